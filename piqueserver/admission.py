@@ -0,0 +1,114 @@
+"""
+Admission control for the raw UDP datagrams the server receives, before enet
+or the HELLO/HELLOLAN replies handle them.
+
+Every source IP gets a token bucket that refills at a fixed rate, and a
+datagram is only let through if its bucket has a token left. An optional
+bucket shared by all sources caps the total, so that the server cannot be
+used to reflect floods of queries with spoofed sources. The IPs that ran out
+of tokens are kept in a bounded list of offenders.
+"""
+
+from collections import OrderedDict
+from time import monotonic
+from typing import Dict, Optional
+
+from twisted.logger import Logger
+
+log = Logger()
+
+# number of source IPs that buckets are kept for. The least recently seen are
+# dropped first, and get a full bucket if they come back
+MAX_SOURCES = 4096
+# number of offending IPs that are kept
+MAX_OFFENDERS = 256
+
+
+class TokenBucket:
+    __slots__ = ('tokens', 'stamp')
+
+    def __init__(self, tokens: float, stamp: float) -> None:
+        self.tokens = tokens
+        self.stamp = stamp
+
+    def take(self, now: float, rate: float, burst: float) -> bool:
+        """refills the bucket and takes one token from it, if it has one"""
+        tokens = self.tokens + (now - self.stamp) * rate
+        if tokens > burst:
+            tokens = burst
+        self.stamp = now
+        if tokens < 1:
+            self.tokens = tokens
+            return False
+        self.tokens = tokens - 1
+        return True
+
+
+class AdmissionControl:
+    """
+    Token buckets for the datagrams of each source IP, allowing rate
+    datagrams per second with bursts of up to burst datagrams.
+    """
+
+    def __init__(self, name: str, rate: float, burst: float,
+                 total_rate: Optional[float] = None,
+                 total_burst: Optional[float] = None,
+                 max_sources: int = MAX_SOURCES,
+                 max_offenders: int = MAX_OFFENDERS) -> None:
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.total_rate = total_rate
+        self.total_burst = total_burst or total_rate
+        # shared by all sources, created on the first datagram
+        self.total = None  # type: Optional[TokenBucket]
+        self.max_sources = max_sources
+        self.max_offenders = max_offenders
+        # host -> bucket, least recently seen first
+        self.buckets = OrderedDict()  # type: Dict[str, TokenBucket]
+        # host -> dropped datagrams, least recently dropped first
+        self.offenders = OrderedDict()  # type: Dict[str, int]
+        self.admitted = 0
+        self.dropped = 0
+        self.dropped_total = 0
+
+    def admit(self, host: str, now: Optional[float] = None) -> bool:
+        """returns whether a datagram from host should be handled"""
+        if now is None:
+            now = monotonic()
+        buckets = self.buckets
+        bucket = buckets.get(host)
+        if bucket is None:
+            bucket = buckets[host] = TokenBucket(self.burst, now)
+            if len(buckets) > self.max_sources:
+                buckets.popitem(last=False)
+        else:
+            buckets.move_to_end(host)
+        if not bucket.take(now, self.rate, self.burst):
+            self.dropped += 1
+            self.add_offender(host)
+            return False
+        if self.total_rate is not None:
+            total = self.total
+            if total is None:
+                total = self.total = TokenBucket(self.total_burst, now)
+            if not total.take(now, self.total_rate, self.total_burst):
+                self.dropped_total += 1
+                return False
+        self.admitted += 1
+        return True
+
+    def add_offender(self, host: str) -> None:
+        offenders = self.offenders
+        count = offenders.pop(host, None)
+        if count is None:
+            log.info('{host} is sending more than {rate} {name} per second',
+                     host=host, rate=self.rate, name=self.name)
+            count = 0
+            if len(offenders) >= self.max_offenders:
+                offenders.popitem(last=False)
+        offenders[host] = count + 1
+
+    def reset(self) -> None:
+        self.buckets.clear()
+        self.offenders.clear()
@@ -15,12 +15,45 @@
 # You should have received a copy of the GNU General Public License
 # along with pyspades.  If not, see <http://www.gnu.org/licenses/>.
 
+import gzip
+import hashlib
 import json
+import os
+import zlib
+from collections import deque
 
 from twisted.internet import reactor
 from twisted.web import server
 from twisted.web.resource import Resource
 
+from piqueserver.utils import matches_etag
+
+# number of past updates that deltas can be requested from
+DELTA_HISTORY = 32
+
+# content codings that are served, in order of preference
+ENCODINGS = {
+    'gzip': gzip.compress,
+    'deflate': zlib.compress,
+}
+
+
+def get_accepted_encodings(header):
+    """returns the content codings of an Accept-Encoding header that are not
+    refused with q=0"""
+    accepted = set()
+    for part in header.split(','):
+        coding, _, params = part.partition(';')
+        params = params.replace(' ', '')
+        if params.startswith('q='):
+            try:
+                if float(params[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(coding.strip().lower())
+    return accepted
+
 
 class PublishResource(Resource):
 
@@ -33,21 +66,121 @@ class PublishResource(Resource):
 
     def render_GET(self, request):
         request.defaultContentType = "application/json"
-        return bytes(self.factory.json_bans, "utf-8")
+        factory = self.factory
+        request.setHeader("X-Bans-Version", str(factory.version))
+        since = request.args.get(b"since")
+        if since:
+            delta = factory.get_delta(since[0])
+            if delta is not None:
+                return delta
+
+        header = request.getHeader("Accept-Encoding") or ""
+        accepted = get_accepted_encodings(header)
+        encoding = next((name for name in ENCODINGS if name in accepted),
+                        "identity")
+        request.setHeader("Vary", "Accept-Encoding")
+        etag = factory.get_etag(encoding)
+        request.setHeader("ETag", etag)
+        if matches_etag(request.getHeader("If-None-Match") or "", etag):
+            request.setResponseCode(304)
+            return b""
+        if encoding != "identity":
+            request.setHeader("Content-Encoding", encoding)
+        return factory.get_body(encoding)
 
 
 class PublishServer:
+    """
+    Serves the ban list as JSON. The body is built when the ban list changes,
+    and compressed once for each content coding the first time it is asked
+    for. Responses carry a strong ETag, so subscribers that send it back in
+    If-None-Match get a 304 while the list is unchanged.
+
+    Every change of the list gets a new version, sent in the X-Bans-Version
+    header as ``<run id>-<number>``. Requesting ``?since=<version>`` returns
+    the changes since that version as ``{"version": ..., "added": [...],
+    "removed": [...]}``, or the whole list if the version is too old or from
+    before a restart.
+    """
 
     def __init__(self, protocol, port):
         self.protocol = protocol
+        # differs between runs, whose versions are not comparable
+        self.run_id = os.urandom(4).hex()
+        self.serial = 0
+        # ip -> {"ip": ..., "reason": ...}
+        self.bans = {}
+        # (version, added, removed) of the last updates
+        self.deltas = deque(maxlen=DELTA_HISTORY)
+        self.json_bans = None
+        self.bodies = {}
+        self.digest = None
         publish_resource = PublishResource(self)
         site = server.Site(publish_resource)
         protocol.listenTCP(port, site)
         self.update()
 
     def update(self):
-        bans = []
+        bans = {}
+        now = reactor.seconds()
         for (network, _name, reason, timestamp) in self.protocol.ban_manager.get_all_bans():
-            if timestamp is None or reactor.seconds() < timestamp:
-                bans.append({"ip": str(network), "reason": reason})
-        self.json_bans = json.dumps(bans)
+            if timestamp is None or now < timestamp:
+                ip = str(network)
+                bans[ip] = {"ip": ip, "reason": reason}
+        if self.json_bans is not None and bans == self.bans:
+            return
+        added = [ban for ip, ban in bans.items() if self.bans.get(ip) != ban]
+        removed = [ip for ip in self.bans if ip not in bans]
+        self.serial += 1
+        self.deltas.append((self.serial, added, removed))
+        self.bans = bans
+        self.json_bans = json.dumps(list(bans.values()))
+        body = self.json_bans.encode("utf-8")
+        self.bodies = {"identity": body}
+        self.digest = hashlib.sha1(body).hexdigest()
+
+    @property
+    def version(self):
+        return '{}-{}'.format(self.run_id, self.serial)
+
+    def get_etag(self, encoding):
+        # a compressed body is a different representation, with its own
+        # strong ETag
+        if encoding == "identity":
+            return '"{}"'.format(self.digest)
+        return '"{}-{}"'.format(self.digest, encoding)
+
+    def get_body(self, encoding):
+        body = self.bodies.get(encoding)
+        if body is None:
+            body = self.bodies[encoding] = ENCODINGS[encoding](
+                self.bodies["identity"])
+        return body
+
+    def get_delta(self, since):
+        """returns the changes since a version as JSON, or None if they are
+        not kept anymore"""
+        run_id, _, since = since.decode("utf-8", "replace").rpartition("-")
+        if run_id != self.run_id:
+            return None
+        try:
+            since = int(since)
+        except ValueError:
+            return None
+        # the first delta kept is the change from the version before it
+        if since > self.serial or since < self.deltas[0][0] - 1:
+            return None
+        added = {}
+        removed = set()
+        for version, version_added, version_removed in self.deltas:
+            if version <= since:
+                continue
+            for ban in version_added:
+                added[ban["ip"]] = ban
+                removed.discard(ban["ip"])
+            for ip in version_removed:
+                added.pop(ip, None)
+                removed.add(ip)
+        return json.dumps({"version": self.version,
+                           "added": list(added.values()),
+                           "removed": sorted(removed)}).encode("utf-8")
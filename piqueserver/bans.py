@@ -2,16 +2,18 @@ import abc
 from typing import Tuple, Optional, List
 
 import os
+import heapq
+import itertools
 import json
 import time
 from ipaddress import IPv4Network, ip_address, ip_network
 from twisted.logger import Logger
-from twisted.internet import reactor
-from twisted.internet.task import LoopingCall, coiterate
+from twisted.internet import reactor, threads
+from twisted.internet.task import LoopingCall
 from pyspades.common import prettify_timespan
 from piqueserver.utils import ensure_dir_exists
-from piqueserver.networkdict import NetworkDict
-from piqueserver.config import config
+from piqueserver.networkdict import NetworkDict, get_cidr
+from piqueserver.config import cast_duration, config
 
 
 # network, name, reason, duration
@@ -20,6 +22,10 @@ Ban = Tuple[IPv4Network, str, str, Optional[int]]
 
 log = Logger()
 
+# minimum time between two runs of vacuum_bans, so that bans expiring close to
+# each other are removed and saved together
+EXPIRY_INTERVAL = 10
+
 
 # i would REALLY like to make this async, but i'm not totally sure that's feasible atm - muffin
 class BaseBanManager(abc.ABC):
@@ -58,11 +64,11 @@ class BaseBanManager(abc.ABC):
         pass
 
     @abc.abstractmethod
-    def add_ban(self, network, name, reason, duration) -> Optional[str]:
+    def add_ban(self, network, name, reason, duration, admin=None) -> Optional[str]:
         """
         Add an IP/network to the ban database.
 
-        name, reason and duration may be None.
+        name, reason, duration and admin may be None.
 
         Returns an optional error string message. Not an exception as they're non-fatal errors
         """
@@ -129,17 +135,174 @@ class BaseBanManager(abc.ABC):
         self.protocol.broadcast_chat(message, irc=True)
 
 
+def write_snapshot(path, items):
+    """writes a ban list, as (network, value) items of a NetworkDict, to a
+    temporary file and renames it over the bans file, so that the file is
+    never left half written"""
+    ensure_dir_exists(path)
+    temp_path = path + '.tmp'
+    bans = [[value[0], get_cidr(network), *value[1:]]
+            for network, value in items]
+    with open(temp_path, 'w') as f:
+        json.dump(bans, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+    return len(bans)
+
+
+class BanJournal:
+    """
+    Append-only log of the changes to a ban list, kept next to the bans file.
+
+    Each change is written as one JSON record per line, so saving a ban does
+    not rewrite the whole list. From time to time the journal is compacted:
+    the list is written to the bans file in a worker thread, see
+    write_snapshot(). The changes made meanwhile go to a new journal, and the
+    old one is only deleted once the new bans file is in place, so loading the
+    bans file and then the journals always gives the latest list.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.journal_path = path + '.journal'
+        # journal of a compaction in progress, or one that failed
+        self.old_path = path + '.journal.old'
+        self.file = None
+        self.records = 0
+        self.compacting = None
+        self.compact_again = False
+
+    def load(self, database) -> int:
+        """applies the changes in the journals to a list loaded from the bans
+        file and returns how many there were"""
+        count = 0
+        for path in (self.old_path, self.journal_path):
+            try:
+                f = open(path, 'r')
+            except FileNotFoundError:
+                continue
+            with f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # the last record is cut off if the server stopped
+                        # while writing it
+                        log.warn(f'Skipping invalid record in {path}: {line!r}')
+                        continue
+                    if 'add' in record:
+                        name, network, reason, expiry = record['add']
+                        database[network] = [name, reason, expiry]
+                    else:
+                        database.discard(record['remove'])
+                    count += 1
+        self.records = count
+        return count
+
+    def append(self, added=(), removed=()):
+        """writes the records of a change: added is a list of (network, value)
+        and removed a list of networks"""
+        if self.file is None:
+            ensure_dir_exists(self.journal_path)
+            self.file = open(self.journal_path, 'a')
+        lines = []
+        for network, value in added:
+            lines.append(json.dumps(
+                {'add': [value[0], str(network), *value[1:]]}))
+        for network in removed:
+            lines.append(json.dumps({'remove': str(network)}))
+        if not lines:
+            return
+        self.file.write('\n'.join(lines) + '\n')
+        self.file.flush()
+        self.records += len(lines)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def rotate(self):
+        """moves the journal out of the way of the changes made during a
+        compaction"""
+        self.close()
+        if not os.path.exists(self.journal_path):
+            return
+        if not os.path.exists(self.old_path):
+            os.replace(self.journal_path, self.old_path)
+            return
+        # a previous compaction failed, keep its records too
+        with open(self.journal_path, 'r') as src, \
+                open(self.old_path, 'a') as dst:
+            dst.write(src.read())
+        os.remove(self.journal_path)
+
+    def needs_compaction(self) -> bool:
+        return self.compacting is None and (
+            self.records > 0 or os.path.exists(self.old_path))
+
+    def compact(self, database):
+        """writes the list to the bans file in a worker thread and returns a
+        Deferred that fires with the number of bans written"""
+        if self.compacting is not None:
+            # the list changed since the running compaction took its copy
+            self.compact_again = True
+            return self.compacting
+        self.rotate()
+        self.records = 0
+        start_time = reactor.seconds()
+        # copying the items is quick, formatting them is left to the thread
+        items = list(database.networks.items())
+
+        def done(count):
+            self.compacting = None
+            try:
+                os.remove(self.old_path)
+            except FileNotFoundError:
+                pass
+            log.debug(f'Compacting {count} bans took '
+                      f'{reactor.seconds() - start_time :.2f} seconds')
+            if self.compact_again:
+                self.compact_again = False
+                self.compact(database)
+            return count
+
+        def failed(failure):
+            self.compacting = None
+            self.compact_again = False
+            log.error(f'Could not write bans file ({self.path}): '
+                      f'{failure.getErrorMessage()}')
+
+        self.compacting = threads.deferToThread(
+            write_snapshot, self.path, items)
+        self.compacting.addCallbacks(done, failed)
+        return self.compacting
+
+
 class DefaultBanManager(BaseBanManager):
     """
     Ban manager that uses a NetworkDict as its database and saves to a local bans.txt JSON file
+
+    With the journal option, changes are appended to a journal next to the
+    file instead of rewriting it, see BanJournal.
+
+    Timed bans are also kept in a heap by expiry, with a timer for the next
+    one to expire. The heap is not updated when a ban is removed, its entries
+    are checked against the database when they come up.
     """
 
+    journal = None
+
     def __init__(self, protocol):
         super().__init__(protocol)
 
         self.database = NetworkDict()
         bans_config = config.section('bans')
         self.bans_file = bans_config.option('file', default = 'bans.txt')
+        journal = bans_config.option('journal', default=False)
+        compact_interval = bans_config.option(
+            'journal_compact_interval', default='5min', cast=cast_duration)
 
         # attempt to load a saved bans list
         try:
@@ -152,29 +315,43 @@ class DefaultBanManager(BaseBanManager):
             log.error(f'Could not read bans file ({self.bans_file.get()}): {e}')
         except ValueError as e:
             log.error(f'Could not parse bans file ({self.bans_file.get()}): {e}')
-            
-        self.vacuum_loop = LoopingCall(self.vacuum_bans)
-        # Run the vacuum every 6 hours, and kick it off it right now
-        self.vacuum_loop.start(60 * 60 * 6, True)
+
+        if journal.get():
+            self.journal = BanJournal(
+                os.path.join(config.config_dir, self.bans_file.get()))
+            try:
+                count = self.journal.load(self.database)
+                log.debug(f'Applied {count} changes from the bans journal')
+            except (IOError, ValueError, KeyError) as e:
+                log.error(f'Could not read bans journal: {e}')
+            self.compact_loop = LoopingCall(self.compact_bans)
+            self.compact_loop.start(compact_interval.get(), False)
+
+        # (expiry, sequence number, network), the sequence number keeps
+        # networks of different IP versions from being compared
+        self.expiry_counter = itertools.count()
+        self.expiry_heap = [
+            (value[2], next(self.expiry_counter), network)
+            for network, value in self.database.networks.items()
+            if value[2] is not None]
+        heapq.heapify(self.expiry_heap)
+        self.expiry_call = None
+        self.expiry_time = None
+        self.last_vacuum = 0
+        # removes the bans that expired while the server was down right away
+        self.arm_expiry_timer()
 
     def ban_overlaps(self, network) -> Optional[IPv4Network]:
         network1 = ip_network(str(network), strict=False)
-        n1_from = int(network1[0])
-        n1_to = int(network1[-1])
-    
+
         if network1.num_addresses == 1:
             # a single IP cannot overlap any network
             return False
-    
-        for network2 in self.database.networks.keys():
-            n2_from = int(network2[0])
-            n2_to = int(network2[-1])
-    
-            if (n2_from != n2_to and
-                (n2_from <= n1_from <= n2_to or
-                 n1_from <= n2_from <= n1_to)):
+
+        for network2 in self.database.get_overlaps(network1):
+            if network2.num_addresses != 1:
                 return network2
-    
+
         return None
 
     def get_ban(self, network) -> Optional[Ban]:
@@ -189,20 +366,8 @@ class DefaultBanManager(BaseBanManager):
             # a single IP cannot contain any other networks
             return []
 
-        n1_from = int(network1[0])
-        n1_to = int(network1[-1])
-        contained = []
-
-        for network2 in self.database.networks.keys():
-            if network1 == network2:
-                continue
-
-            n2_from = int(network2[0])
-            n2_to = int(network2[-1])
-            if n1_from <= n2_from and n2_to <= n1_to:
-                contained.append(network2)
-
-        return contained
+        return [network2 for network2 in self.database.get_subnets(network1)
+                if network2 != network1]
 
     def get_all_bans(self) -> List[Ban]:
         results = []
@@ -210,7 +375,7 @@ class DefaultBanManager(BaseBanManager):
             results.append((network, *value))
         return results
 
-    def add_ban(self, network, name, reason, duration) -> Optional[str]:
+    def add_ban(self, network, name, reason, duration, admin=None) -> Optional[str]:
         """
         Ban an ip with an optional reason and duration in seconds. If duration
         is None, ban is permanent.
@@ -232,32 +397,62 @@ class DefaultBanManager(BaseBanManager):
             duration = time.time() + duration
         else:
             duration = None
-        self.database[network] = (name or '(unknown)', reason, duration)
-        self.save_bans()
+        value = (name or '(unknown)', reason, duration)
+        self.database[network] = value
+        self.schedule_expiry(network, duration)
+        self.save_change(added=[(network, value)])
         return None
 
     def remove_ban(self, network) -> int:
         network = ip_network(str(network), strict=False)
         to_remove = [network] + self.get_contained_bans(network)
-        amount_removed = 0
+        removed = []
         for net in to_remove:
             results = self.database.remove(net)
             log.info(f'Removing banned network: {net} {results}')
-            amount_removed += len(results)
-        self.save_bans()
-        return amount_removed
+            removed.extend(network for network, _ in results)
+        self.save_change(removed=removed)
+        return len(removed)
 
     def undo_ban(self) -> Optional[Ban]:
         try:
             result = self.database.pop()
             network = ip_network(result[0])
             log.info(f'Removing banned network: {network} {result[1]}')
-            self.save_bans()
+            self.save_change(removed=[network])
             return (network, *result[1])
         except KeyError:
             return None
 
+    def save_change(self, added=(), removed=()):
+        """
+        Saves a change that was made to the database: added is a list of
+        (network, value) and removed a list of networks. Without the journal
+        this saves the whole list.
+        """
+        if self.journal is None:
+            self.save_bans()
+            return
+        try:
+            self.journal.append(added, removed)
+        except IOError as e:
+            log.error(f'Could not write bans journal: {e}')
+            self.journal.compact(self.database)
+        self.banpublish_update()
+
+    def compact_bans(self):
+        """writes the bans file if the journal has changes since the last
+        time"""
+        if self.journal.needs_compaction():
+            self.journal.compact(self.database)
+
     def save_bans(self):
+        if self.journal is not None:
+            # write the whole list, but off the reactor thread
+            self.journal.compact(self.database)
+            self.banpublish_update()
+            return
+
         ban_file = os.path.join(config.config_dir, self.bans_file.get())
         ensure_dir_exists(ban_file)
 
@@ -268,31 +463,113 @@ class DefaultBanManager(BaseBanManager):
 
         self.banpublish_update()
 
-    def vacuum_bans(self):
-        """remove any bans that might have expired. This takes a while, so it is
-        split up over the event loop"""
-
-        def do_vacuum_bans():
-            """do the actual clearing of bans"""
-
-            bans_count = len(self.database)
-            log.info(f'starting ban vacuum with {bans_count} bans')
-            start_time = time.time()
-
-            # create a copy of the items, so we don't have issues modifying
-            # while iteraing
-            for ban in list(self.database.iteritems()):
-                ban_expiry = ban[1][2]
-                if ban_expiry is None:
-                    # entry never expires
-                    continue
-                if ban[1][2] < start_time:
-                    # expired
-                    del self.database[ban[0]]
-                yield
-            log.debug(f'Ban vacuum took {time.time() - start_time :.2f} seconds, removed {bans_count - len(self.database)} bans')
-            self.save_bans()
+    def schedule_expiry(self, network, expiry):
+        """removes the ban of network at the given time"""
+        if expiry is None:
+            return
+        heapq.heappush(self.expiry_heap,
+                       (expiry, next(self.expiry_counter), network))
+        self.arm_expiry_timer()
+
+    def arm_expiry_timer(self):
+        """sets the timer of vacuum_bans for the next ban to expire"""
+        if not self.expiry_heap:
+            return
+        when = max(self.expiry_heap[0][0], self.last_vacuum + EXPIRY_INTERVAL)
+        if self.expiry_call is not None and self.expiry_call.active():
+            if self.expiry_time <= when:
+                return
+            self.expiry_call.cancel()
+        self.expiry_time = when
+        self.expiry_call = reactor.callLater(max(when - time.time(), 0),
+                                             self.vacuum_bans)
+
+    def vacuum_bans(self) -> List[IPv4Network]:
+        """removes the bans that expired, saves the change and returns the
+        removed networks"""
+        self.expiry_call = None
+        now = self.last_vacuum = time.time()
+        removed = []
+        heap = self.expiry_heap
+        while heap and heap[0][0] <= now:
+            expiry, _, network = heapq.heappop(heap)
+            value = self.database.networks.get(network)
+            if value is None or value[2] != expiry:
+                # removed, or banned again with another duration
+                continue
+            self.database.discard(network)
+            removed.append(network)
+        if removed:
+            log.info(f'Removed {len(removed)} expired bans')
+            self.save_change(removed=removed)
+        self.arm_expiry_timer()
+        return removed
+
+
+class SupervisedBanManager(DefaultBanManager):
+    """
+    Ban manager used by workers in supervisor mode. It keeps a replica of the
+    supervisor's ban list, sends local changes to the supervisor and applies
+    the changes made on the other workers.
+    """
+
+    def __init__(self, protocol):
+        BaseBanManager.__init__(self, protocol)
+        self.database = NetworkDict()
+        self.client = protocol.supervisor_client
+        self.client.handlers.update(
+            bans=self.on_bans,
+            ban_added=self.on_ban_added,
+            bans_removed=self.on_bans_removed)
+
+    def add_ban(self, network, name, reason, duration, admin=None) -> Optional[str]:
+        error = super().add_ban(network, name, reason, duration, admin)
+        if error is None:
+            network = ip_network(str(network), strict=False)
+            name, reason, expiry = self.database.networks[network]
+            self.client.send('add_ban', ban=[name, str(network), reason, expiry])
+        return error
+
+    def remove_ban(self, network) -> int:
+        before = set(self.database.networks)
+        amount_removed = super().remove_ban(network)
+        self.send_removed(before)
+        return amount_removed
+
+    def undo_ban(self) -> Optional[Ban]:
+        before = set(self.database.networks)
+        result = super().undo_ban()
+        self.send_removed(before)
+        return result
+
+    def send_removed(self, before):
+        removed = before.difference(self.database.networks)
+        if removed:
+            self.client.send('remove_bans',
+                             networks=[str(network) for network in removed])
+
+    def schedule_expiry(self, network, expiry):
+        # the supervisor removes expired bans and tells the workers
+        pass
+
+    def save_bans(self):
+        # the supervisor owns the bans file
+        self.banpublish_update()
+
+    def on_bans(self, message):
+        self.database = NetworkDict()
+        self.database.read_list(message['bans'])
+        log.debug(f'Received {len(self.database)} bans from supervisor')
+        self.banpublish_update()
 
-        # TODO: use cooperate() here instead, once you figure out why it's
-        # swallowing errors. Perhaps try add an errback?
-        coiterate(do_vacuum_bans())
+    def on_ban_added(self, message):
+        name, network, reason, expiry = message['ban']
+        network = ip_network(network, strict=False)
+        self.database[network] = [name, reason, expiry]
+        self.kick_network(network)
+        self.banpublish_update()
+
+    def on_bans_removed(self, message):
+        for network in message['networks']:
+            self.database.discard(network)
+        self.banpublish_update()
@@ -16,20 +16,30 @@
 # along with pyspades.  If not, see <http://www.gnu.org/licenses/>.
 
 import asyncio
+import codecs
 import json
-from itertools import chain
-from typing import List
+import re
+from typing import Any, Dict, List, Optional, Tuple
 
 import aiohttp
 from twisted.logger import Logger
 
 from piqueserver.config import cast_duration, config
-from piqueserver.networkdict import NetworkDict
+from piqueserver.networkdict import NetworkRanges, parse_network
 
 log = Logger()
 
 # format is [{"ip" : "1.1.1.1", "reason : "blah"}, ...]
 
+# bytes of a list read at a time
+CHUNK_SIZE = 64 * 1024
+
+WHITESPACE = re.compile(r'\s*')
+SEPARATORS = re.compile(r'[\s,]*')
+
+# (version, address, prefix length), see parse_network
+Network = Tuple[int, int, int]
+
 
 def validate_bansub_config(c):
     if not isinstance(c, list):
@@ -47,47 +57,179 @@ bans_config_interval = bans_config.option('bansubscribe_interval', default="5min
                                           cast=cast_duration)
 
 
+class JSONArrayParser:
+    """
+    Parses a JSON array as its text arrives and returns each item once it is
+    complete, so that the text of a large list is never held all at once.
+    """
+
+    def __init__(self):
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.started = False
+        self.finished = False
+
+    def feed(self, text: str, final: bool = False) -> List[Any]:
+        """returns the items that were completed by text. With final, the
+        text has to end the array"""
+        buffer = self.buffer + text
+        items = []
+        pos = 0
+        if not self.started:
+            pos = WHITESPACE.match(buffer).end()
+            if pos < len(buffer):
+                if buffer[pos] != '[':
+                    raise ValueError('expected a JSON array')
+                self.started = True
+                pos += 1
+        while self.started and not self.finished:
+            pos = SEPARATORS.match(buffer, pos).end()
+            if pos == len(buffer):
+                break
+            if buffer[pos] == ']':
+                self.finished = True
+                pos += 1
+                break
+            try:
+                item, end = self.decoder.raw_decode(buffer, pos)
+            except ValueError:
+                if final:
+                    raise
+                # the rest of the item is in the next chunk
+                break
+            if end == len(buffer) and not final:
+                # a number could go on in the next chunk
+                break
+            items.append(item)
+            pos = end
+        self.buffer = buffer[pos:]
+        if final and not self.finished:
+            raise ValueError('unterminated JSON array')
+        return items
+
+
+class Subscription:
+    """what was received from a subscribed list, to fetch it again only if it
+    changed"""
+
+    def __init__(self):
+        self.etag = None  # type: Optional[str]
+        self.last_modified = None  # type: Optional[str]
+        self.bans = {}  # type: Dict[Network, str]
+
+
 class BanSubscribeManager:
+    """
+    Downloads the subscribed lists and keeps the bans of all of them in one
+    NetworkRanges.
+
+    The lists are requested with the validators of the last response, so an
+    unchanged list is not sent again. When a list did change, only the
+    networks that were added or removed since the last time are merged into
+    the index. A list that cannot be fetched keeps its previous bans.
+    """
+
     bans = None
 
     def __init__(self, protocol):
         self.protocol = protocol
         self.urls = [(entry.get('url'), entry.get('whitelist')) for entry in
                      bans_config_urls.get()]
+        self.subscriptions = {}  # type: Dict[str, Subscription]
 
     async def start(self):
         while True:
             await self.update_bans()
             await asyncio.sleep(bans_config_interval.get())
 
-    async def fetch_filtered_bans(self, url: str, whitelist: List[str]):
+    async def fetch_filtered_bans(self, url: str, whitelist: List[str]
+                                  ) -> Optional[Dict[Network, str]]:
+        """returns the bans of a list, or None if it did not change since the
+        last time or could not be fetched"""
+        subscription = self.subscriptions.setdefault(url, Subscription())
+        headers = {}
+        if subscription.etag is not None:
+            headers['If-None-Match'] = subscription.etag
+        if subscription.last_modified is not None:
+            headers['If-Modified-Since'] = subscription.last_modified
+        bans = {}
+
+        def add_bans(items):
+            for ban in items:
+                if ban.get('name', None) in whitelist:
+                    continue
+                try:
+                    network = parse_network(ban['ip'], strict=False)
+                except (KeyError, ValueError):
+                    log.warn("Invalid ban from {url}: {ban}", url=url, ban=ban)
+                    continue
+                bans[network] = ban.get('reason')
+
         try:
             async with aiohttp.ClientSession() as session:
-                async with session.get(url) as resp:
+                async with session.get(url, headers=headers) as resp:
+                    if resp.status == 304:
+                        return None
+                    resp.raise_for_status()
                     # blacklist.spadille.net doesn't set json content type ¯\_(ツ)_/¯
-                    banslist = json.loads(await resp.text())
-                    return [ban for ban in banslist if ban.get('name', None) not in whitelist]
+                    parser = JSONArrayParser()
+                    decoder = codecs.getincrementaldecoder(
+                        resp.charset or 'utf-8')()
+                    async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+                        add_bans(parser.feed(decoder.decode(chunk)))
+                    add_bans(parser.feed(decoder.decode(b'', True), True))
+                    subscription.etag = resp.headers.get('ETag')
+                    subscription.last_modified = resp.headers.get(
+                        'Last-Modified')
+                    return bans
         except Exception as e:
             log.error("Failed to fetch bans from {url}: {err}", url=url, err=e)
-            return []
+            return None
 
     async def update_bans(self):
+        urls = self.urls
         coros = []
-        for url, whitelist in self.urls:
+        for url, whitelist in urls:
             coros.append(self.fetch_filtered_bans(url, whitelist))
         log.info("fetching bans from bansubscribe urls")
         banlists = await asyncio.gather(*coros)
-        bans = list(chain(*banlists))
-        new_bans = NetworkDict()
-        for ban in bans:
-            new_bans[ban['ip']] = ban['reason']
-        self.bans = new_bans
-        log.info("successfully updated bans from bansubscribe urls")
+
+        changed = set()
+        for (url, _), bans in zip(urls, banlists):
+            if bans is None:
+                continue
+            subscription = self.subscriptions[url]
+            old = subscription.bans
+            changed.update(old.keys() ^ bans.keys())
+            changed.update(network for network, reason in bans.items()
+                           if network in old and old[network] != reason)
+            subscription.bans = bans
+        subscribed = {url for url, _ in urls}
+        for url in list(self.subscriptions):
+            if url not in subscribed:
+                changed.update(self.subscriptions.pop(url).bans)
+
+        if self.bans is not None and not changed:
+            log.info("bansubscribe lists did not change")
+            return
+        # the first list that has a network gives the reason
+        lists = [self.subscriptions[url].bans for url, _ in urls
+                 if url in self.subscriptions]
+        added = {}
+        removed = []
+        for network in changed:
+            for bans in lists:
+                if network in bans:
+                    added[network] = bans[network]
+                    break
+            else:
+                removed.append(network)
+        self.bans = (self.bans or NetworkRanges()).update(added, removed)
+        log.info("successfully updated bans from bansubscribe urls: "
+                 "{added} added, {removed} removed",
+                 added=len(added), removed=len(removed))
 
     def get_ban(self, ip):
         if self.bans is None:
             return None
-        try:
-            return self.bans[ip]
-        except KeyError:
-            return None
+        return self.bans.get(ip)
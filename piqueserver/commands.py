@@ -24,7 +24,7 @@ import warnings
 from collections import namedtuple
 import textwrap
 import functools
-from typing import Awaitable, Dict, List, Callable
+from typing import Awaitable, Dict, List, Callable, NamedTuple, Optional
 
 from twisted.logger import Logger
 
@@ -45,6 +45,42 @@ class PermissionDenied(Exception):
     pass
 
 
+class CommandSpec(NamedTuple):
+    """number of parameters a command takes, not counting the connection"""
+    min_params: int
+    # None if the command takes any number of parameters
+    max_params: Optional[int]
+
+
+def get_command_spec(function: Callable) -> CommandSpec:
+    argspec = inspect.signature(function, follow_wrapped=False)
+
+    # all args
+    positional_args = [
+        param for param in argspec.parameters.values()
+        if param.kind == param.POSITIONAL_ONLY or
+           param.kind == param.POSITIONAL_OR_KEYWORD
+    ]
+
+    # we need to subtract 1 for the first argument which is always connection
+    min_params = len([
+        param for param in positional_args
+        if param.default == inspect._empty
+    ]) - 1
+
+    # check if we have a 'rest' arg
+    vararg = next((
+        param for param in argspec.parameters.values()
+        if param.kind == param.VAR_POSITIONAL
+    ), None)
+
+    if vararg is not None:
+        max_params = None
+    else:
+        max_params = max(0, len(positional_args) - 1)
+    return CommandSpec(min_params, max_params)
+
+
 def command(name=None, *aliases,
             admin_only=False) -> Callable[[Callable], Callable]:
     """
@@ -73,6 +109,8 @@ def command(name=None, *aliases,
             name = function.__name__
 
         function.command_name = name
+        # so the signature isn't inspected on every call
+        function.command_spec = get_command_spec(function)
 
         _commands[name] = function
 
@@ -269,10 +307,9 @@ def get_player(protocol, value: str, spectators=True):
             player_obj = protocol.players[value]
         else:
             players = protocol.players
-            try:
-                player_obj = players[value]
-            except KeyError:
-                value = value.lower()
+            value = value.lower()
+            player_obj = protocol.player_names.get(value)
+            if player_obj is None:
                 matches = []
                 for player in players.values():
                     name = player.name.lower()
@@ -384,32 +421,16 @@ async def _handle_command(connection, command, parameters):
     if not has_permission(command_func, connection):
         return "You can't use this command"
 
-    argspec = inspect.signature(command_func, follow_wrapped=False)
-
-    # all args
-    positional_args = [
-        param for param in argspec.parameters.values()
-        if param.kind == param.POSITIONAL_ONLY or
-           param.kind == param.POSITIONAL_OR_KEYWORD
-    ]
-
-    # we need to subtract 1 for the first argument which is always connection
-    min_params = len([
-        param for param in positional_args
-        if param.default == inspect._empty
-    ]) - 1
-
-    # check if we have a 'rest' arg
-    vararg = next((
-        param for param in argspec.parameters.values()
-        if param.kind == param.VAR_POSITIONAL
-    ), None)
+    try:
+        spec = command_func.command_spec
+    except AttributeError:
+        # added to _commands without @command
+        spec = command_func.command_spec = get_command_spec(command_func)
 
-    max_params = max(0, len(positional_args) - 1)
     len_params = len(parameters)
 
-    if len_params < min_params or \
-       (vararg is None and len_params > max_params):
+    if len_params < spec.min_params or \
+       (spec.max_params is not None and len_params > spec.max_params):
         return format_command_error(
             command_func, 'Invalid number of arguments')
 
@@ -8,5 +8,5 @@ from .moderation import (get_ban_arguments, kick, ban, hban, dban, pban, banip,
                          invisible, godsilent, god, god_build)
 from .movement import unstick, move_silent, move, where, teleport, tpsilent, fly
 from .player import client, weapon, intel, kill, heal, deaf
-from .server import server_name, server_info, version, scripts, toggle_master
+from .server import server_name, server_info, version, scripts, toggle_master, tick_stats, hook_stats
 from .social import login, pm, to_admin
@@ -4,6 +4,7 @@ import sys
 from twisted.logger import Logger
 
 from piqueserver.commands import command, join_arguments
+from piqueserver.hooks import hook_profiler
 
 log = Logger()
 
@@ -77,3 +78,42 @@ def toggle_master(connection):
     protocol.irc_say("* %s " % connection.name + message)
     if connection in connection.protocol.players.values():
         return "You " + message
+
+
+@command('tickstats', admin_only=True)
+def tick_stats(connection, value=None):
+    """
+    Tell you how long the server's update loop takes per tick
+    /tickstats [reset]
+    """
+    profiler = connection.protocol.profiler
+    if value == 'reset':
+        profiler.reset()
+        return 'Tick statistics reset'
+    tick = profiler.ticks.summary()
+    phase, histogram = max(profiler.phases.items(),
+                           key=lambda item: item[1].percentile(0.99))
+    return ('Tick ms p50 {:.2f} p99 {:.2f} max {:.2f}, {} slow ticks, '
+            'slowest phase {} (p99 {:.2f} ms)'.format(
+                tick['p50'], tick['p99'], tick['max'], profiler.slow_ticks,
+                phase, histogram.percentile(0.99) * 1000))
+
+
+@command('hookstats', admin_only=True)
+def hook_stats(connection, value=None):
+    """
+    Tell you which scripts' hooks take the most time
+    /hookstats [reset]
+    """
+    if not hook_profiler.enabled:
+        return 'Hook profiling is disabled, see profile_hooks in [logging]'
+    if value == 'reset':
+        hook_profiler.reset()
+        return 'Hook statistics reset'
+    items = hook_profiler.summary(3)
+    if not items:
+        return 'No hooks were called yet'
+    return 'Slowest hooks: ' + ', '.join(
+        '{}.{} x{} {:.1f} ms (max {:.2f})'.format(
+            script, hook, stats.calls, stats.total * 1000, stats.max * 1000)
+        for script, hook, stats in items)
@@ -5,6 +5,8 @@ import importlib.machinery
 
 from twisted.logger import Logger
 
+from piqueserver import hooks
+
 log = Logger()
 
 
@@ -164,7 +166,8 @@ def load_script_game_mode(script_name, script_dir):
     return []
 
 
-def apply_scripts(scripts, config, protocol_class, connection_class):
+def apply_scripts(scripts, config, protocol_class, connection_class,
+                  hook_profiler=None):
     ''' Application of scripts modules
 
     It applies the script modules to the specified protocol and connection class instances, in order to build
@@ -178,13 +181,26 @@ def apply_scripts(scripts, config, protocol_class, connection_class):
          logic
         protocol_class: The protocol class instance to update
         connection_class: The connection class instance to update
+        hook_profiler: If set, a HookProfiler that wraps the hooks each script
+         overrides to measure the time spent in them
 
     Return:
         (FeatureProtocol, FeatureConnection): The updated protocol and connection class instances
     '''
 
+    if hook_profiler is not None:
+        # so that the time spent in the server's own hooks is not counted
+        # towards the lowest script
+        hook_profiler.instrument(hooks.SERVER_NAME, protocol_class, object)
+        hook_profiler.instrument(hooks.SERVER_NAME, connection_class, object)
+
     for script in scripts:
+        base_protocol, base_connection = protocol_class, connection_class
         protocol_class, connection_class = script.apply_script(
             protocol_class, connection_class, config.get_dict())
+        if hook_profiler is not None:
+            name = hooks.get_script_name(script.__name__)
+            hook_profiler.instrument(name, protocol_class, base_protocol)
+            hook_profiler.instrument(name, connection_class, base_connection)
 
     return (protocol_class, connection_class)
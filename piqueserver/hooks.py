@@ -0,0 +1,171 @@
+"""
+Tools for the hooks of the protocol and connection classes, the ``on_*``
+methods that extension scripts override.
+
+The hook registry is only used to check the chains of overrides. Hooks are
+still called through the class hierarchy, see doc/architecture.rst for why
+there is no mode that calls them through the registry.
+"""
+
+import functools
+import inspect
+from time import perf_counter
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from twisted.logger import Logger
+
+log = Logger()
+
+HOOK_PREFIX = 'on_'
+# the name under which the hooks of the server classes are profiled
+SERVER_NAME = 'server'
+
+
+def get_script_name(module_name: str) -> str:
+    """returns the configured name of a script from the name of its module,
+    as loaded by extensions.load_scripts"""
+    return module_name.rsplit('_pique_', 1)[0]
+
+
+def get_overridden_hooks(cls: type, base: type) -> Iterator[
+        Tuple[type, str, Callable]]:
+    """yields (class, name, function) of the hooks defined by the classes
+    that cls adds on top of base"""
+    base_mro = set(base.__mro__)
+    for klass in cls.__mro__:
+        if klass in base_mro:
+            continue
+        for name, value in list(vars(klass).items()):
+            if name.startswith(HOOK_PREFIX) and inspect.isfunction(value):
+                yield klass, name, value
+
+
+def uses_name(code, name: str) -> bool:
+    """returns whether the code, or a function defined in it, looks up the
+    given attribute or global"""
+    if name in code.co_names:
+        return True
+    return any(uses_name(const, name) for const in code.co_consts
+               if inspect.iscode(const))
+
+
+def get_hook_registry(cls: type, base: type) -> Dict[
+        str, List[Tuple[str, Callable]]]:
+    """returns, for each hook overridden by the scripts applied to base to
+    create cls, the (script, function) of the scripts that override it, in
+    the order they are called in"""
+    registry = {}  # type: Dict[str, List[Tuple[str, Callable]]]
+    for klass, name, func in get_overridden_hooks(cls, base):
+        script = get_script_name(klass.__module__)
+        registry.setdefault(name, []).append((script, inspect.unwrap(func)))
+    return registry
+
+
+def get_broken_chains(registry: Dict[str, List[Tuple[str, Callable]]],
+                      base: type) -> Iterator[Tuple[str, str]]:
+    """yields (script, hook) of the hooks that never call the next script's
+    hook, so that the scripts applied before them and the server never see
+    the call"""
+    for name, scripts in registry.items():
+        # hooks that scripts add themselves have nothing to call at the end
+        # of the chain
+        if not hasattr(base, name):
+            scripts = scripts[:-1]
+        for script, func in scripts:
+            if not uses_name(func.__code__, name):
+                yield script, name
+
+
+def check_hook_chains(cls: type, base: type) -> None:
+    """warns about script hooks that do not call the next one"""
+    registry = get_hook_registry(cls, base)
+    for script, name in get_broken_chains(registry, base):
+        log.warn('{script}: {hook} does not call the {hook} of the scripts '
+                 'applied before it', script=script, hook=name)
+
+
+class HookStats:
+    __slots__ = ('calls', 'total', 'max')
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds: float) -> None:
+        self.calls += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+
+class HookProfiler:
+    """
+    Measures the time spent in the hooks of each script.
+
+    Hooks call the next script's hook through super(), so the time of a call
+    includes the time of the scripts below it. Only the time spent in the
+    script itself is recorded, with the time of nested hook calls taken out.
+    """
+
+    def __init__(self) -> None:
+        # (script, hook) -> HookStats
+        self.stats = {}  # type: Dict[Tuple[str, str], HookStats]
+        # time spent in nested hook calls, for each hook call in progress
+        self.stack = []  # type: List[float]
+        # called with a label and the duration of each hook call, see
+        # TickProfiler.add_trace
+        self.tracer = None  # type: Optional[Callable[[str, float], None]]
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.stats)
+
+    def wrap(self, script: str, hook: str, func: Callable) -> Callable:
+        stats = self.stats.get((script, hook))
+        if stats is None:
+            stats = self.stats[script, hook] = HookStats()
+        label = '{}.{}'.format(script, hook)
+        stack = self.stack
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            stack.append(0.0)
+            start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = perf_counter() - start
+                own = elapsed - stack.pop()
+                if stack:
+                    stack[-1] += elapsed
+                stats.record(own)
+                if self.tracer is not None:
+                    self.tracer(label, own)
+        wrapper.hook_profiler_wrapped = True
+        return wrapper
+
+    def instrument(self, script: str, cls: type, base: type) -> None:
+        """wraps the hooks that the script added to cls on top of base"""
+        for klass, name, func in get_overridden_hooks(cls, base):
+            if getattr(func, 'hook_profiler_wrapped', False):
+                continue
+            setattr(klass, name, self.wrap(script, name, func))
+
+    def summary(self, limit: Optional[int] = None) -> List[
+            Tuple[str, str, HookStats]]:
+        """returns (script, hook, stats) of the hooks that were called,
+        by total time spent in them"""
+        items = [(script, hook, stats)
+                 for (script, hook), stats in self.stats.items()
+                 if stats.calls]
+        items.sort(key=lambda item: -item[2].total)
+        return items[:limit]
+
+    def reset(self) -> None:
+        for stats in self.stats.values():
+            stats.__init__()
+
+
+# instruments the scripts when the profile_hooks option is set
+hook_profiler = HookProfiler()
@@ -0,0 +1,296 @@
+"""
+Server metrics in the Prometheus text exposition format, served by the status
+server at /metrics.
+
+Everything is read from counters and histograms the server keeps anyway, so
+rendering only walks a few lists and does not touch the map.
+"""
+
+import gc
+import os
+import time
+from typing import List
+
+from piqueserver.hooks import hook_profiler
+from pyspades.profiler import Histogram, get_packet_name
+
+try:
+    import resource
+except ImportError:  # not available on windows
+    resource = None
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# upper bounds in seconds of the duration histogram buckets
+DURATION_BUCKETS = [0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                    0.025, 0.05, 0.1, 0.25, 0.5, 1.0]
+# upper bounds in milliseconds of the round trip time buckets
+RTT_BUCKETS = [10, 25, 50, 75, 100, 150, 200, 300, 500, 1000]
+# upper bounds of the packet loss buckets, as a fraction of packets
+LOSS_BUCKETS = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25]
+
+# enet reports packet loss scaled to this
+ENET_PEER_PACKET_LOSS_SCALE = 1 << 16
+
+try:
+    PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+except (AttributeError, ValueError, OSError):
+    PAGE_SIZE = None
+
+
+class GCMonitor:
+    """
+    Times garbage collections with gc.callbacks
+    """
+
+    def __init__(self) -> None:
+        self.pauses = {generation: Histogram() for generation in range(3)}
+        self.start = None
+
+    def install(self) -> None:
+        if self.callback not in gc.callbacks:
+            gc.callbacks.append(self.callback)
+
+    def uninstall(self) -> None:
+        if self.callback in gc.callbacks:
+            gc.callbacks.remove(self.callback)
+
+    def callback(self, phase: str, info: dict) -> None:
+        if phase == 'start':
+            self.start = time.perf_counter()
+        elif self.start is not None:
+            self.pauses[info['generation']].record(
+                time.perf_counter() - self.start)
+            self.start = None
+
+
+gc_monitor = GCMonitor()
+
+
+def format_labels(labels: dict) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, value)
+                          for name, value in labels.items()) + '}'
+
+
+def format_bound(bound: float) -> str:
+    return repr(float(bound))
+
+
+class MetricsWriter:
+    """
+    Builds a page in the text exposition format
+    """
+
+    def __init__(self, prefix: str = 'piqueserver_') -> None:
+        self.prefix = prefix
+        self.lines = []  # type: List[str]
+
+    def header(self, name: str, metric_type: str, help_text: str) -> str:
+        name = self.prefix + name
+        self.lines.append('# HELP {} {}'.format(name, help_text))
+        self.lines.append('# TYPE {} {}'.format(name, metric_type))
+        return name
+
+    def sample(self, name: str, value, **labels) -> None:
+        self.lines.append('{}{} {}'.format(name, format_labels(labels), value))
+
+    def simple(self, name: str, metric_type: str, help_text: str,
+               value) -> None:
+        self.sample(self.header(name, metric_type, help_text), value)
+
+    def buckets(self, name: str, bounds, cumulative: List[int], count: int,
+                total: float, labels: dict) -> None:
+        for bound, seen in zip(bounds, cumulative):
+            self.sample(name + '_bucket', seen, le=format_bound(bound),
+                        **labels)
+        self.sample(name + '_bucket', count, le='+Inf', **labels)
+        self.sample(name + '_sum', total, **labels)
+        self.sample(name + '_count', count, **labels)
+
+    def histogram(self, name: str, histogram: Histogram, **labels) -> None:
+        """writes the samples of a profiler histogram, in seconds"""
+        self.buckets(name, DURATION_BUCKETS,
+                     histogram.cumulative(DURATION_BUCKETS), histogram.count,
+                     histogram.total, labels)
+
+    def values(self, name: str, bounds, values: List[float]) -> None:
+        """writes a histogram of the given values"""
+        values = sorted(values)
+        cumulative = []
+        seen = 0
+        for bound in bounds:
+            while seen < len(values) and values[seen] <= bound:
+                seen += 1
+            cumulative.append(seen)
+        self.buckets(name, bounds, cumulative, len(values), sum(values), {})
+
+    def render(self) -> bytes:
+        self.lines.append('')
+        return '\n'.join(self.lines).encode('utf-8')
+
+
+def write_tick_metrics(writer: MetricsWriter, protocol) -> None:
+    profiler = protocol.profiler
+    name = writer.header('tick_seconds', 'histogram',
+                         'Duration of update loop ticks, including the '
+                         'packet handlers that ran since the previous one')
+    writer.histogram(name, profiler.ticks)
+    name = writer.header('tick_phase_seconds', 'histogram',
+                         'Duration of the phases of update loop ticks')
+    for phase, histogram in profiler.phases.items():
+        writer.histogram(name, histogram, phase=phase)
+    writer.simple('slow_ticks_total', 'counter',
+                  'Ticks that took longer than the update interval',
+                  profiler.slow_ticks)
+    name = writer.header('packet_handler_seconds', 'histogram',
+                         'Duration of packet handlers by packet type')
+    for packet_id, histogram in profiler.packets.items():
+        writer.histogram(name, histogram, packet=get_packet_name(packet_id))
+
+
+def write_traffic_metrics(writer: MetricsWriter, protocol) -> None:
+    for direction, counter, verb in (
+            ('in', protocol.packets_in, 'received'),
+            ('out', protocol.packets_out, 'sent')):
+        sent = direction == 'out'
+        items = [(get_packet_name(packet_id, sent), packets, size)
+                 for packet_id, packets, size in counter.items()]
+        name = writer.header('packets_{}_total'.format(direction), 'counter',
+                             'Packets {} by packet type'.format(verb))
+        for packet_name, packets, _ in items:
+            writer.sample(name, packets, packet=packet_name)
+        name = writer.header('packet_bytes_{}_total'.format(direction),
+                             'counter',
+                             'Packet bytes {} by packet type, before enet '
+                             'compression'.format(verb))
+        for packet_name, _, size in items:
+            writer.sample(name, size, packet=packet_name)
+    host = protocol.host
+    if host is not None:
+        writer.simple('enet_received_bytes_total', 'counter',
+                      'Bytes received by the enet host', host.totalReceivedData)
+        writer.simple('enet_sent_bytes_total', 'counter',
+                      'Bytes sent by the enet host', host.totalSentData)
+
+
+def write_peer_metrics(writer: MetricsWriter, protocol) -> None:
+    connections = list(protocol.connections.values())
+    writer.simple('connections', 'gauge', 'Connected peers', len(connections))
+    writer.simple('players', 'gauge', 'Players in the game',
+                  len(protocol.players))
+    peers = [connection.peer for connection in connections]
+    name = writer.header('peer_rtt_milliseconds', 'histogram',
+                         'Round trip time of the connected peers')
+    writer.values(name, RTT_BUCKETS, [peer.roundTripTime for peer in peers])
+    name = writer.header('peer_packet_loss_ratio', 'histogram',
+                         'Packet loss of the connected peers')
+    writer.values(name, LOSS_BUCKETS,
+                  [peer.packetLoss / ENET_PEER_PACKET_LOSS_SCALE
+                   for peer in peers])
+    transfers = sum(connection.map_data is not None
+                    for connection in connections)
+    writer.simple('map_transfers', 'gauge',
+                  'Peers that are still downloading the map', transfers)
+
+
+def write_admission_metrics(writer: MetricsWriter, protocol) -> None:
+    """writes the counters of the UDP admission control, if it is enabled"""
+    limiters = [limiter for limiter in (protocol.query_admission,
+                                        protocol.packet_admission)
+                if limiter is not None]
+    if not limiters:
+        return
+    name = writer.header('admission_admitted_total', 'counter',
+                         'UDP datagrams let through to the server')
+    for limiter in limiters:
+        writer.sample(name, limiter.admitted, kind=limiter.name)
+    name = writer.header('admission_dropped_total', 'counter',
+                         'UDP datagrams dropped because their source sent '
+                         'too many, or all sources together did')
+    for limiter in limiters:
+        writer.sample(name, limiter.dropped, kind=limiter.name,
+                      limit='source')
+        writer.sample(name, limiter.dropped_total, kind=limiter.name,
+                      limit='total')
+    name = writer.header('admission_sources', 'gauge',
+                         'Source IPs that token buckets are kept for')
+    for limiter in limiters:
+        writer.sample(name, len(limiter.buckets), kind=limiter.name)
+    name = writer.header('admission_offenders', 'gauge',
+                         'Source IPs that recently sent too many datagrams')
+    for limiter in limiters:
+        writer.sample(name, len(limiter.offenders), kind=limiter.name)
+
+
+def write_game_metrics(writer: MetricsWriter, protocol) -> None:
+    writer.simple('blocks_built_total', 'counter', 'Blocks built by players',
+                  protocol.blocks_built)
+    writer.simple('blocks_removed_total', 'counter',
+                  'Blocks removed by players', protocol.blocks_removed)
+
+
+def write_hook_metrics(writer: MetricsWriter) -> None:
+    """writes the time spent in the hooks of each script, if they are
+    instrumented"""
+    if not hook_profiler.enabled:
+        return
+    items = hook_profiler.summary()
+    name = writer.header('hook_calls_total', 'counter',
+                         'Calls of the hooks of each script')
+    for script, hook, stats in items:
+        writer.sample(name, stats.calls, script=script, hook=hook)
+    name = writer.header('hook_seconds_total', 'counter',
+                         'Time spent in the hooks of each script, not '
+                         'counting the scripts they call through super()')
+    for script, hook, stats in items:
+        writer.sample(name, stats.total, script=script, hook=hook)
+    name = writer.header('hook_max_seconds', 'gauge',
+                         'Longest call of the hooks of each script')
+    for script, hook, stats in items:
+        writer.sample(name, stats.max, script=script, hook=hook)
+
+
+def write_process_metrics(writer: MetricsWriter,
+                          monitor: GCMonitor = gc_monitor) -> None:
+    name = writer.header('gc_pause_seconds', 'histogram',
+                         'Duration of garbage collections by generation')
+    for generation, histogram in monitor.pauses.items():
+        writer.histogram(name, histogram, generation=generation)
+    # standard names, so dashboards for other exporters work
+    writer.prefix = 'process_'
+    writer.simple('cpu_seconds_total', 'counter',
+                  'User and system CPU time spent', time.process_time())
+    if resource is not None:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        # kilobytes on linux
+        writer.simple('max_resident_memory_bytes', 'gauge',
+                      'Peak resident memory size', usage.ru_maxrss * 1024)
+    if PAGE_SIZE is not None:
+        try:
+            with open('/proc/self/statm') as f:
+                size, resident = f.read().split()[:2]
+        except OSError:
+            pass
+        else:
+            writer.simple('virtual_memory_bytes', 'gauge',
+                          'Virtual memory size', int(size) * PAGE_SIZE)
+            writer.simple('resident_memory_bytes', 'gauge',
+                          'Resident memory size', int(resident) * PAGE_SIZE)
+    writer.prefix = 'piqueserver_'
+
+
+def render_metrics(protocol) -> bytes:
+    """returns the /metrics page for the given protocol"""
+    writer = MetricsWriter()
+    writer.simple('uptime_seconds', 'gauge', 'Time since the server started',
+                  time.time() - protocol.start_time)
+    write_tick_metrics(writer, protocol)
+    write_traffic_metrics(writer, protocol)
+    write_peer_metrics(writer, protocol)
+    write_admission_metrics(writer, protocol)
+    write_game_metrics(writer, protocol)
+    write_hook_metrics(writer)
+    write_process_metrics(writer)
+    return writer.render()
@@ -1,8 +1,16 @@
-from ipaddress import ip_network, ip_address
+from array import array
+from bisect import bisect_left, bisect_right
+from heapq import merge
+from ipaddress import IPv4Network, IPv6Network, ip_network
 from collections import OrderedDict
+from socket import AF_INET, AF_INET6, inet_pton
+
+MAX_PREFIXLEN = {4: 32, 6: 128}
+NETWORK_TYPES = {4: IPv4Network, 6: IPv6Network}
+
 
 def get_cidr(network):
-    if network.prefixlen == 32:
+    if network.prefixlen == network.max_prefixlen:
         return str(network.network_address)
     return str(network)
 
@@ -10,9 +18,76 @@ def get_cidr(network):
 # More info: https://docs.python.org/3/howto/ipaddress.html#defining-networks
 
 
+def get_mask(prefixlen, max_prefixlen):
+    """returns the netmask of a prefix length as an int"""
+    return ((1 << prefixlen) - 1) << (max_prefixlen - prefixlen)
+
+
+def parse_network(key, strict=True):
+    """returns the IP version, address as an int and prefix length of an
+    address or network, like ip_network() but without creating a network
+    object for the common cases. With strict=False host bits are cleared"""
+    text = str(key)
+    address, _, prefix = text.partition('/')
+    for version, family in ((4, AF_INET), (6, AF_INET6)):
+        try:
+            packed = inet_pton(family, address)
+        except OSError:
+            continue
+        max_prefixlen = MAX_PREFIXLEN[version]
+        if not prefix:
+            return version, int.from_bytes(packed, 'big'), max_prefixlen
+        if prefix.isdigit() and int(prefix) <= max_prefixlen:
+            prefixlen = int(prefix)
+            value = int.from_bytes(packed, 'big')
+            masked = value & get_mask(prefixlen, max_prefixlen)
+            if masked == value or not strict:
+                return version, masked, prefixlen
+        break
+    # netmasks, invalid input and errors are left to ipaddress
+    network = ip_network(text, strict=strict)
+    return (network.version, int(network.network_address),
+            network.prefixlen)
+
+
+def get_last_address(address, prefixlen, max_prefixlen):
+    """returns the last address of a network as an int"""
+    return address | ((1 << (max_prefixlen - prefixlen)) - 1)
+
+
+def make_network(key):
+    """same as ip_network(key, strict=False)"""
+    version, address, prefixlen = parse_network(key, strict=False)
+    return NETWORK_TYPES[version]((address, prefixlen))
+
+
 class NetworkDict:
+    """
+    Mapping of IPv4 and IPv6 networks to values. Looking up an address or
+    network returns the value of the most specific network that contains it.
+
+    The networks are kept in insertion order in ``networks``, which should not
+    be modified directly. For lookups they are also indexed by IP version and
+    prefix length, with the network address as an int, so that a lookup only
+    tries the prefix lengths that are actually in use.
+
+    The address ranges of the networks are also kept sorted, so that the
+    networks inside a given one can be found with a binary search. Two CIDR
+    networks are either disjoint or one contains the other, so these and the
+    networks containing it are all the networks that overlap it.
+    """
+
     def __init__(self):
         self.networks = OrderedDict()
+        # version -> prefix length -> network address -> network
+        self.prefixes = {4: {}, 6: {}}
+        # version -> (prefix length, netmask, networks) of the prefix lengths
+        # in use, longest first
+        self.levels = {4: [], 6: []}
+        # version -> (first address, last address, network), sorted once
+        # a query needs it, so that loading a list does not sort every time
+        self.ranges = {4: [], 6: []}
+        self.unsorted = set()
 
     def read_list(self, values):
         for index, item in enumerate(values):
@@ -26,57 +101,134 @@ class NetworkDict:
             values.append([value[0]] + [network] + list(value[1:]))
         return values
 
+    def _update_levels(self, version):
+        max_prefixlen = MAX_PREFIXLEN[version]
+        self.levels[version] = [
+            (prefixlen, get_mask(prefixlen, max_prefixlen), networks)
+            for prefixlen, networks in sorted(self.prefixes[version].items(),
+                                              reverse=True)]
+
+    def _get_ranges(self, version):
+        ranges = self.ranges[version]
+        if version in self.unsorted:
+            ranges.sort()
+            self.unsorted.discard(version)
+        return ranges
+
+    def _index(self, network):
+        version = network.version
+        prefixes = self.prefixes[version]
+        networks = prefixes.get(network.prefixlen)
+        if networks is None:
+            networks = prefixes[network.prefixlen] = {}
+            self._update_levels(version)
+        address = int(network.network_address)
+        if address in networks:
+            networks[address] = network
+            return
+        networks[address] = network
+        ranges = self.ranges[version]
+        last = get_last_address(address, network.prefixlen,
+                                MAX_PREFIXLEN[version])
+        entry = (address, last, network)
+        if ranges and entry < ranges[-1]:
+            self.unsorted.add(version)
+        ranges.append(entry)
+
+    def _unindex(self, network):
+        version = network.version
+        prefixes = self.prefixes[version]
+        networks = prefixes[network.prefixlen]
+        address = int(network.network_address)
+        del networks[address]
+        if not networks:
+            del prefixes[network.prefixlen]
+            self._update_levels(version)
+        ranges = self._get_ranges(version)
+        del ranges[bisect_left(ranges, (address, get_last_address(
+            address, network.prefixlen, MAX_PREFIXLEN[version])))]
+
+    def _matches(self, key, strict=True):
+        """returns the stored networks that contain the given address or
+        network, most specific first"""
+        version, address, key_prefixlen = parse_network(key, strict)
+        matches = []
+        for prefixlen, mask, networks in self.levels[version]:
+            if prefixlen > key_prefixlen:
+                continue
+            match = networks.get(address & mask)
+            if match is not None:
+                matches.append(match)
+        return matches
+
+    def get_supernets(self, key):
+        """returns the stored networks that contain the given address or
+        network, including the network itself, most specific first"""
+        return self._matches(key, strict=False)
+
+    def get_subnets(self, key):
+        """returns the stored networks inside the given network, including
+        the network itself, by address"""
+        version, address, prefixlen = parse_network(key, strict=False)
+        last = get_last_address(address, prefixlen, MAX_PREFIXLEN[version])
+        ranges = self._get_ranges(version)
+        start = bisect_left(ranges, (address,))
+        end = bisect_left(ranges, (last + 1,), start)
+        return [network for _, _, network in ranges[start:end]]
+
+    def get_overlaps(self, key):
+        """returns the stored networks that share addresses with the given
+        network"""
+        prefixlen = parse_network(key, strict=False)[2]
+        # the network itself is one of its subnets
+        return [network for network in self.get_supernets(key)
+                if network.prefixlen < prefixlen] + self.get_subnets(key)
+
     def remove(self, key):
         """remove a key from the networkdict and return the removed items"""
-        ip = ip_network(str(key), strict=False)
         results = []
-        # There are 32 possible networks for each IP address in CIDR. This is
-        # small enough that we can just loop through all of them to get an
-        # unelegant constant time lookup for IP addresses.
-        #
-        # This loop could be sped up by a lot by using a (ip, mask) int tuple
-        # instead of constantly creating new IPNetwork objects with .supernet()
-        #
-        # When in doubt, use brute force - Ken Thompson
-        for _ in range(0, 32):
-            try:
-                elem = self.networks.pop(ip)
-            except KeyError:
-                pass
-            else:
-                results.append([ip, elem])
-            ip = ip.supernet()
+        # the key itself and all the stored networks that contain it
+        for network in self._matches(key, strict=False):
+            self._unindex(network)
+            results.append([network, self.networks.pop(network)])
         return results
 
     def __setitem__(self, key, value):
-        self.networks[ip_network(str(key), strict=False)] = value
+        network = make_network(key)
+        self.networks[network] = value
+        self._index(network)
 
     def __getitem__(self, key):
         return self.get_entry(key)
 
     def get_entry(self, key):
-        ip = ip_network(str(key))
-        # See comment for remove()
-        for _ in range(0, 32):
-            try:
-                return self.networks[ip]
-            except KeyError:
-                pass
-            ip = ip.supernet()
-        raise KeyError(key)
+        matches = self._matches(key)
+        if not matches:
+            raise KeyError(key)
+        return self.networks[matches[0]]
 
     def __len__(self):
         return len(self.networks)
 
     def __delitem__(self, key):
-        ip = ip_network(str(key), strict=False)
-        self.networks.pop(ip)
+        network = make_network(key)
+        self.networks.pop(network)
+        self._unindex(network)
+
+    def discard(self, key):
+        """remove a network if it is in the networkdict. Unlike remove(), this
+        does not remove the networks that contain it"""
+        try:
+            del self[key]
+        except KeyError:
+            pass
 
     def pop(self, *arg, **kw):
         if not arg or not kw:
             network, value = self.networks.popitem()
         else:
             network, value = self.networks.pop(*arg, **kw)
+        self._unindex(network)
         return get_cidr(network), value
 
     def iteritems(self):
@@ -89,3 +241,123 @@ class NetworkDict:
             return True
         except KeyError:
             return False
+
+
+class NetworkRanges:
+    """
+    Read-only mapping of networks to values, stored as sorted arrays of
+    address ranges that are searched with bisect. It takes a lot less memory
+    than a NetworkDict, for large lists that are looked up often and change
+    rarely, like the bansubscribe lists.
+
+    Networks are given as the (version, address, prefix length) tuples that
+    parse_network() returns. Looking up an address or network returns the
+    value of the most specific network that contains it.
+
+    CIDR networks are either disjoint or nested, so the ranges are sorted by
+    first address with the containing networks first, and each range keeps the
+    index of the closest range that contains it. The range that starts last
+    before an address is either the most specific one that contains it, or
+    inside that one.
+    """
+
+    def __init__(self, items=()):
+        # version -> (first addresses, last addresses, index of the
+        # containing range or -1, prefix lengths, values)
+        self.ranges = {}
+        entries = sorted(
+            (version, address, prefixlen, value)
+            for (version, address, prefixlen), value in dict(items).items())
+        for version in (4, 6):
+            self._build(version, [entry[1:] for entry in entries
+                                  if entry[0] == version])
+
+    def _build(self, version, entries):
+        """stores the (address, prefix length, value) of a version, sorted by
+        address and prefix length"""
+        max_prefixlen = MAX_PREFIXLEN[version]
+        if version == 4:
+            firsts, lasts = array('I'), array('I')
+        else:
+            # too large for an array
+            firsts, lasts = [], []
+        parents = array('i')
+        prefixlens = array('B')
+        values = []
+        stack = []
+        for index, (address, prefixlen, value) in enumerate(entries):
+            last = get_last_address(address, prefixlen, max_prefixlen)
+            while stack and lasts[stack[-1]] < address:
+                stack.pop()
+            parents.append(stack[-1] if stack else -1)
+            stack.append(index)
+            firsts.append(address)
+            lasts.append(last)
+            prefixlens.append(prefixlen)
+            values.append(value)
+        self.ranges[version] = (firsts, lasts, parents, prefixlens, values)
+
+    def _entries(self, version):
+        firsts, _, _, prefixlens, values = self.ranges[version]
+        return zip(firsts, prefixlens, values)
+
+    def update(self, added, removed):
+        """returns a new NetworkRanges with the networks in added set to their
+        values and the ones in removed taken out. This merges the changes into
+        the sorted ranges instead of sorting everything again"""
+        new = NetworkRanges.__new__(NetworkRanges)
+        new.ranges = {}
+        for version in (4, 6):
+            changed = {(address, prefixlen): value
+                       for (key_version, address, prefixlen), value
+                       in added.items() if key_version == version}
+            dropped = {(address, prefixlen)
+                       for key_version, address, prefixlen in removed
+                       if key_version == version}
+            dropped.update(changed)
+            if not dropped:
+                new.ranges[version] = self.ranges[version]
+                continue
+            kept = (entry for entry in self._entries(version)
+                    if entry[:2] not in dropped)
+            inserted = sorted((address, prefixlen, value) for
+                              (address, prefixlen), value in changed.items())
+            new._build(version, list(merge(kept, inserted,
+                                           key=lambda entry: entry[:2])))
+        return new
+
+    def _find(self, key):
+        """returns the values of the version of key and the index of the value
+        for key, or -1"""
+        version, address, prefixlen = parse_network(key, strict=False)
+        firsts, lasts, parents, _, values = self.ranges[version]
+        last = get_last_address(address, prefixlen, MAX_PREFIXLEN[version])
+        index = bisect_right(firsts, address) - 1
+        while index >= 0 and lasts[index] < last:
+            index = parents[index]
+        return values, index
+
+    def get(self, key, default=None):
+        values, index = self._find(key)
+        if index < 0:
+            return default
+        return values[index]
+
+    def __getitem__(self, key):
+        values, index = self._find(key)
+        if index < 0:
+            raise KeyError(key)
+        return values[index]
+
+    def __contains__(self, key):
+        return self._find(key)[1] >= 0
+
+    def __len__(self):
+        return sum(len(ranges[4]) for ranges in self.ranges.values())
+
+    def items(self):
+        """yields the (version, address, prefix length) and value of each
+        network"""
+        for version in (4, 6):
+            for address, prefixlen, value in self._entries(version):
+                yield (version, address, prefixlen), value
@@ -0,0 +1,159 @@
+"""
+Images of the map as seen from above, for the status server.
+
+The RGBA pixels of the map are kept between renders, and only the tiles of
+the map that changed since are drawn again, a few at a time so that the game
+keeps running in between. Encoding the PNGs is done in a worker thread, and
+each image is kept until the part of the map it shows changes.
+
+Besides the whole map, the images are served as a pyramid of square tiles of
+TILE_SIZE pixels: zoom level 0 is the whole map in one tile, and every level
+splits each tile of the one above into four, up to MAX_ZOOM where a pixel is
+a column of the map. Every tile has a version, so that viewers only fetch the
+tiles that changed.
+"""
+
+import asyncio
+import os
+from io import BytesIO
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image
+
+from pyspades.vxl import OVERVIEW_TILE_SIZE
+
+MAP_SIZE = 512
+TILES = MAP_SIZE // OVERVIEW_TILE_SIZE
+# number of tiles drawn before letting the game run
+TILES_PER_STEP = 8
+
+# size of the served tiles, in pixels
+TILE_SIZE = OVERVIEW_TILE_SIZE
+MAX_ZOOM = (MAP_SIZE // TILE_SIZE).bit_length() - 1
+
+# (generation, map version)
+Version = Tuple[int, int]
+Area = Tuple[int, int, int, int]
+
+
+def encode_png(pixels: bytes, size: int, area: Optional[Area] = None) -> bytes:
+    """encodes the square RGBA image as PNG, or only the given area of it
+    scaled to TILE_SIZE"""
+    image = Image.frombytes('RGBA', (size, size), pixels)
+    if area is not None:
+        image = image.resize((TILE_SIZE, TILE_SIZE), Image.BOX, box=area)
+    data = BytesIO()
+    image.save(data, 'png')
+    return data.getvalue()
+
+
+def get_tile_area(zoom: int, x: int, y: int) -> Area:
+    """returns the columns a tile covers, as (left, top, right, bottom)"""
+    size = MAP_SIZE >> zoom
+    return (x * size, y * size, (x + 1) * size, (y + 1) * size)
+
+
+class Overview:
+    """
+    RGBA pixels of the top of the map, kept up to date tile by tile.
+    """
+
+    def __init__(self) -> None:
+        self.map = None
+        # increased when a different map is drawn
+        self.generation = 0
+        # differs between runs, so that ETags of an earlier run never match
+        self.run_id = os.urandom(4).hex()
+        self.pixels = bytearray(MAP_SIZE * MAP_SIZE * 4)
+        # copy of the pixels for the worker threads, made when needed
+        self.snapshot = None  # type: Optional[bytes]
+        # map version each tile was drawn at, None if it was not drawn yet
+        self.tile_versions = [None] * (TILES * TILES)  # type: List[Optional[int]]
+        # image key -> version and future of the PNG
+        self.images = {}  # type: Dict[object, Tuple[Version, asyncio.Future]]
+        self.lock = asyncio.Lock()
+
+    def draw_tile(self, the_map, index: int) -> None:
+        size = OVERVIEW_TILE_SIZE
+        x = (index % TILES) * size
+        y = (index // TILES) * size
+        area = the_map.get_overview_area(x, y, size, size)
+        row = size * 4
+        pixels = self.pixels
+        start = (y * MAP_SIZE + x) * 4
+        for offset in range(0, len(area), row):
+            pixels[start:start + row] = area[offset:offset + row]
+            start += MAP_SIZE * 4
+        self.snapshot = None
+
+    async def update(self, the_map) -> None:
+        """draws the tiles that changed since the last update"""
+        async with self.lock:
+            if the_map is not self.map:
+                self.map = the_map
+                self.generation += 1
+                self.tile_versions = [None] * (TILES * TILES)
+                self.images.clear()
+            versions = the_map.get_tile_versions()
+            drawn = 0
+            for index, tile_version in enumerate(self.tile_versions):
+                if tile_version == versions[index]:
+                    continue
+                if drawn == TILES_PER_STEP:
+                    await asyncio.sleep(0)
+                    drawn = 0
+                    # the map may have changed in the meantime
+                    versions = the_map.get_tile_versions()
+                self.tile_versions[index] = versions[index]
+                self.draw_tile(the_map, index)
+                drawn += 1
+
+    def get_version(self, zoom: int = 0, x: int = 0, y: int = 0) -> Version:
+        """returns the version of the drawn pixels of a tile, which is the
+        version of the latest change inside it"""
+        left, top, right, bottom = get_tile_area(zoom, x, y)
+        size = OVERVIEW_TILE_SIZE
+        tile_versions = self.tile_versions
+        version = max(tile_versions[tile_y * TILES + tile_x] or 0
+                      for tile_y in range(top // size, bottom // size)
+                      for tile_x in range(left // size, right // size))
+        return (self.generation, version)
+
+    def get_etag(self, zoom: int = 0, x: int = 0, y: int = 0) -> str:
+        return '"{}-{}-{}"'.format(self.run_id, *self.get_version(zoom, x, y))
+
+    async def encode(self, key, version: Version, *args) -> bytes:
+        """encodes the pixels with encode_png(*args) in a worker thread, or
+        returns the PNG encoded earlier for the same key and version"""
+        cached = self.images.get(key)
+        if cached is None or cached[0] != version:
+            if self.snapshot is None:
+                self.snapshot = bytes(self.pixels)
+            loop = asyncio.get_event_loop()
+            future = loop.run_in_executor(None, encode_png, self.snapshot,
+                                          MAP_SIZE, *args)
+            cached = self.images[key] = (version, future)
+        try:
+            return await cached[1]
+        except Exception:
+            if self.images.get(key) is cached:
+                del self.images[key]
+            raise
+
+    async def get_png(self, the_map) -> bytes:
+        """returns the map encoded as PNG, drawn and encoded again only if it
+        changed since the last call"""
+        await self.update(the_map)
+        return await self.encode(None, self.get_version())
+
+    async def get_tile(self, the_map, zoom: int, x: int, y: int) -> bytes:
+        """returns a tile of the pyramid encoded as PNG, see the module
+        docstring"""
+        await self.update(the_map)
+        return await self.encode_tile(zoom, x, y)
+
+    async def encode_tile(self, zoom: int, x: int, y: int) -> bytes:
+        """returns a tile as drawn by the last update, which matches
+        get_etag() if called right after it"""
+        return await self.encode((zoom, x, y), self.get_version(zoom, x, y),
+                                 get_tile_area(zoom, x, y))
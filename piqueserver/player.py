@@ -4,7 +4,6 @@ from typing import List, Tuple, Optional, Union
 
 from twisted.internet import reactor
 from twisted.internet.defer import ensureDeferred
-from twisted.logger import Logger
 
 from piqueserver import commands
 from piqueserver.release import format_release
@@ -12,6 +11,7 @@ from pyspades.constants import (ERROR_BANNED, DESTROY_BLOCK, SPADE_DESTROY,
                                 GRENADE_DESTROY, ERROR_KICKED)
 from pyspades.server import ServerConnection
 from pyspades.common import escape_control_codes, prettify_timespan
+from pyspades.log import Logger
 from pyspades.types import AttributeSet, RateLimiter
 
 # TODO: move these where they belong
@@ -64,9 +64,8 @@ class FeatureConnection(ServerConnection):
         if banned:
             name, reason, timestamp = banned[1:]
 
-            if timestamp is not None and reactor.seconds() >= timestamp:
-                ban_manager.remove_ban(client_ip)
-            else:
+            # expired bans are left to the ban manager to remove and save
+            if timestamp is None or reactor.seconds() < timestamp:
                 log.info('banned user {name} ({client_ip}) attempted to join',
                          name=name,
                          client_ip=client_ip)
@@ -12,6 +12,7 @@ def apply_script(protocol, connection, config):
     class SpadenadeConnection(connection):
         def on_secondary_fire_set(self, secondary):
             self.was_spade = (self.tool == SPADE_TOOL)
+            return connection.on_secondary_fire_set(self, secondary)
 
         def on_grenade(self, time_left):
             if(self.world_object.secondary_fire and self.was_spade):
@@ -38,14 +38,15 @@ from twisted.internet import reactor, threads
 from twisted.internet.defer import Deferred, ensureDeferred
 from twisted.internet.task import LoopingCall, deferLater
 from twisted.internet.tcp import Port
-from twisted.logger import (FilteringLogObserver, Logger, LogLevel,
+from twisted.logger import (FilteringLogObserver, LogLevel,
                             LogLevelFilterPredicate, globalLogBeginner,
                             textFileLogObserver)
 from twisted.python.logfile import DailyLogFile
 
 # won't be used; just need to be executed
 import piqueserver.core_commands  # pylint: disable=unused-import
-from piqueserver import commands, extensions
+from piqueserver import commands, extensions, hooks, supervisor
+from piqueserver.admission import AdmissionControl
 from piqueserver.config import cast_duration, config
 from piqueserver.console import create_console
 from piqueserver.map import Map, MapNotFound, RotationInfo, check_rotation
@@ -57,6 +58,7 @@ from piqueserver.utils import ensure_dir_exists, as_deferred, EndCall
 from piqueserver.bansubscribe import bans_config_urls
 from pyspades.bytes import NoDataLeft
 from pyspades.constants import CTF_MODE, ERROR_SHUTDOWN, TC_MODE, EXTENSION_CHATTYPE
+from pyspades.log import Logger, set_level as set_log_level
 from pyspades.master import MAX_SERVER_NAME_SIZE
 from pyspades.server import ServerProtocol, Team
 from pyspades.tools import make_server_identifier
@@ -86,6 +88,7 @@ logging_config = config.section('logging')
 status_server_config = config.section('status_server')
 team1_config = config.section('team1')
 team2_config = config.section('team2')
+admission_config = config.section('admission')
 
 bans_backend = bans_config.option('backend', default='piqueserver.bans.DefaultBanManager')
 bans_file = bans_config.option('file', default='bans.txt')
@@ -150,9 +153,19 @@ status_server_backend = status_server_config.option('backend', 'piqueserver.stat
 ban_publish = bans_config.option('publish', False)
 ban_publish_port = bans_config.option('publish_port', 32885)
 logging_rotate_daily = logging_config.option('rotate_daily', False)
+capture_file = logging_config.option('capture', default='')
+profile_hooks_option = logging_config.option('profile_hooks', False)
 tip_frequency = config.option(
     'tips_frequency', default="5sec", cast=lambda x: cast_duration(x)/60)
 register_master_option = config.option('master', False)
+admission_enabled = admission_config.option('enabled', default=True)
+query_rate_option = admission_config.option('query_rate', default=5)
+query_burst_option = admission_config.option('query_burst', default=10)
+total_query_rate_option = admission_config.option('total_query_rate',
+                                                  default=500)
+# off by default, players behind one address share the limit
+packet_rate_option = admission_config.option('packet_rate', default=0)
+packet_burst_option = admission_config.option('packet_burst', default=0)
 
 default_ip_getter = 'https://services.buildandshoot.com/getip'
 ip_getter_option = config.option('ip_getter', default_ip_getter)
@@ -213,6 +226,7 @@ class FeatureProtocol(ServerProtocol):
     ban_manager = None
     ban_publish = None
     bansubscribe_manager = None
+    supervisor_client = None
     auth_backend = None
     everyone_is_admin = False
     player_memory = None
@@ -248,6 +262,8 @@ class FeatureProtocol(ServerProtocol):
     default_fog = (128, 232, 255)
 
     def __init__(self, interface: bytes, config_dict: Dict[str, Any]) -> None:
+        # drop filtered out events before they are built, see pyspades.log
+        set_log_level(LogLevel.levelWithName(loglevel.get()))
         # logfile path relative to config dir if not abs path
         log_filename = logfile.get()
         if log_filename.strip():  # catches empty filename
@@ -279,6 +295,9 @@ class FeatureProtocol(ServerProtocol):
         self.advance_on_win = int(advance_on_win.get())
         self.win_count = itertools.count(1)
 
+        if supervisor.is_worker():
+            self.supervisor_client = supervisor.start_client(self)
+
         b_backend = bans_backend.get()
         if b_backend:
             b_backend_class = extensions.load_backend(b_backend, 'bans/')
@@ -287,6 +306,18 @@ class FeatureProtocol(ServerProtocol):
         self.available_proto_extensions = [(EXTENSION_CHATTYPE, 1)]
 
         self.hard_bans = set()  # possible DDoS'ers are added here
+        self.query_admission = self.packet_admission = None
+        if admission_enabled.get():
+            self.query_admission = AdmissionControl(
+                'queries', query_rate_option.get(), query_burst_option.get(),
+                total_query_rate_option.get())
+            packet_rate = packet_rate_option.get()
+            if packet_rate:
+                self.packet_admission = AdmissionControl(
+                    'packets', packet_rate,
+                    packet_burst_option.get() or 2 * packet_rate)
+        # (state, payload) of the last HELLOLAN reply
+        self.lan_reply = (None, None)
         self.player_memory = deque(maxlen=100)
         if len(self.name) > MAX_SERVER_NAME_SIZE:
             log.warn(
@@ -375,6 +406,17 @@ class FeatureProtocol(ServerProtocol):
         self.port = port_option.get()
         ServerProtocol.__init__(self, self.port, interface)
         self.host.intercept = self.receive_callback
+        # slow tick traces show the scripts' hooks, if they are instrumented
+        hooks.hook_profiler.tracer = self.profiler.add_trace
+
+        capture_filename = capture_file.get()
+        if capture_filename:
+            capture_filename = os.path.join(config.config_dir,
+                                            capture_filename)
+            ensure_dir_exists(capture_filename)
+            self.start_capture(capture_filename)
+            reactor.addSystemEventTrigger('after', 'shutdown',
+                                          self.stop_capture)
 
         try:
             self.set_map_rotation(self.config['rotation'])
@@ -653,6 +695,33 @@ class FeatureProtocol(ServerProtocol):
                 log.info("#" * 60)
             await asyncio.sleep(86400)  # 24 hrs
 
+    def get_lan_reply(self) -> bytes:
+        """returns the reply to HELLOLAN messages, for LAN discovery. It is
+        only encoded again when the server data changed"""
+        # we might receive a HELLOLAN before the map has been loaded
+        # if so, return a dummy string instead
+        if self.map_info:
+            map_name = self.map_info.short_name
+        else:
+            map_name = "loading..."
+        state = (self.name, self.get_player_count(), self.max_players,
+                 map_name, self.get_mode_name(),
+                 tuple(self.available_proto_extensions))
+        last_state, payload = self.lan_reply
+        if state != last_state:
+            entry = {
+                "name": self.name,
+                "players_current": state[1],
+                "players_max": self.max_players,
+                "map": map_name,
+                "game_mode": state[4],
+                "game_version": "0.75",
+                "extensions": self.available_proto_extensions
+            }
+            payload = json.dumps(entry).encode()
+            self.lan_reply = (state, payload)
+        return payload
+
     def receive_callback(self, address: Address, data: bytes) -> int:
         """This hook receives the raw UDP data before it is processed by enet"""
 
@@ -660,34 +729,24 @@ class FeatureProtocol(ServerProtocol):
         # for now. This should ideally get fixed in pyenet instead.
         try:
             # reply to ASCII HELLO messages with HI so that clients can measure the
-            # connection latency
-            if data == b'HELLO':
-                self.host.socket.send(address, b'HI')
-                return 1
-            # reply to ASCII HELLOLAN messages with server data for LAN discovery
-            elif data == b'HELLOLAN':
-                # we might receive a HELLOLAN before the map has been loaded
-                # if so, return a dummy string instead
-                if self.map_info:
-                    map_name = self.map_info.short_name
+            # connection latency, and to HELLOLAN messages with server data for
+            # LAN discovery
+            if data == b'HELLO' or data == b'HELLOLAN':
+                admission = self.query_admission
+                if admission is not None and not admission.admit(address.host):
+                    return 1
+                if data == b'HELLO':
+                    self.host.socket.send(address, b'HI')
                 else:
-                    map_name = "loading..."
-                entry = {
-                    "name": self.name,
-                    "players_current": self.get_player_count(),
-                    "players_max": self.max_players,
-                    "map": map_name,
-                    "game_mode": self.get_mode_name(),
-                    "game_version": "0.75",
-                    "extensions": self.available_proto_extensions
-                }
-                payload = json.dumps(entry).encode()
-                self.host.socket.send(address, payload)
+                    self.host.socket.send(address, self.get_lan_reply())
                 return 1
 
             # This drop the connection of any ip in hard_bans
             if address.host in self.hard_bans:
                 return 1
+            admission = self.packet_admission
+            if admission is not None and not admission.admit(address.host):
+                return 1
         except Exception:
             import traceback
             traceback.print_exc()
@@ -695,25 +754,18 @@ class FeatureProtocol(ServerProtocol):
         return 0
 
     def data_received(self, peer: Peer, packet: Packet) -> None:
-        ip = peer.address.host
-        current_time = reactor.seconds()
+        # slow packets are logged by ServerConnection.loader_received
         try:
             ServerProtocol.data_received(self, peer, packet)
         except (NoDataLeft, ValueError):
             import traceback
             traceback.print_exc()
+            ip = peer.address.host
             log.info(
                 'IP {ip} was hardbanned for invalid data or possibly DDoS.',
                 ip=ip
             )
             self.hard_bans.add(ip)
-            return
-        dt = reactor.seconds() - current_time
-        if dt > 1.0:
-            log.warn('processing {data!r} from {ip} took {time}',
-                     data=packet.data,
-                     ip=ip,
-                     time=dt)
 
     def irc_say(self, msg: str, me: bool = False) -> None:
         if self.irc_relay:
@@ -830,9 +882,10 @@ class FeatureProtocol(ServerProtocol):
         return self.advance_call.getTime() - self.advance_call.seconds()
 
 
-def run() -> None:
+def create_protocol_class() -> type:
     """
-    runs the server
+    loads the configured scripts and game mode and applies them to the server
+    classes, returning the resulting protocol class
     """
 
     # load and apply regular scripts
@@ -840,8 +893,12 @@ def run() -> None:
     script_dir = os.path.join(config.config_dir, 'scripts/')
     script_objects = extensions.load_scripts_regular_extension(
         script_names, script_dir)
+    hook_profiler = None
+    if profile_hooks_option.get():
+        hook_profiler = hooks.hook_profiler
     (protocol_class, connection_class) = extensions.apply_scripts(
-        script_objects, config, FeatureProtocol, FeatureConnection)
+        script_objects, config, FeatureProtocol, FeatureConnection,
+        hook_profiler)
 
     # load and apply the game_mode script
     game_mode_name = game_mode.get()
@@ -849,9 +906,26 @@ def run() -> None:
     game_mode_object = extensions.load_script_game_mode(
         game_mode_name, game_mode_dir)
     (protocol_class, connection_class) = extensions.apply_scripts(
-        game_mode_object, config, protocol_class, connection_class)
+        game_mode_object, config, protocol_class, connection_class,
+        hook_profiler)
+
+    hooks.check_hook_chains(protocol_class, FeatureProtocol)
+    hooks.check_hook_chains(connection_class, FeatureConnection)
 
     protocol_class.connection_class = connection_class
+    return protocol_class
+
+
+def run() -> None:
+    """
+    runs the server
+    """
+
+    if supervisor.is_supervisor():
+        supervisor.run()
+        return
+
+    protocol_class = create_protocol_class()
 
     interface = network_interface.get().encode('utf-8')
 
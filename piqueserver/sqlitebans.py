@@ -0,0 +1,428 @@
+"""
+Ban manager that keeps the bans in an SQLite database, which several server
+processes on the same host can share.
+
+Networks are stored as the range of addresses they cover, as big-endian
+BLOBs that compare like the addresses do, so that the bans containing or
+inside a network are found with the index instead of loading every ban.
+Writes are done in a worker thread, and the changes that are not written yet
+are kept in memory so that they apply right away. Lookups on connect are
+cached until the database changes. Expired bans are ignored right away, and
+deleted by a timer armed for the next ban to expire.
+
+Use it with::
+
+    [bans]
+    backend = "piqueserver.sqlitebans.SqliteBanManager"
+    #database = "bans.sqlite3"
+"""
+
+import json
+import os
+import sqlite3
+import time
+from ipaddress import IPv4Network
+from typing import List, Optional
+
+from twisted.internet import reactor
+from twisted.internet.task import LoopingCall
+from twisted.internet.threads import deferToThreadPool
+from twisted.logger import Logger
+from twisted.python.threadpool import ThreadPool
+
+from piqueserver.bans import EXPIRY_INTERVAL, Ban, BaseBanManager
+from piqueserver.config import config
+from piqueserver.networkdict import (
+    MAX_PREFIXLEN, NETWORK_TYPES, NetworkDict, get_last_address, get_mask,
+    make_network, parse_network)
+from piqueserver.utils import ensure_dir_exists
+
+log = Logger()
+
+# number of get_ban() results kept between changes to the database
+CACHE_SIZE = 1024
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS bans (
+    id INTEGER PRIMARY KEY,
+    version INTEGER NOT NULL,
+    first BLOB NOT NULL,
+    last BLOB NOT NULL,
+    prefixlen INTEGER NOT NULL,
+    name TEXT,
+    reason TEXT,
+    expiry REAL,
+    UNIQUE (version, first, prefixlen)
+);
+CREATE INDEX IF NOT EXISTS bans_expiry ON bans (expiry)
+    WHERE expiry IS NOT NULL;
+'''
+
+# the bans that did not expire yet, the first parameter is the current time
+SELECT = ('SELECT version, first, prefixlen, name, reason, expiry FROM bans '
+          'WHERE (expiry IS NULL OR expiry > ?) ')
+
+
+def connect(path: str, **kw) -> sqlite3.Connection:
+    connection = sqlite3.connect(path, isolation_level=None, **kw)
+    # readers and the writer do not block each other
+    connection.execute('PRAGMA journal_mode = WAL')
+    connection.execute('PRAGMA synchronous = NORMAL')
+    # wait for the writers of the other processes
+    connection.execute('PRAGMA busy_timeout = 5000')
+    return connection
+
+
+def pack_address(version: int, address: int) -> bytes:
+    return address.to_bytes(MAX_PREFIXLEN[version] // 8, 'big')
+
+
+def get_range(key):
+    """returns the IP version, first and last address and prefix length of an
+    address or network"""
+    version, address, prefixlen = parse_network(key, strict=False)
+    last = get_last_address(address, prefixlen, MAX_PREFIXLEN[version])
+    return version, address, last, prefixlen
+
+
+def execute_all(connection, statements):
+    """runs (statement, parameters) pairs in one transaction"""
+    connection.execute('BEGIN IMMEDIATE')
+    try:
+        for statement, parameters in statements:
+            connection.execute(statement, parameters)
+    except BaseException:
+        connection.execute('ROLLBACK')
+        raise
+    connection.execute('COMMIT')
+
+
+def is_expired(expiry, now) -> bool:
+    return expiry is not None and expiry <= now
+
+
+def make_ban(row) -> Ban:
+    version, first, prefixlen, name, reason, expiry = row
+    network = NETWORK_TYPES[version]((int.from_bytes(first, 'big'), prefixlen))
+    return network, name, reason, expiry
+
+
+class SqliteBanManager(BaseBanManager):
+    """
+    Ban manager that stores the bans in an SQLite database. See the module
+    docstring.
+    """
+
+    def __init__(self, protocol):
+        super().__init__(protocol)
+
+        bans_config = config.section('bans')
+        self.bans_file = bans_config.option('file', default='bans.txt')
+        self.database_file = bans_config.option('database',
+                                                default='bans.sqlite3')
+        self.path = os.path.join(config.config_dir, self.database_file.get())
+        ensure_dir_exists(self.path)
+        self.connection = connect(self.path)
+        self.connection.executescript(SCHEMA)
+        # connection of the worker thread
+        self.writer = None
+        self.pool = ThreadPool(1, 1, 'bans')
+        self.pool.start()
+        self.shutdown_trigger = reactor.addSystemEventTrigger(
+            'during', 'shutdown', self.pool.stop)
+
+        # changes that are queued but not written yet
+        self.pending_added = NetworkDict()
+        self.pending_removed = set()
+        self.queued = 0
+
+        self.cache = {}
+        self.data_version = None
+
+        self.expiry_call = None
+        self.expiry_time = None
+        self.last_vacuum = 0
+        self.closed = False
+
+        if not self.connection.execute('SELECT 1 FROM bans LIMIT 1').fetchone():
+            self.import_bans_file()
+
+        self.vacuum_loop = LoopingCall(self.vacuum_bans)
+        # Run the vacuum every 6 hours, and kick it off it right now. The
+        # expiry timer is armed after each vacuum, this also catches the bans
+        # added by other processes
+        self.vacuum_loop.start(60 * 60 * 6, True)
+
+    def close(self):
+        """stops the worker thread once the queued writes are done"""
+        self.closed = True
+        if self.vacuum_loop.running:
+            self.vacuum_loop.stop()
+        if self.expiry_call is not None and self.expiry_call.active():
+            self.expiry_call.cancel()
+        reactor.removeSystemEventTrigger(self.shutdown_trigger)
+        self.pool.stop()
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        self.connection.close()
+
+    def import_bans_file(self):
+        """copies the bans of the JSON bans file into a new database"""
+        database = NetworkDict()
+        try:
+            with open(os.path.join(config.config_dir, self.bans_file.get()),
+                      'r') as f:
+                database.read_list(json.load(f))
+        except FileNotFoundError:
+            return
+        except (IOError, ValueError) as e:
+            log.error(f'Could not import bans file ({self.bans_file.get()}): '
+                      f'{e}')
+            return
+        execute_all(self.connection, [
+            self.make_insert(network, value)
+            for network, value in database.networks.items()])
+        log.info(f'Imported {len(database)} bans from {self.bans_file.get()}')
+
+    # writing
+
+    def make_insert(self, network, value):
+        version, first, last, prefixlen = get_range(network)
+        return ('INSERT OR REPLACE INTO bans (version, first, last, '
+                'prefixlen, name, reason, expiry) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (version, pack_address(version, first),
+                 pack_address(version, last), prefixlen, *value))
+
+    def make_delete(self, network):
+        version, first, _, prefixlen = get_range(network)
+        return ('DELETE FROM bans WHERE version = ? AND first = ? AND '
+                'prefixlen = ?',
+                (version, pack_address(version, first), prefixlen))
+
+    def write(self, statements):
+        """runs the statements in one transaction, in the worker thread"""
+        if self.writer is None:
+            # only used by the worker thread, but closed by close()
+            self.writer = connect(self.path, check_same_thread=False)
+        execute_all(self.writer, statements)
+
+    def queue_write(self, statements):
+        """writes the statements in the worker thread and returns a Deferred
+        that fires once they are written"""
+        self.queued += 1
+        self.cache.clear()
+        d = deferToThreadPool(reactor, self.pool, self.write, statements)
+        d.addErrback(lambda failure: log.error(
+            f'Could not write bans database ({self.path}): '
+            f'{failure.getErrorMessage()}'))
+        d.addBoth(self.on_written)
+        return d
+
+    def on_written(self, result):
+        self.queued -= 1
+        if not self.queued:
+            # everything that was pending is in the database now
+            self.pending_added = NetworkDict()
+            self.pending_removed.clear()
+        self.cache.clear()
+        return result
+
+    # reading
+
+    def select(self, where, parameters) -> List[Ban]:
+        """returns the stored bans that match and did not expire, without the
+        pending changes. where follows the expiry condition of SELECT"""
+        rows = self.connection.execute(
+            SELECT + where, (time.time(), *parameters)).fetchall()
+        pending = self.pending_added.networks
+        removed = self.pending_removed
+        return [ban for ban in map(make_ban, rows)
+                if ban[0] not in pending and ban[0] not in removed]
+
+    def get_pending(self, networks) -> List[Ban]:
+        pending = self.pending_added.networks
+        now = time.time()
+        return [(network, *pending[network]) for network in networks
+                if not is_expired(pending[network][2], now)]
+
+    def get_supernets(self, key) -> List[Ban]:
+        """returns the bans that contain the given address or network, most
+        specific first"""
+        version, first, last, prefixlen = get_range(key)
+        max_prefixlen = MAX_PREFIXLEN[version]
+        # the containing networks start at the address with its host bits
+        # cleared, for one of the prefix lengths
+        starts = {pack_address(version, first & get_mask(length, max_prefixlen))
+                  for length in range(prefixlen + 1)}
+        bans = self.select(
+            'AND version = ? AND first IN ({}) AND last >= ?'.format(
+                ', '.join('?' * len(starts))),
+            (version, *starts, pack_address(version, last)))
+        bans += self.get_pending(self.pending_added.get_supernets(key))
+        bans.sort(key=lambda ban: -ban[0].prefixlen)
+        return bans
+
+    def get_subnets(self, key) -> List[Ban]:
+        """returns the bans inside the given network, including the network
+        itself"""
+        version, first, last, prefixlen = get_range(key)
+        bans = self.select(
+            'AND version = ? AND first BETWEEN ? AND ? AND prefixlen >= ? '
+            'ORDER BY first',
+            (version, pack_address(version, first),
+             pack_address(version, last), prefixlen))
+        return bans + self.get_pending(self.pending_added.get_subnets(key))
+
+    def get_overlaps(self, key) -> List[Ban]:
+        prefixlen = get_range(key)[3]
+        return [ban for ban in self.get_supernets(key)
+                if ban[0].prefixlen < prefixlen] + self.get_subnets(key)
+
+    def check_data_version(self):
+        """clears the cache if the database changed since the last lookup,
+        including changes made by other processes"""
+        data_version = self.connection.execute(
+            'PRAGMA data_version').fetchone()[0]
+        if data_version != self.data_version:
+            self.data_version = data_version
+            self.cache.clear()
+
+    # BaseBanManager
+
+    def ban_overlaps(self, network) -> Optional[IPv4Network]:
+        network = make_network(network)
+        if network.num_addresses == 1:
+            # a single IP cannot overlap any network
+            return False
+
+        for ban in self.get_overlaps(network):
+            if ban[0].num_addresses != 1:
+                return ban[0]
+
+        return None
+
+    def get_ban(self, network) -> Optional[Ban]:
+        key = str(network)
+        self.check_data_version()
+        try:
+            result = self.cache[key]
+        except KeyError:
+            pass
+        else:
+            if result is None or not is_expired(result[3], time.time()):
+                return result
+        bans = self.get_supernets(key)
+        result = None
+        if bans:
+            result = (make_network(key),
+                      *bans[0][1:])
+        if len(self.cache) >= CACHE_SIZE:
+            del self.cache[next(iter(self.cache))]
+        self.cache[key] = result
+        return result
+
+    def get_all_bans(self) -> List[Ban]:
+        return (self.select('ORDER BY id', ()) +
+                self.get_pending(list(self.pending_added.networks)))
+
+    def add_ban(self, network, name, reason, duration, admin=None) -> Optional[str]:
+        """
+        Ban an ip with an optional reason and duration in seconds. If duration
+        is None, ban is permanent.
+        """
+        network = make_network(network)
+        kicked_name = self.kick_network(network)
+        if kicked_name:
+            name = name or kicked_name
+        if self.get_ban(network):
+            msg = f'IP/Network {network} is already banned'
+            log.info(msg)
+            return msg
+        overlap = self.ban_overlaps(network)
+        if overlap:
+            msg = f'IP/Network {network} overlaps with network {overlap}'
+            log.info(msg)
+            return msg
+        if duration:
+            duration = time.time() + duration
+        else:
+            duration = None
+        value = (name or '(unknown)', reason, duration)
+        self.pending_removed.discard(network)
+        self.pending_added[network] = value
+        self.queue_write([self.make_insert(network, value)])
+        if duration is not None:
+            self.arm_expiry_timer(duration)
+        self.banpublish_update()
+        return None
+
+    def remove_ban(self, network) -> int:
+        bans = self.get_overlaps(network)
+        for ban in bans:
+            log.info(f'Removing banned network: {ban[0]} {list(ban[1:])}')
+            self.pending_added.discard(ban[0])
+            self.pending_removed.add(ban[0])
+        if bans:
+            self.queue_write([self.make_delete(ban[0]) for ban in bans])
+            self.banpublish_update()
+        return len(bans)
+
+    def undo_ban(self) -> Optional[Ban]:
+        if len(self.pending_added):
+            network = next(reversed(self.pending_added.networks))
+            ban = (network, *self.pending_added.networks[network])
+        else:
+            bans = self.select('ORDER BY id DESC LIMIT ?',
+                               (len(self.pending_removed) + 1,))
+            if not bans:
+                return None
+            ban = bans[0]
+        log.info(f'Removing banned network: {ban[0]} {list(ban[1:])}')
+        self.pending_added.discard(ban[0])
+        self.pending_removed.add(ban[0])
+        self.queue_write([self.make_delete(ban[0])])
+        self.banpublish_update()
+        return ban
+
+    def arm_expiry_timer(self, expiry):
+        """sets the timer of vacuum_bans for a ban that expires at the given
+        time, unless it is set to run before"""
+        when = max(expiry, self.last_vacuum + EXPIRY_INTERVAL)
+        if self.expiry_call is not None and self.expiry_call.active():
+            if self.expiry_time <= when:
+                return
+            self.expiry_call.cancel()
+        self.expiry_time = when
+        self.expiry_call = reactor.callLater(max(when - time.time(), 0),
+                                             self.vacuum_bans)
+
+    def arm_next_expiry(self, _=None):
+        """sets the timer for the next ban to expire, which is found with the
+        expiry index"""
+        if self.closed:
+            return
+        expiries = [value[2] for value in self.pending_added.networks.values()
+                    if value[2] is not None]
+        expiries += self.connection.execute(
+            'SELECT MIN(expiry) FROM bans WHERE expiry IS NOT NULL').fetchone()
+        expiries = [expiry for expiry in expiries if expiry is not None]
+        if expiries:
+            self.arm_expiry_timer(min(expiries))
+
+    def vacuum_bans(self):
+        """removes the bans that expired, in the worker thread"""
+        if self.expiry_call is not None and self.expiry_call.active():
+            # run by the vacuum loop, the timer is armed again afterwards
+            self.expiry_call.cancel()
+        self.expiry_call = None
+        now = self.last_vacuum = time.time()
+        for network, value in list(self.pending_added.networks.items()):
+            if is_expired(value[2], now):
+                self.pending_added.discard(network)
+        d = self.queue_write([(
+            'DELETE FROM bans WHERE expiry IS NOT NULL AND expiry <= ?',
+            (now,))])
+        d.addCallback(lambda _: self.banpublish_update())
+        d.addCallback(self.arm_next_expiry)
+        return d
@@ -22,11 +22,11 @@ from aiohttp import web
 
 from jinja2 import Environment, PackageLoader, select_autoescape
 import time
-from PIL import Image
-from io import BytesIO
 from aiohttp.abc import AbstractAccessLogger
 from twisted.logger import Logger
-from piqueserver.utils import as_deferred
+from piqueserver.utils import as_deferred, matches_etag
+from piqueserver import metrics
+from piqueserver.overview import MAX_ZOOM, Overview
 
 from piqueserver.config import config, cast_duration
 
@@ -118,40 +118,65 @@ class DefaultStatusServer(BaseStatusServer):
         self.last_update = None
         self.last_map_name = None
         self.cached_overview = None
+        self.overview_image = Overview()
         env = Environment(
             loader=PackageLoader('piqueserver.web'),
             autoescape=select_autoescape(),
         )
         self.status_template = env.get_template('status.html')
+        metrics.gc_monitor.install()
 
     async def json(self, request):
         state = current_state(self.protocol)
         return web.json_response(state)
 
+    async def metrics(self, request):
+        return web.Response(body=metrics.render_metrics(self.protocol),
+                            headers={'Content-Type': metrics.CONTENT_TYPE})
+
     @property
     def current_map(self):
         return self.protocol.map_info.name
 
-    def update_cached_overview(self):
-        """Updates cached overview"""
-        overview = self.protocol.map.get_overview(rgba=True)
-        image = Image.frombytes('RGBA', (512, 512), overview)
-        data = BytesIO()
-        image.save(data, 'png')
-        self.cached_overview = data.getvalue()
+    async def update_cached_overview(self):
+        """Updates cached overview, redrawing only the parts of the map that
+        changed and encoding it in a worker thread"""
+        map_name = self.protocol.map_info.name
+        self.cached_overview = await self.overview_image.get_png(
+            self.protocol.map)
         self.last_update = time.time()
-        self.last_map_name = self.protocol.map_info.name
+        self.last_map_name = map_name
 
     async def overview(self, request):
         # update cache on a set interval or map change or initialization
         if (self.cached_overview is None or
                 self.last_map_name != self.current_map or
                 time.time() - self.last_update > interval_option.get()):
-            self.update_cached_overview()
+            await self.update_cached_overview()
 
         return web.Response(body=self.cached_overview,
                             content_type='image/png')
 
+    async def tile(self, request):
+        """Serves a tile of the overview, see piqueserver.overview. Viewers
+        should send back the ETag, tiles that did not change get a 304"""
+        zoom = int(request.match_info['zoom'])
+        x = int(request.match_info['x'])
+        y = int(request.match_info['y'])
+        if zoom > MAX_ZOOM or x >= 1 << zoom or y >= 1 << zoom:
+            raise web.HTTPNotFound()
+        await self.overview_image.update(self.protocol.map)
+        etag = self.overview_image.get_etag(zoom, x, y)
+        # viewers check every time, which only costs a 304 while the tile is
+        # unchanged
+        headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+        if matches_etag(request.headers.get('If-None-Match', ''), etag):
+            return web.Response(status=304, headers=headers)
+        # not get_tile(), which could draw changes newer than the ETag
+        body = await self.overview_image.encode_tile(zoom, x, y)
+        return web.Response(body=body, content_type='image/png',
+                            headers=headers)
+
     async def index(self, request):
         rendered = self.status_template.render(server=self.protocol)
         return web.Response(body=rendered, content_type='text/html')
@@ -162,6 +187,8 @@ class DefaultStatusServer(BaseStatusServer):
         app.add_routes([
             web.get('/json', self.json),
             web.get('/overview', self.overview),
+            web.get(r'/tiles/{zoom:\d+}/{x:\d+}/{y:\d+}.png', self.tile),
+            web.get('/metrics', self.metrics),
             web.get('/', self.index)
         ])
         return app
@@ -0,0 +1,378 @@
+"""
+Supervisor mode: run several game servers as worker processes of one parent.
+
+When ``[supervisor] workers`` is set, :func:`piqueserver.server.run` does not
+start a game server itself. Instead it starts one worker process per entry,
+each running the normal server with that entry's settings applied on top of
+the config file, e.g.::
+
+    [supervisor]
+    workers = [
+      {port = 32887},
+      {port = 32888, game_mode = "tc"},
+    ]
+
+The parent owns the state that should be shared between the workers: it keeps
+the authoritative ban list (and the bans file) and serves one status server
+with the state of all workers. Each worker keeps its own status server, for
+its metrics and map images, on ``worker_status_port`` plus its index unless
+its entry sets ``status_server.port``. Workers talk to the parent over a
+local TCP connection using newline delimited JSON messages. The first message must
+carry a random token the parent passes to its workers, so that other local
+users cannot change the bans.
+"""
+
+import asyncio
+import hmac
+import json
+import os
+import secrets
+import sys
+from typing import Any, Dict, List, Optional
+
+from aiohttp import web
+from twisted.internet import reactor
+from twisted.internet.defer import ensureDeferred
+from twisted.logger import Logger, globalLogBeginner, textFileLogObserver
+
+from piqueserver.bans import DefaultBanManager
+from piqueserver.config import config, cast_duration
+from piqueserver.networkdict import make_network
+from piqueserver.utils import as_deferred
+
+# set in the environment of worker processes as
+# "<worker index>:<ipc port>:<token>"
+WORKER_ENV = 'PIQUESERVER_SUPERVISOR'
+WORKER_BAN_BACKEND = 'piqueserver.bans.SupervisedBanManager'
+DEFAULT_BAN_BACKEND = 'piqueserver.bans.DefaultBanManager'
+# longest message accepted over the IPC connection. The whole ban list is sent
+# as one message, so this is far above the default of 64 KiB
+IPC_LIMIT = 64 * 1024 * 1024
+
+supervisor_config = config.section('supervisor')
+workers_option = supervisor_config.option('workers', default=[])
+ipc_port_option = supervisor_config.option('ipc_port', default=32884)
+pin_cpus_option = supervisor_config.option('pin_cpus', default=True)
+restart_delay_option = supervisor_config.option(
+    'restart_delay', default='5sec', cast=cast_duration)
+worker_status_port_option = supervisor_config.option(
+    'worker_status_port', default=32890)
+state_interval_option = supervisor_config.option(
+    'state_interval', default='5sec', cast=cast_duration)
+
+port_option = config.option('port', default=32887)
+bans_backend_option = config.section('bans').option(
+    'backend', default=DEFAULT_BAN_BACKEND)
+status_server_config = config.section('status_server')
+status_server_enabled = status_server_config.option('enabled', False)
+status_host_option = status_server_config.option('host', '0.0.0.0')
+status_port_option = status_server_config.option('port', 32886)
+
+log = Logger()
+
+
+def is_supervisor() -> bool:
+    """Returns True if this process should supervise workers instead of
+    running a game server"""
+    return bool(workers_option.get()) and not is_worker()
+
+
+def is_worker() -> bool:
+    """Returns True if this process was started by a supervisor"""
+    return WORKER_ENV in os.environ
+
+
+def encode_message(message_type: str, **kw) -> bytes:
+    kw['type'] = message_type
+    return json.dumps(kw).encode('utf-8') + b'\n'
+
+
+def decode_message(line: bytes) -> Dict[str, Any]:
+    return json.loads(line.decode('utf-8'))
+
+
+def worker_overrides(index: int, entry: Dict[str, Any]) -> Dict[str, Any]:
+    """Builds the config overrides passed to the worker with the given index"""
+    overrides = {
+        'bans': {'backend': WORKER_BAN_BACKEND},
+        'status_server': {'port': worker_status_port_option.get() + index},
+    }
+    if index != 0:
+        # all replicas hold the same bans, one publisher is enough
+        overrides['bans']['publish'] = False
+    port = entry.get('port', port_option.get())
+    overrides['logging'] = {'logfile': './logs/log-{}.txt'.format(port)}
+    for key, value in entry.items():
+        if isinstance(value, dict) and isinstance(overrides.get(key), dict):
+            overrides[key].update(value)
+        else:
+            overrides[key] = value
+    overrides.pop('cpu', None)
+    return overrides
+
+
+class SupervisorBanManager(DefaultBanManager):
+    """
+    Authoritative ban list kept by the supervisor. There are no players in the
+    supervisor process, kicking is done by the workers.
+    """
+
+    def kick_network(self, network) -> Optional[str]:
+        return None
+
+    def announce_ban(self, address, name, reason, duration):
+        pass
+
+    def vacuum_bans(self):
+        removed = super().vacuum_bans()
+        if removed:
+            self.protocol.broadcast(
+                'bans_removed', networks=[str(network) for network in removed])
+        return removed
+
+
+class Worker:
+    def __init__(self, index: int, entry: Dict[str, Any]):
+        self.index = index
+        self.entry = entry
+        self.process = None
+        self.writer = None
+        self.state = None
+
+    @property
+    def port(self) -> int:
+        return self.entry.get('port', port_option.get())
+
+    @property
+    def status_port(self) -> int:
+        return worker_overrides(self.index, self.entry)['status_server']['port']
+
+    def send(self, message_type: str, **kw) -> None:
+        if self.writer is not None:
+            self.writer.write(encode_message(message_type, **kw))
+
+
+class Supervisor:
+    """
+    Starts and restarts the worker processes and serves the shared state to
+    them.
+    """
+
+    def __init__(self, entries: List[Dict[str, Any]]):
+        self.workers = [Worker(index, dict(entry))
+                        for index, entry in enumerate(entries)]
+        backend = bans_backend_option.get()
+        if backend != DEFAULT_BAN_BACKEND:
+            log.warn('[bans] backend = "{backend}" is not used in supervisor '
+                     'mode, the supervisor keeps the bans in the bans file '
+                     'and the workers use {worker_backend}',
+                     backend=backend, worker_backend=WORKER_BAN_BACKEND)
+        self.ban_manager = SupervisorBanManager(self)
+        # required in the hello message of the workers
+        self.token = secrets.token_hex(16)
+        self.ipc_server = None
+        self.stopping = False
+        try:
+            self.cpus = sorted(os.sched_getaffinity(0))
+        except AttributeError:
+            self.cpus = []
+
+    async def start(self) -> None:
+        self.ipc_server = await asyncio.start_server(
+            self.handle_worker, '127.0.0.1', ipc_port_option.get(),
+            limit=IPC_LIMIT)
+        for worker in self.workers:
+            asyncio.ensure_future(self.run_worker(worker))
+        if status_server_enabled.get():
+            await self.listen_status()
+
+    def stop(self) -> None:
+        self.stopping = True
+        for worker in self.workers:
+            if worker.process is not None and worker.process.returncode is None:
+                worker.process.terminate()
+        if self.ipc_server is not None:
+            self.ipc_server.close()
+
+    def worker_command(self, worker: Worker) -> List[str]:
+        return [sys.executable, '-m', 'piqueserver',
+                '-d', config.config_dir,
+                '-c', config.config_file,
+                '-j', json.dumps(worker_overrides(worker.index, worker.entry))]
+
+    async def run_worker(self, worker: Worker) -> None:
+        env = dict(os.environ)
+        env[WORKER_ENV] = '{}:{}:{}'.format(worker.index, ipc_port_option.get(),
+                                            self.token)
+        while not self.stopping:
+            worker.process = await asyncio.create_subprocess_exec(
+                *self.worker_command(worker), env=env)
+            self.pin_worker(worker)
+            log.info('started worker {index} on port {port} (pid {pid})',
+                     index=worker.index, port=worker.port,
+                     pid=worker.process.pid)
+            returncode = await worker.process.wait()
+            worker.state = None
+            if self.stopping:
+                break
+            log.warn('worker {index} exited with code {code}, restarting',
+                     index=worker.index, code=returncode)
+            await asyncio.sleep(restart_delay_option.get())
+
+    def pin_worker(self, worker: Worker) -> None:
+        cpu = worker.entry.get('cpu')
+        if cpu is None:
+            if not pin_cpus_option.get() or not self.cpus:
+                return
+            cpu = self.cpus[worker.index % len(self.cpus)]
+        try:
+            os.sched_setaffinity(worker.process.pid, {cpu})
+        except (AttributeError, OSError) as e:
+            log.warn('could not pin worker {index} to cpu {cpu}: {error}',
+                     index=worker.index, cpu=cpu, error=e)
+
+    async def handle_worker(self, reader, writer) -> None:
+        worker = None
+        try:
+            async for line in reader:
+                message = decode_message(line)
+                if worker is None:
+                    if (message['type'] != 'hello' or
+                            not hmac.compare_digest(str(message['token']),
+                                                    self.token)):
+                        log.warn('refused IPC connection without the token')
+                        break
+                    worker = self.workers[message['index']]
+                    worker.writer = writer
+                    worker.send('bans',
+                                bans=self.ban_manager.database.make_list())
+                else:
+                    self.on_message(worker, message)
+        except (ConnectionError, ValueError, KeyError, IndexError) as e:
+            log.warn('lost connection to worker: {error}', error=e)
+        finally:
+            if worker is not None and worker.writer is writer:
+                worker.writer = None
+            writer.close()
+
+    def on_message(self, worker: Worker, message: Dict[str, Any]) -> None:
+        message_type = message['type']
+        if message_type == 'add_ban':
+            name, network, reason, expiry = message['ban']
+            value = (name, reason, expiry)
+            self.ban_manager.database[network] = value
+            self.ban_manager.schedule_expiry(make_network(network), expiry)
+            self.ban_manager.save_change(added=[(network, value)])
+            self.broadcast('ban_added', worker, ban=message['ban'])
+        elif message_type == 'remove_bans':
+            for network in message['networks']:
+                self.ban_manager.database.discard(network)
+            self.ban_manager.save_change(removed=message['networks'])
+            self.broadcast('bans_removed', worker,
+                           networks=message['networks'])
+        elif message_type == 'state':
+            worker.state = message['state']
+
+    def broadcast(self, message_type: str, sender: Optional[Worker] = None,
+                  **kw) -> None:
+        for worker in self.workers:
+            if worker is not sender:
+                worker.send(message_type, **kw)
+
+    async def json(self, request):
+        servers = [dict(worker.state, statusPort=worker.status_port)
+                   for worker in self.workers if worker.state is not None]
+        return web.json_response({'servers': servers})
+
+    async def listen_status(self) -> None:
+        app = web.Application()
+        app.add_routes([web.get('/json', self.json)])
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, status_host_option.get(),
+                           status_port_option.get())
+        await site.start()
+
+
+class SupervisorClient:
+    """
+    Connection from a worker process to its supervisor.
+    """
+
+    def __init__(self, protocol, port: int, index: int, token: str):
+        self.protocol = protocol
+        self.port = port
+        self.index = index
+        self.token = token
+        self.writer = None
+        self.pending = []
+        self.handlers = {}
+
+    def send(self, message_type: str, **kw) -> None:
+        data = encode_message(message_type, **kw)
+        if self.writer is None:
+            self.pending.append(data)
+        else:
+            self.writer.write(data)
+
+    async def run(self) -> None:
+        state_task = None
+        try:
+            reader, self.writer = await asyncio.open_connection(
+                '127.0.0.1', self.port, limit=IPC_LIMIT)
+            self.writer.write(encode_message('hello', index=self.index,
+                                             token=self.token))
+            for data in self.pending:
+                self.writer.write(data)
+            self.pending = []
+            state_task = asyncio.ensure_future(self.send_state())
+            async for line in reader:
+                message = decode_message(line)
+                handler = self.handlers.get(message['type'])
+                if handler is not None:
+                    handler(message)
+            log.error('lost connection to supervisor, shutting down')
+        except Exception as e:
+            # without the supervisor the bans are out of date, better stop
+            # than keep running without them
+            log.error('error in connection to supervisor, shutting down: '
+                      '{error}', error=e)
+        finally:
+            if state_task is not None:
+                state_task.cancel()
+            self.writer = None
+        reactor.stop()
+
+    async def send_state(self) -> None:
+        from piqueserver.statusserver import current_state
+        while True:
+            try:
+                self.send('state', state=current_state(self.protocol))
+            except AttributeError:
+                # map not loaded yet
+                pass
+            await asyncio.sleep(state_interval_option.get())
+
+
+def start_client(protocol) -> SupervisorClient:
+    index, port, token = os.environ[WORKER_ENV].split(':', 2)
+    client = SupervisorClient(protocol, int(port), int(index), token)
+    ensureDeferred(as_deferred(client.run()))
+    return client
+
+
+def run() -> None:
+    """
+    runs the supervisor and its workers until interrupted
+    """
+    globalLogBeginner.beginLoggingTo([textFileLogObserver(sys.stderr)])
+    supervisor = Supervisor(workers_option.get())
+
+    def start():
+        ensureDeferred(as_deferred(supervisor.start()))
+
+    reactor.callWhenRunning(start)
+    reactor.addSystemEventTrigger('before', 'shutdown', supervisor.stop)
+    log.info('Started supervisor with {count} workers',
+             count=len(supervisor.workers))
+    reactor.run()
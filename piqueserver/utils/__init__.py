@@ -5,4 +5,14 @@ from ._async import as_deferred, as_future, EndCall
 
 def ensure_dir_exists(filename: str) -> None:
     d = os.path.dirname(filename)
-    os.makedirs(d, exist_ok=True)
\ No newline at end of file
+    os.makedirs(d, exist_ok=True)
+
+
+def matches_etag(header: str, etag: str) -> bool:
+    """returns whether an If-None-Match header matches the ETag"""
+    for tag in header.split(','):
+        tag = tag.strip()
+        # If-None-Match uses the weak comparison
+        if tag == '*' or tag.replace('W/', '', 1) == etag:
+            return True
+    return False
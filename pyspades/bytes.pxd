@@ -1,11 +1,11 @@
-from libc.math cimport NAN
-
 DEF INT_ERROR = -0xFFFFFFFF >> 1
 DEF LONG_LONG_ERROR = -0xFFFFFFFFFFFFFFFF >> 1
 
-cdef extern from "<sstream>" namespace "std":
-    cdef cppclass stringstream:
-        pass
+cdef extern from "bytes_c.cpp":
+    struct ByteBuffer:
+        char * data
+        size_t pos, size
+        int exports
 
 cdef class ByteReader:
     cdef char * data
@@ -14,6 +14,7 @@ cdef class ByteReader:
     cdef int start, size
     cdef object input
 
+    cpdef reset(self, input_data, int start = ?, int size = ?)
     cdef char * check_available(self, int size) except NULL
     cpdef read(self, int bytecount = ?)
     cpdef int readByte(self, bint unsigned = ?) except INT_ERROR
@@ -21,7 +22,7 @@ cdef class ByteReader:
                         except INT_ERROR
     cpdef long long readInt(self, bint unsigned = ?, bint big_endian = ?) \
                             except LONG_LONG_ERROR
-    cpdef float readFloat(self, bint big_endian = ?) except? NAN
+    cpdef float readFloat(self, bint big_endian = ?) except? -1
     cpdef bytes readString(self, int size = ?)
     cpdef ByteReader readReader(self, int size = ?)
     cpdef int dataLeft(self)
@@ -32,9 +33,9 @@ cdef class ByteReader:
     cpdef size_t tell(self)
 
 cdef class ByteWriter:
-    cdef stringstream * stream
+    cdef ByteBuffer * buffer
 
-    cdef void writeSize(self, char * data, int size)
+    cdef int writeSize(self, char * data, int size) except -1
     cpdef write(self, data)
     cpdef writeByte(self, int value, bint unsigned = ?)
     cpdef writeShort(self, int value, bint unsigned = ?,
@@ -47,3 +48,4 @@ cdef class ByteWriter:
     cpdef pad(self, int bytecount)
     cpdef rewind(self, int bytecount)
     cpdef size_t tell(self)
+    cpdef reset(self)
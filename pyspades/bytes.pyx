@@ -20,7 +20,8 @@ The ByteReader/Bytewriter classes are used to read and write various data types
 from and to byte-like objects. This is used e.g. to read the contents of
 packets.
 """
-from libc.math cimport NAN
+from cpython.buffer cimport (PyBUF_FORMAT, PyBUF_ND, PyBUF_STRIDES,
+                             PyBUF_WRITABLE)
 
 cdef extern from "bytes_c.cpp":
     char read_byte(char * data)
@@ -32,25 +33,23 @@ cdef extern from "bytes_c.cpp":
     double read_float(char * data, int big_endian)
     char * read_string(char * data)
 
-    stringstream * create_stream()
-    void delete_stream(stringstream * stream)
-    void write_byte(stringstream * stream, char value)
-    void write_ubyte(stringstream * stream, unsigned char value)
-    void write_short(stringstream * stream, short value, int big_endian)
-    void write_ushort(stringstream * stream, unsigned short value, int big_endian)
-    void write_int(stringstream * stream, int value, int big_endian)
-    void write_uint(stringstream * stream, unsigned int value, int big_endian)
-    void write_float(stringstream * stream, double value, int big_endian)
-    void write_string(stringstream * stream, char * data, size_t size)
-    void write(stringstream * stream, char * data, size_t size)
-    void rewind_stream(stringstream * stream, int bytecount)
-    object get_stream(stringstream * stream)
-    size_t get_stream_size(stringstream * stream)
-    size_t get_stream_pos(stringstream * stream)
-
-cdef extern from "<sstream>" namespace "std":
-    cdef cppclass stringstream:
-        pass
+    ByteBuffer * create_buffer() except NULL
+    void delete_buffer(ByteBuffer * buffer)
+    int write_byte(ByteBuffer * buffer, char value) except -1
+    int write_ubyte(ByteBuffer * buffer, unsigned char value) except -1
+    int write_short(ByteBuffer * buffer, short value, int big_endian) except -1
+    int write_ushort(ByteBuffer * buffer, unsigned short value,
+                     int big_endian) except -1
+    int write_int(ByteBuffer * buffer, int value, int big_endian) except -1
+    int write_uint(ByteBuffer * buffer, unsigned int value,
+                   int big_endian) except -1
+    int write_float(ByteBuffer * buffer, double value, int big_endian) except -1
+    int write_string(ByteBuffer * buffer, char * data, size_t size) except -1
+    int write_padding(ByteBuffer * buffer, size_t size) except -1
+    int write(ByteBuffer * buffer, char * data, size_t size) except -1
+    void rewind_buffer(ByteBuffer * buffer, int bytecount)
+    void reset_buffer(ByteBuffer * buffer)
+    object get_buffer(ByteBuffer * buffer)
 
 class NoDataLeft(Exception):
     pass
@@ -61,6 +60,19 @@ DEF LONG_LONG_ERROR = -0xFFFFFFFFFFFFFFFF >> 1
 cdef class ByteReader:
     """Reads various data types from a bytes-like object"""
     def __init__(self, input_data, int start = 0, int size = -1):
+        self.reset(input_data, start, size)
+
+    cpdef reset(self, input_data, int start = 0, int size = -1):
+        """bind the reader to a new buffer, without allocating a new reader
+
+        The buffer is not copied, the reader only keeps a reference to it.
+
+        Arguments:
+            input_data: The bytes-like object to read from
+            start (int, optional): Offset into ``input_data`` to start at
+            size (int, optional): Number of bytes to read. If omitted, all bytes
+                after ``start`` are available
+        """
         self.input = input_data
         self.data = input_data
         self.data += start
@@ -143,7 +155,7 @@ cdef class ByteReader:
         else:
             return read_int(pos, big_endian)
 
-    cpdef float readFloat(self, bint big_endian = True) except? NAN:
+    cpdef float readFloat(self, bint big_endian = True) except? -1:
         """read four bytes of data as floating point number
 
         Arguments:
@@ -238,62 +250,101 @@ cdef class ByteReader:
         return self.data[:self.size]
 
 cdef class ByteWriter:
-    def __init__(self):
-        self.stream = create_stream()
+    """Writes various data types into a contiguous, growable buffer
 
-    cdef void writeSize(self, char * data, int size):
-        write(self.stream, data, size)
+    The written data can be retrieved with ``bytes(writer)``, or accessed
+    without copying through the buffer protocol, e.g. with
+    ``memoryview(writer)``. The writer cannot grow while such a view exists.
+    """
+    def __cinit__(self):
+        self.buffer = create_buffer()
+
+    cdef int writeSize(self, char * data, int size) except -1:
+        return write(self.buffer, data, size)
 
     cpdef write(self, data):
-        write(self.stream, data, len(data))
+        write(self.buffer, data, len(data))
 
     cpdef writeByte(self, int value, bint unsigned = False):
         if unsigned:
-            write_ubyte(self.stream, value)
+            write_ubyte(self.buffer, value)
         else:
-            write_byte(self.stream, value)
+            write_byte(self.buffer, value)
 
     cpdef writeShort(self, int value, bint unsigned = False,
                      bint big_endian = True):
         if unsigned:
-            write_ushort(self.stream, value, big_endian)
+            write_ushort(self.buffer, value, big_endian)
         else:
-            write_short(self.stream, value, big_endian)
+            write_short(self.buffer, value, big_endian)
 
     cpdef writeInt(self, long long value, bint unsigned = False,
                    bint big_endian = True):
         if unsigned:
-            write_uint(self.stream, value, big_endian)
+            write_uint(self.buffer, value, big_endian)
         else:
-            write_int(self.stream, value, big_endian)
+            write_int(self.buffer, value, big_endian)
 
     cpdef writeFloat(self, float value, bint big_endian = True):
-        write_float(self.stream, value, big_endian)
+        write_float(self.buffer, value, big_endian)
 
     cpdef writeStringSize(self, char * value, int size):
-        write_string(self.stream, value, size)
+        write_string(self.buffer, value, size)
 
     cpdef writeString(self, value, int size = -1):
-        write_string(self.stream, value, len(value))
+        write_string(self.buffer, value, len(value))
         if size != -1:
             self.pad(size - (len(value) + 1))
 
     cpdef pad(self, int bytecount):
-        cdef int i
-        for i in range(bytecount):
-            write_ubyte(self.stream, 0)
+        if bytecount > 0:
+            write_padding(self.buffer, bytecount)
 
     cpdef rewind(self, int bytecount):
-        rewind_stream(self.stream, bytecount)
+        rewind_buffer(self.buffer, bytecount)
 
     cpdef size_t tell(self):
-        return get_stream_pos(self.stream)
+        return self.buffer.pos
+
+    cpdef reset(self):
+        """discard all written data, keeping the allocated buffer
+
+        This allows reusing one writer for many packets.
+        """
+        if self.buffer.exports > 0:
+            raise BufferError('cannot reset a ByteWriter while it is exported')
+        reset_buffer(self.buffer)
+
+    def __getbuffer__(self, Py_buffer * view, int flags):
+        if flags & PyBUF_WRITABLE:
+            raise BufferError('ByteWriter buffers are read-only')
+        view.buf = self.buffer.data
+        view.obj = self
+        view.len = self.buffer.size
+        view.readonly = 1
+        view.itemsize = 1
+        view.format = NULL
+        if flags & PyBUF_FORMAT:
+            view.format = 'B'
+        view.ndim = 1
+        view.shape = NULL
+        if flags & PyBUF_ND:
+            view.shape = &view.len
+        view.strides = NULL
+        if flags & PyBUF_STRIDES:
+            view.strides = &view.itemsize
+        view.suboffsets = NULL
+        view.internal = NULL
+        self.buffer.exports += 1
+
+    def __releasebuffer__(self, Py_buffer * view):
+        self.buffer.exports -= 1
 
     def __bytes__(self):
-        return get_stream(self.stream)
+        return get_buffer(self.buffer)
 
     def __dealloc__(self):
-        delete_stream(self.stream)
+        delete_buffer(self.buffer)
 
     def __len__(self):
-        return get_stream_size(self.stream)
+        return self.buffer.size
@@ -18,20 +18,81 @@
 */
 
 #include "Python.h"
-#include <iostream>
-#include <sstream>
-#include <string>
-using namespace std;
+#include <stdint.h>
+#include <stdlib.h>
+#include <string.h>
 
-stringstream *create_stream()
+// contiguous growable buffer used by ByteWriter
+struct ByteBuffer
 {
-    stringstream *ss = new stringstream(stringstream::out | stringstream::binary);
-    return ss;
+    char *data;
+    size_t pos;      // current write position
+    size_t size;     // number of bytes written
+    size_t capacity; // number of bytes allocated
+    int exports;     // number of buffer views exported to Python
+};
+
+#define INITIAL_BUFFER_SIZE 64
+
+ByteBuffer *create_buffer()
+{
+    ByteBuffer *buffer = (ByteBuffer *)malloc(sizeof(ByteBuffer));
+    if (buffer == NULL)
+    {
+        PyErr_NoMemory();
+        return NULL;
+    }
+    buffer->data = (char *)malloc(INITIAL_BUFFER_SIZE);
+    if (buffer->data == NULL)
+    {
+        free(buffer);
+        PyErr_NoMemory();
+        return NULL;
+    }
+    buffer->pos = buffer->size = 0;
+    buffer->capacity = INITIAL_BUFFER_SIZE;
+    buffer->exports = 0;
+    return buffer;
 }
 
-void delete_stream(stringstream *ss)
+void delete_buffer(ByteBuffer *buffer)
 {
-    delete ss;
+    if (buffer == NULL)
+        return;
+    free(buffer->data);
+    free(buffer);
+}
+
+// make room for `count` bytes at the write position and advance it. Returns
+// the location to write to, or NULL with a Python exception set
+inline char *reserve(ByteBuffer *buffer, size_t count)
+{
+    size_t end = buffer->pos + count;
+    if (end > buffer->capacity)
+    {
+        if (buffer->exports > 0)
+        {
+            PyErr_SetString(PyExc_BufferError,
+                            "cannot resize a ByteWriter while it is exported");
+            return NULL;
+        }
+        size_t capacity = buffer->capacity * 2;
+        while (capacity < end)
+            capacity *= 2;
+        char *data = (char *)realloc(buffer->data, capacity);
+        if (data == NULL)
+        {
+            PyErr_NoMemory();
+            return NULL;
+        }
+        buffer->data = data;
+        buffer->capacity = capacity;
+    }
+    char *pos = buffer->data + buffer->pos;
+    buffer->pos = end;
+    if (end > buffer->size)
+        buffer->size = end;
+    return pos;
 }
 
 /*
@@ -107,108 +168,137 @@ write methods
 
 // byte
 
-inline void write_byte(stringstream *ss, int8_t value)
+inline int write_byte(ByteBuffer *buffer, int8_t value)
 {
-    ss->put(value);
+    char *out = reserve(buffer, 1);
+    if (out == NULL)
+        return -1;
+    out[0] = value;
+    return 0;
 }
 
-inline void write_ubyte(stringstream *ss, uint8_t value)
+inline int write_ubyte(ByteBuffer *buffer, uint8_t value)
 {
-    ss->put((char)value);
+    return write_byte(buffer, (int8_t)value);
 }
 
 // short
 
-inline void write_short(stringstream *ss, int16_t value, int big_endian)
+inline int write_short(ByteBuffer *buffer, int16_t value, int big_endian)
 {
+    char *out = reserve(buffer, 2);
+    if (out == NULL)
+        return -1;
     if (big_endian)
     {
-        ss->put((char)(value >> 8));
-        ss->put((char)value);
+        out[0] = (char)(value >> 8);
+        out[1] = (char)value;
     }
     else
     {
-        ss->put((char)value);
-        ss->put((char)(value >> 8));
+        out[0] = (char)value;
+        out[1] = (char)(value >> 8);
     }
+    return 0;
 }
 
-inline void write_ushort(stringstream *ss, uint16_t value,
-                         int big_endian)
+inline int write_ushort(ByteBuffer *buffer, uint16_t value, int big_endian)
 {
-    write_short(ss, (short)value, big_endian);
+    return write_short(buffer, (short)value, big_endian);
 }
 
 // int
 
-inline void write_int(stringstream *ss, int32_t value, int big_endian)
+inline int write_int(ByteBuffer *buffer, int32_t value, int big_endian)
 {
+    char *out = reserve(buffer, 4);
+    if (out == NULL)
+        return -1;
     if (big_endian)
     {
-        ss->put((char)(value >> 24));
-        ss->put((char)(value >> 16));
-        ss->put((char)(value >> 8));
-        ss->put((char)value);
+        out[0] = (char)(value >> 24);
+        out[1] = (char)(value >> 16);
+        out[2] = (char)(value >> 8);
+        out[3] = (char)value;
     }
     else
     {
-        ss->put((char)value);
-        ss->put((char)(value >> 8));
-        ss->put((char)(value >> 16));
-        ss->put((char)(value >> 24));
+        out[0] = (char)value;
+        out[1] = (char)(value >> 8);
+        out[2] = (char)(value >> 16);
+        out[3] = (char)(value >> 24);
     }
+    return 0;
 }
 
-inline void write_uint(stringstream *ss, uint32_t value,
-                       int big_endian)
+inline int write_uint(ByteBuffer *buffer, uint32_t value, int big_endian)
 {
-    write_int(ss, (int)value, big_endian);
+    return write_int(buffer, (int)value, big_endian);
 }
 
 // float
 
-inline void write_float(stringstream *ss, double value, int big_endian)
+inline int write_float(ByteBuffer *buffer, double value, int big_endian)
 {
-    char out[4];
+    char *out = reserve(buffer, 4);
+    if (out == NULL)
+        return -1;
     #if (PY_MAJOR_VERSION >= 3 && PY_MINOR_VERSION >= 11)
-        PyFloat_Pack4(value, (char *)&out, !big_endian);
+        return PyFloat_Pack4(value, out, !big_endian);
     #else
-        _PyFloat_Pack4(value, (unsigned char *)&out, !big_endian);
+        return _PyFloat_Pack4(value, (unsigned char *)out, !big_endian);
     #endif
-    ss->write(out, 4);
 }
 
-inline void write_string(stringstream *ss, char *data, size_t size)
+inline int write(ByteBuffer *buffer, const char *data, size_t size)
 {
-    ss->write(data, size);
-    ss->put(0);
+    char *out = reserve(buffer, size);
+    if (out == NULL)
+        return -1;
+    memcpy(out, data, size);
+    return 0;
 }
 
-inline void write(stringstream *ss, char *data, size_t size)
+inline int write_string(ByteBuffer *buffer, const char *data, size_t size)
 {
-    ss->write(data, size);
+    char *out = reserve(buffer, size + 1);
+    if (out == NULL)
+        return -1;
+    memcpy(out, data, size);
+    out[size] = 0;
+    return 0;
 }
 
-inline void rewind_stream(stringstream *ss, int bytes)
+inline int write_padding(ByteBuffer *buffer, size_t size)
 {
-    ss->seekp(-bytes, stringstream::cur);
+    char *out = reserve(buffer, size);
+    if (out == NULL)
+        return -1;
+    memset(out, 0, size);
+    return 0;
 }
 
-inline size_t get_stream_size(stringstream *ss)
+inline void rewind_buffer(ByteBuffer *buffer, int bytes)
 {
-    return ss->str().length();
+    if (bytes < 0)
+    {
+        // move forward, but not past the written data
+        buffer->pos += -(long)bytes;
+        if (buffer->pos > buffer->size)
+            buffer->pos = buffer->size;
+    }
+    else if ((size_t)bytes > buffer->pos)
+        buffer->pos = 0;
+    else
+        buffer->pos -= bytes;
 }
 
-inline size_t get_stream_pos(stringstream *ss)
+inline void reset_buffer(ByteBuffer *buffer)
 {
-    streampos pos = ss->tellp();
-    if (pos == (streampos)-1)
-        return 0;
-    return pos;
+    buffer->pos = buffer->size = 0;
 }
 
-inline PyObject *get_stream(stringstream *ss)
+inline PyObject *get_buffer(ByteBuffer *buffer)
 {
-    const string tmp = ss->str();
-    return PyBytes_FromStringAndSize(tmp.c_str(), tmp.length());
+    return PyBytes_FromStringAndSize(buffer->data, buffer->size);
 }
@@ -0,0 +1,158 @@
+"""
+Capturing and replaying the enet events received by a protocol.
+
+A capture file starts with MAGIC, followed by one record per event. A record
+is a RECORD header (time since the start of the capture, event type, peer id
+and a value) followed by:
+
+- connect: the peer address as ADDRESS, value is the event data (the client
+  version)
+- receive: value bytes of packet data
+- disconnect: nothing, value is the event data
+"""
+
+import socket
+import struct
+import time
+from typing import BinaryIO, Iterator, NamedTuple
+
+import enet
+
+MAGIC = b'PQCAP\x00\x01\x00'
+RECORD = struct.Struct('<dBHI')
+ADDRESS = struct.Struct('<4sH')
+
+CONNECT = enet.EVENT_TYPE_CONNECT
+DISCONNECT = enet.EVENT_TYPE_DISCONNECT
+RECEIVE = enet.EVENT_TYPE_RECEIVE
+
+
+class CaptureRecord(NamedTuple):
+    time: float
+    type: int
+    peer_id: int
+    value: int
+    # (host, port) for connect events, packet data for receive events
+    data: object
+
+
+class CaptureWriter:
+    """
+    Writes enet events to a capture file
+    """
+
+    def __init__(self, fp: BinaryIO) -> None:
+        self.fp = fp
+        self.start_time = time.monotonic()
+        fp.write(MAGIC)
+
+    def write_event(self, event) -> None:
+        event_type = event.type
+        peer = event.peer
+        timestamp = time.monotonic() - self.start_time
+        if event_type == RECEIVE:
+            data = event.packet.data
+            self.fp.write(RECORD.pack(timestamp, event_type,
+                                      peer.incomingPeerID, len(data)))
+            self.fp.write(data)
+        elif event_type == CONNECT:
+            address = peer.address
+            self.fp.write(RECORD.pack(timestamp, event_type,
+                                      peer.incomingPeerID, event.data))
+            self.fp.write(ADDRESS.pack(socket.inet_aton(address.host),
+                                       address.port))
+        elif event_type == DISCONNECT:
+            self.fp.write(RECORD.pack(timestamp, event_type,
+                                      peer.incomingPeerID, event.data))
+
+    def close(self) -> None:
+        self.fp.close()
+
+
+def read_capture(fp: BinaryIO) -> Iterator[CaptureRecord]:
+    """reads the records of a capture file"""
+    if fp.read(len(MAGIC)) != MAGIC:
+        raise ValueError('not a capture file')
+    while True:
+        header = fp.read(RECORD.size)
+        if len(header) < RECORD.size:
+            return
+        timestamp, event_type, peer_id, value = RECORD.unpack(header)
+        if event_type == RECEIVE:
+            data = fp.read(value)
+        elif event_type == CONNECT:
+            host, port = ADDRESS.unpack(fp.read(ADDRESS.size))
+            data = (socket.inet_ntoa(host), port)
+        else:
+            data = None
+        yield CaptureRecord(timestamp, event_type, peer_id, value, data)
+
+
+class ReplayAddress(NamedTuple):
+    host: str
+    port: int
+
+
+class ReplayPacket:
+    def __init__(self, data: bytes, flags: int = 0) -> None:
+        self.data = data
+        self.flags = flags
+
+
+class ReplayPeer:
+    """
+    Stands in for an enet.Peer when replaying a capture. Outgoing packets are
+    counted and dropped.
+    """
+    reliableDataInTransit = 0
+    roundTripTime = 0
+
+    def __init__(self, peer_id: int, address: ReplayAddress,
+                 event_data: int) -> None:
+        self.incomingPeerID = peer_id
+        self.address = address
+        self.eventData = event_data
+        self.packets_sent = 0
+        self.bytes_sent = 0
+
+    def send(self, channel: int, packet) -> int:
+        self.packets_sent += 1
+        self.bytes_sent += len(packet.data)
+        return 0
+
+    def disconnect(self, data: int = 0) -> None:
+        pass
+
+    def disconnect_later(self, data: int = 0) -> None:
+        pass
+
+    def reset(self) -> None:
+        pass
+
+
+class Replayer:
+    """
+    Feeds the records of a capture to a protocol, in the same way
+    BaseProtocol.service_enet does for live enet events.
+    """
+
+    def __init__(self, protocol) -> None:
+        self.protocol = protocol
+        self.peers = {}
+
+    def dispatch(self, record: CaptureRecord) -> None:
+        protocol = self.protocol
+        if record.type == RECEIVE:
+            peer = self.peers.get(record.peer_id)
+            if peer is not None and peer in protocol.connections:
+                protocol.data_received(peer, ReplayPacket(record.data))
+        elif record.type == CONNECT:
+            peer = ReplayPeer(record.peer_id, ReplayAddress(*record.data),
+                              record.value)
+            self.peers[record.peer_id] = peer
+            protocol.on_connect(peer)
+        elif record.type == DISCONNECT:
+            peer = self.peers.pop(record.peer_id, None)
+            if peer is not None:
+                peer.eventData = record.value
+                protocol.on_disconnect(peer)
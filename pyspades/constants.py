@@ -64,6 +64,8 @@ MAX_POSITION_RATE = 0.7
 
 UPDATE_FPS = 60.0
 UPDATE_FREQUENCY = 1 / UPDATE_FPS
+# how often the server wakes up when nobody is connected
+IDLE_UPDATE_FREQUENCY = 0.1
 DEFAULT_NETWORK_FPS = 60.0
 
 MIN_BLOCK_INTERVAL = 0.1
@@ -24,8 +24,11 @@ This module contains the definitions and registrations for the various packets u
 # This is due to these packets all being cdef. This means you can not assign to
 # them, and hence not use decorators on them.
 #
-# Other things that should probably be done here is using cython.freelist(n) to
-# speed up allocation for packets
+# cython.freelist(n) has no effect on these packets, since freelists can only
+# be managed by the base class. Instead, packets that clients send many times
+# per second are registered with pooled=True, so that pyspades.packet decodes
+# them into a reused instance. The read() method of a pooled packet must
+# overwrite every field.
 
 from pyspades.common import encode, decode
 from pyspades.constants import NEUTRAL_TEAM, CTF_MODE, TC_MODE
@@ -88,7 +91,7 @@ cdef class PositionData(Loader):
         writer.writeByte(self.id, True)
         write_position(writer, self.x, self.y, self.z)
 
-register_packet(PositionData)
+register_packet(PositionData, pooled=True)
 
 cdef class OrientationData(Loader):
     id = 1
@@ -114,7 +117,7 @@ cdef class OrientationData(Loader):
         writer.writeFloat(self.y, False)
         writer.writeFloat(self.z, False)
 
-register_packet(OrientationData)
+register_packet(OrientationData, pooled=True)
 
 cdef class WorldUpdate(Loader):
     id = 2
@@ -125,7 +128,8 @@ cdef class WorldUpdate(Loader):
     cpdef read(self, ByteReader reader):
         cdef list items = []
         self.items = items
-        for _ in range(32):
+        # the server leaves out the items after the highest player id
+        for _ in range(min(32, reader.dataLeft() // 24)):
             p_x = reader.readFloat(False)
             p_y = reader.readFloat(False)
             p_z = reader.readFloat(False)
@@ -175,7 +179,7 @@ cdef class InputData(Loader):
             (self.sneak << 6) | (self.sprint << 7))
         writer.writeByte(byte, True)
 
-register_packet(InputData)
+register_packet(InputData, pooled=True)
 
 cdef class WeaponInput(Loader):
     id = 4
@@ -197,7 +201,7 @@ cdef class WeaponInput(Loader):
         writer.writeByte(byte, True)
 
 
-register_packet(WeaponInput)
+register_packet(WeaponInput, pooled=True)
 
 cdef class HitPacket(Loader):
     id = 5
@@ -214,7 +218,7 @@ cdef class HitPacket(Loader):
         writer.writeByte(self.player_id, True)
         writer.writeByte(self.value, True)
 
-register_packet(HitPacket, server=False)
+register_packet(HitPacket, server=False, pooled=True)
 
 cdef class SetHP(Loader):
     id = 5
@@ -266,7 +270,7 @@ cdef class GrenadePacket(Loader):
         for value in self.velocity:
             writer.writeFloat(value, False)
 
-register_packet(GrenadePacket)
+register_packet(GrenadePacket, pooled=True)
 
 @cython.freelist(8)
 cdef class SetTool(Loader):
@@ -284,7 +288,7 @@ cdef class SetTool(Loader):
         writer.writeByte(self.player_id, True)
         writer.writeByte(self.value, True)
 
-register_packet(SetTool)
+register_packet(SetTool, pooled=True)
 
 cdef class SetColor(Loader):
     id = 8
@@ -301,7 +305,7 @@ cdef class SetColor(Loader):
         writer.writeByte(self.player_id, True)
         write_color(writer, self.value)
 
-register_packet(SetColor)
+register_packet(SetColor, pooled=True)
 
 cdef class ExistingPlayer(Loader):
     id = 9
@@ -426,7 +430,7 @@ cdef class BlockAction(Loader):
         writer.writeInt(self.y, False, False)
         writer.writeInt(self.z, False, False)
 
-register_packet(BlockAction)
+register_packet(BlockAction, pooled=True)
 
 cdef class BlockLine(Loader):
     id = 14
@@ -455,7 +459,7 @@ cdef class BlockLine(Loader):
         writer.writeInt(self.y2, False, False)
         writer.writeInt(self.z2, False, False)
 
-register_packet(BlockLine)
+register_packet(BlockLine, pooled=True)
 
 cdef class CTFState(Loader):
     id = CTF_MODE # this is not a real a packet, it sent as part of the StateData packet
@@ -676,7 +680,7 @@ cdef class ChatMessage(Loader):
         writer.writeByte(self.chat_type, True)
         writer.writeString(encode(self.value))
 
-register_packet(ChatMessage)
+register_packet(ChatMessage, pooled=True)
 
 cdef class MapStart(Loader):
     id = 18
@@ -867,7 +871,7 @@ cdef class WeaponReload(Loader):
         writer.writeByte(self.clip_ammo, True)
         writer.writeByte(self.reserve_ammo, True)
 
-register_packet(WeaponReload)
+register_packet(WeaponReload, pooled=True)
 
 cdef class ChangeTeam(Loader):
     id = 29
@@ -901,7 +905,7 @@ cdef class ChangeWeapon(Loader):
         writer.writeByte(self.player_id, True)
         writer.writeByte(self.weapon, True)
 
-register_packet(ChangeWeapon)
+register_packet(ChangeWeapon, pooled=True)
 
 cdef class HandShakeInit(Loader):
     id = 31
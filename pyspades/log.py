@@ -0,0 +1,35 @@
+"""
+Logging for code that runs for every packet or tick.
+
+twisted.logger.Logger builds an event for every call and passes it to the
+observers, which only then filter it by level. The Logger here drops events
+below the configured level before building them, and lets callers check
+whether a level is enabled before preparing expensive arguments.
+"""
+
+from twisted.logger import Logger as TwistedLogger, LogLevel
+
+LEVELS = frozenset(LogLevel.iterconstants())
+
+
+class Logger(TwistedLogger):
+    """
+    twisted.logger.Logger that skips levels below the one set with
+    set_level()
+    """
+    # shared by all loggers. Everything is emitted until a level is set
+    enabled_levels = LEVELS
+
+    def emit(self, level, format=None, **kwargs):
+        # invalid levels are reported by twisted
+        if level in Logger.enabled_levels or level not in LEVELS:
+            TwistedLogger.emit(self, level, format, **kwargs)
+
+    def is_enabled(self, level: LogLevel) -> bool:
+        return level in Logger.enabled_levels
+
+
+def set_level(level: LogLevel) -> None:
+    """drops events below the given level from now on"""
+    Logger.enabled_levels = frozenset(
+        other for other in LEVELS if other >= level)
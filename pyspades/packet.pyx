@@ -18,10 +18,19 @@
 from pyspades.loaders cimport Loader
 from pyspades.bytes cimport ByteReader, ByteWriter
 
+cdef extern from "Python.h":
+    Py_ssize_t Py_REFCNT(object o)
+
 _client_loaders = {}
 _server_loaders = {}
 
-def register_packet(loader=None, server=True, client=True, extension=None):
+# packet ids that may be decoded into a pooled Loader instance
+_pooled_packets = set()
+# the pooled instance for each packet id in _pooled_packets
+cdef dict _packet_pool = {}
+
+def register_packet(loader=None, server=True, client=True, extension=None,
+                    pooled=False):
     """register a packet
 
     >>> @register_packet()
@@ -47,6 +56,9 @@ def register_packet(loader=None, server=True, client=True, extension=None):
         client (bool, optional): This packet can be sent by the client. True by
             default
         extension (int, optional): The extension id this packet belongs to, if any
+        pooled (bool, optional): Received packets of this type may be decoded
+            into a reused instance instead of a new one. Only use this for
+            packets whose ``read()`` overwrites every field. False by default.
 
     Raises:
         KeyError: If the packet's ID has already been registered
@@ -90,6 +102,9 @@ def register_packet(loader=None, server=True, client=True, extension=None):
                 raise KeyError(msg)
             _server_loaders[cls.id] = cls
 
+        if pooled:
+            _pooled_packets.add(cls.id)
+
         return cls
 
     if loader:
@@ -110,8 +125,27 @@ cdef inline Loader load_contained_packet(ByteReader data, dict table):
     type_ = data.readByte(True)
     return table[type_](data)
 
+cdef inline Loader load_pooled_packet(ByteReader data, dict table):
+    type_ = data.readByte(True)
+    if type_ not in _pooled_packets:
+        return table[type_](data)
+    cdef Loader contained = _packet_pool.get(type_)
+    # The pooled instance can only be reused if nothing but the pool and this
+    # function hold a reference to it, e.g. a handler might have stored it
+    if contained is None or Py_REFCNT(contained) > 2:
+        klass = table[type_]
+        contained = klass.__new__(klass)
+        _packet_pool[type_] = contained
+    contained.read(data)
+    return contained
+
 _packet_handlers = {}
 
+# Inbound packets are decoded through this single reader, which is rebound to
+# every new packet instead of allocating a fresh ByteReader each time. This is
+# safe since a loader copies everything it needs out of the reader in read()
+cdef ByteReader _packet_reader = ByteReader(b'')
+
 def register_packet_handler(loader):
     def register_handler(function):
         _packet_handlers[loader.id] = function
@@ -119,7 +153,8 @@ def register_packet_handler(loader):
     return register_handler
 
 def call_packet_handler(self, loader):
-    contained = load_client_packet(ByteReader(loader.data))
+    _packet_reader.reset(loader.data)
+    contained = load_pooled_packet(_packet_reader, _client_loaders)
     try:
         handler = _packet_handlers[contained.id]
     except KeyError:
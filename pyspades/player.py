@@ -5,11 +5,11 @@ import re
 import shlex
 import textwrap
 from itertools import product
+from time import perf_counter
 from typing import Dict, Optional, Sequence, Tuple, Union
 
 import enet
 from twisted.internet import reactor
-from twisted.logger import Logger
 
 from pyspades import contained as loaders
 from pyspades import world
@@ -25,9 +25,11 @@ from pyspades.constants import (BLOCK_TOOL, CTF_MODE, ERROR_FULL,
                                 RAPID_WINDOW_ENTRIES, SPADE_TOOL,
                                 TC_CAPTURE_DISTANCE, TC_MODE, WEAPON_KILL,
                                 WEAPON_TOOL)
+from pyspades.log import Logger
 from pyspades.mapgenerator import ProgressiveMapGenerator
 from pyspades.packet import call_packet_handler, register_packet_handler
 from pyspades.protocol import BaseConnection
+from pyspades.spatial import CELL_SIZE
 from pyspades.team import Team
 from pyspades.weapon import WEAPONS
 from pyspades.types import RateLimiter
@@ -37,6 +39,9 @@ log = Logger()
 
 tc_data = loaders.TCState()
 
+# packet handlers taking longer than this many seconds are logged
+SLOW_PACKET_TIME = 1.0
+
 # special characters to replace in chat messages
 MSG_SPECIAL_CHARACTER_MAP = str.maketrans({'\r': ' ', '\n': ' '})
 
@@ -134,9 +139,16 @@ class ServerConnection(BaseConnection):
         calls the packet handler registered with
         @register_packet_handler
         """
+        self.protocol.packets_in.record(loader.data)
         if self.player_id is None:
             return
+        start = perf_counter()
         call_packet_handler(self, loader)
+        elapsed = perf_counter() - start
+        self.protocol.profiler.record_packet(loader.data[0], elapsed)
+        if elapsed > SLOW_PACKET_TIME:
+            log.warn('processing {data!r} from {ip} took {time}',
+                     data=loader.data, ip=self.address[0], time=elapsed)
 
     @register_packet_handler(loaders.ProtocolExtensionInfo)
     def on_ext_info_received(self, contained: loaders.ProtocolExtensionInfo) -> None:
@@ -176,6 +188,7 @@ class ServerConnection(BaseConnection):
             name = contained.name
             self.name = self.protocol.get_name(self, name)
             self.protocol.players[self.player_id] = self
+            self.protocol.player_names[self.name.lower()] = self
             self.on_login(self.name)
         else:
             self.on_team_changed(old_team)
@@ -190,6 +203,7 @@ class ServerConnection(BaseConnection):
             if self.world_object is not None:
                 self.world_object.delete()
                 self.world_object = None
+                self.protocol.player_grid.remove(self)
         # send kill packets for dead players
         for player in self.protocol.players.values():
             if (player.player_id != self.player_id and player.world_object
@@ -245,6 +259,7 @@ class ServerConnection(BaseConnection):
             return
         if not self.freeze_animation:
             self.world_object.set_position(x, y, z)
+            self.protocol.player_grid.update(self, self.world_object.position)
             self.on_position_update()
         if self.filter_visibility_data:
             return
@@ -260,18 +275,24 @@ class ServerConnection(BaseConnection):
                     self.world_object.position, other_flag):
                 self.take_flag()
         elif game_mode == TC_MODE:
-            for entity in self.protocol.entities:
-                collides = vector_collision(
-                    entity, self.world_object.position, TC_CAPTURE_DISTANCE)
-                if self in entity.players:
-                    if not collides:
-                        entity.remove_player(self)
-                else:
-                    if collides:
-                        entity.add_player(self)
-                if collides and vector_collision(entity,
-                                                 self.world_object.position):
+            position = self.world_object.position
+            x, y, z = position.x, position.y, position.z
+            distance = TC_CAPTURE_DISTANCE
+            nearby = self.protocol.entity_grid.query_box(
+                x - distance, y - distance, z - distance,
+                x + distance, y + distance, z + distance)
+            in_range = set()
+            for entity in nearby:
+                if not vector_collision(entity, position, distance):
+                    continue
+                in_range.add(entity)
+                if self not in entity.players:
+                    entity.add_player(self)
+                if vector_collision(entity, position):
                     self.check_refill()
+            for entity in self.protocol.entities:
+                if entity not in in_range and self in entity.players:
+                    entity.remove_player(self)
 
     @register_packet_handler(loaders.WeaponInput)
     def on_weapon_input_recieved(self, contained: loaders.WeaponInput) -> None:
@@ -394,12 +415,11 @@ class ServerConnection(BaseConnection):
                 value, position1, position2)
         self.on_unvalidated_hit(hit_amount, player, kill_type, None)
 
-        debug_str = f"[on_hit_recieved] hit by {self.name} (#{self.player_id}) towards {player.name} (#{player.player_id}) rejected:"
         if not self.hp:
-            log.debug(f"{debug_str} player is dead")
+            self.log_rejected_hit(player, "player is dead")
             return
         if not is_melee and self.weapon_object.is_empty():
-            log.debug(f"{debug_str} magazine is empty")
+            self.log_rejected_hit(player, "magazine is empty")
             return
         valid_hit = world_object.validate_hit(player.world_object,
                                               value, HIT_TOLERANCE,
@@ -408,21 +428,28 @@ class ServerConnection(BaseConnection):
             return
         if is_melee and not vector_collision(position1, position2,
                                              MELEE_DISTANCE):
-            log.debug(f"{debug_str} melee collision exceeds {MELEE_DISTANCE}")
+            self.log_rejected_hit(
+                player, "melee collision exceeds {}".format(MELEE_DISTANCE))
             return
         returned = self.on_hit(hit_amount, player, kill_type, None)
         if returned == False:
-            log.debug(f"{debug_str} script rejected hit")
+            self.log_rejected_hit(player, "script rejected hit")
             return
         elif returned is not None:
             hit_amount = returned
         # do this after so on_hit can still be used
         if kill_type == WEAPON_KILL or kill_type == HEADSHOT_KILL:
             if self.protocol.map.get_solid(*self.world_object.position.get()):
-                log.debug(f"{debug_str} player is inside solid block")
+                self.log_rejected_hit(player, "player is inside solid block")
                 return
         player.hit(hit_amount, self, kill_type)
 
+    def log_rejected_hit(self, player, reason: str) -> None:
+        log.debug("[on_hit_recieved] hit by {name} (#{player_id}) towards "
+                  "{target.name} (#{target.player_id}) rejected: {reason}",
+                  name=self.name, player_id=self.player_id, target=player,
+                  reason=reason)
+
     @register_packet_handler(loaders.GrenadePacket)
     def on_grenade_recieved(self, contained: loaders.GrenadePacket) -> None:
         if not self.hp:
@@ -548,6 +575,7 @@ class ServerConnection(BaseConnection):
                 return
             elif not map_.build_point(x, y, z, self.color):
                 return
+            self.protocol.blocks_built += 1
             self.on_block_build(x, y, z)
         else:
             if not map_.get_solid(x, y, z):
@@ -562,6 +590,7 @@ class ServerConnection(BaseConnection):
                 count = map_.destroy_point(x, y, z)
                 if count:
                     self.total_blocks_removed += count
+                    self.protocol.blocks_removed += count
                     self.blocks = min(50, self.blocks + 1)
                     self.on_block_removed(x, y, z)
             elif value == SPADE_DESTROY:
@@ -569,6 +598,7 @@ class ServerConnection(BaseConnection):
                     count = map_.destroy_point(*xyz)
                     if count:
                         self.total_blocks_removed += count
+                        self.protocol.blocks_removed += count
                         self.on_block_removed(*xyz)
             self.last_block_destroy = reactor.seconds()
         block_action = loaders.BlockAction()
@@ -641,6 +671,7 @@ class ServerConnection(BaseConnection):
                 continue
             if not map_.build_point(x, y, z, self.color):
                 break
+            self.protocol.blocks_built += 1
 
         self.blocks -= len(points)
         self.on_line_build(points)
@@ -829,6 +860,8 @@ class ServerConnection(BaseConnection):
             z -= 0.5
             if self.world_object is not None:
                 self.world_object.set_position(x, y, z)
+                self.protocol.player_grid.update(
+                    self, self.world_object.position)
         position_data = loaders.PositionData()
         position_data.x = x
         position_data.y = y
@@ -897,6 +930,7 @@ class ServerConnection(BaseConnection):
                 position = Vertex3(x, y, z)
                 self.world_object = self.protocol.world.create_object(
                     world.Character, position, None, self._on_fall)
+            self.protocol.player_grid.update(self, self.world_object.position)
             self.world_object.dead = False
             self.tool = WEAPON_TOOL
             self.refill(True)
@@ -987,6 +1021,7 @@ class ServerConnection(BaseConnection):
             self.protocol.broadcast_contained(player_left, sender=self,
                                               save=True)
             del self.protocol.players[self.player_id]
+            self.protocol.player_names.pop(self.name.lower(), None)
         if self.player_id is not None:
             self.protocol.player_ids.put_back(self.player_id)
             self.protocol.update_master()
@@ -999,6 +1034,7 @@ class ServerConnection(BaseConnection):
         if self.world_object is not None:
             self.world_object.delete()
             self.world_object = None
+            self.protocol.player_grid.remove(self)
         if self.team is not None:
             old_team = self.team
             self.team = None
@@ -1196,27 +1232,40 @@ class ServerConnection(BaseConnection):
         z = position.z
         if x < 0 or x > 512 or y < 0 or y > 512 or z < 0 or z > 63:
             return
+        # get_damage is 0 for players 16 blocks away or more on any axis.
+        # Grenades explode during the world update, before update_grids(), so
+        # the cells are one tick old: search one cell further for the players
+        # that moved out of theirs, get_damages() drops the extra ones
+        reach = 16 + CELL_SIZE
+        nearby = self.protocol.player_grid.query_box(
+            x - reach, y - reach, z - reach, x + reach, y + reach, z + reach)
         x = int(math.floor(x))
         y = int(math.floor(y))
         z = int(math.floor(z))
-        for player_list in (self.team.other.get_players(), (self,)):
-            for player in player_list:
-                # not sure when world_object is ever none, but it's
-                # the source of a crash
-                if not player.hp or player.world_object is None:
-                    continue
-                damage = grenade.get_damage(player.world_object.position)
-                if damage == 0:
-                    continue
-                self.on_unvalidated_hit(damage, player, GRENADE_KILL, grenade)
-                returned = self.on_hit(damage, player, GRENADE_KILL, grenade)
-                if returned == False:
-                    continue
-                elif returned is not None:
-                    damage = returned
-                player.set_hp(player.hp - damage, self,
-                              hit_indicator=position.get(), kill_type=GRENADE_KILL,
-                              grenade=grenade)
+        enemy_team = self.team.other
+        # not sure when world_object is ever none, but it's the source of a
+        # crash
+        victims = [player for player in nearby
+                   if player.world_object is not None and
+                   (player.team is enemy_team or player is self)]
+        # enemies first, then the thrower
+        victims.sort(key=lambda player: player is self)
+        damages = grenade.get_damages(
+            [player.world_object.position for player in victims])
+        for player, damage in zip(victims, damages):
+            if not player.hp or player.world_object is None:
+                continue
+            if damage == 0:
+                continue
+            self.on_unvalidated_hit(damage, player, GRENADE_KILL, grenade)
+            returned = self.on_hit(damage, player, GRENADE_KILL, grenade)
+            if returned == False:
+                continue
+            elif returned is not None:
+                damage = returned
+            player.set_hp(player.hp - damage, self,
+                          hit_indicator=position.get(), kill_type=GRENADE_KILL,
+                          grenade=grenade)
         if self.on_block_destroy(x, y, z, GRENADE_DESTROY) == False:
             return
         map = self.protocol.map
@@ -1224,6 +1273,7 @@ class ServerConnection(BaseConnection):
             count = map.destroy_point(n_x, n_y, n_z)
             if count:
                 self.total_blocks_removed += count
+                self.protocol.blocks_removed += count
                 self.on_block_removed(n_x, n_y, n_z)
         block_action = loaders.BlockAction()
         block_action.x = x
@@ -1263,8 +1313,11 @@ class ServerConnection(BaseConnection):
         if not self.map_data.data_left():
             log.debug("done sending map data to {player}", player=self)
             self.map_data = None
+            packets_out = self.protocol.packets_out
             for data in self.saved_loaders:
-                packet = enet.Packet(bytes(data), enet.PACKET_FLAG_RELIABLE)
+                data = bytes(data)
+                packets_out.record(data)
+                packet = enet.Packet(data, enet.PACKET_FLAG_RELIABLE)
                 self.peer.send(0, packet)
             self.saved_loaders = None
             self.on_join()
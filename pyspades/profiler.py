@@ -0,0 +1,224 @@
+"""
+Low overhead timing of the server's update loop.
+
+ServerProtocol.tick reports the duration of each of its phases, and
+ServerConnection reports the duration of each packet handler. Durations are
+kept in fixed size histograms, and ticks that exceed the time budget are
+logged with a short trace of what ran during them.
+"""
+
+import time
+from collections import deque
+from typing import Dict, List, Tuple
+
+from twisted.logger import Logger
+
+log = Logger()
+
+# the phases of ServerProtocol.tick, in order. "packets" is the time spent in
+# packet handlers since the previous tick, outside of tick(). The handlers run
+# by tick() itself are part of its "enet" phase
+PHASES = ('packets', 'enet', 'map_transfer', 'world', 'world_hooks',
+          'network')
+
+SUB_BUCKET_BITS = 4
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+# durations are recorded in microseconds, up to 2 ** 32 us
+BUCKET_COUNT = (32 - SUB_BUCKET_BITS + 1) * SUB_BUCKETS
+
+
+def bucket_upper(index: int) -> int:
+    """returns the exclusive upper bound of a histogram bucket, in
+    microseconds"""
+    if index < SUB_BUCKETS:
+        return index + 1
+    shift = index // SUB_BUCKETS - 1
+    return (index % SUB_BUCKETS + SUB_BUCKETS + 1) << shift
+
+
+class Histogram:
+    """
+    Histogram of durations in the style of HdrHistogram: each power of two is
+    split into SUB_BUCKETS linear buckets, so values are kept with a relative
+    error below 1 / SUB_BUCKETS in a fixed amount of memory.
+    """
+    __slots__ = ('counts', 'count', 'total', 'max')
+
+    def __init__(self) -> None:
+        self.counts = [0] * BUCKET_COUNT
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds: float) -> None:
+        value = int(seconds * 1e6)
+        if value < SUB_BUCKETS:
+            index = max(value, 0)
+        else:
+            shift = value.bit_length() - SUB_BUCKET_BITS - 1
+            index = min((shift + 1) * SUB_BUCKETS + (value >> shift) -
+                        SUB_BUCKETS, BUCKET_COUNT - 1)
+        self.counts[index] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, fraction: float) -> float:
+        """returns the duration in seconds below which the given fraction of
+        the recorded durations are, rounded up to the end of its bucket"""
+        if not self.count:
+            return 0.0
+        target = max(1, round(self.count * fraction))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                break
+        if index == BUCKET_COUNT - 1:
+            # the last bucket also holds everything out of range
+            return self.max
+        return min(bucket_upper(index) / 1e6, self.max)
+
+    def cumulative(self, bounds: List[float]) -> List[int]:
+        """returns the number of recorded durations up to each of the given
+        increasing bounds in seconds, rounded to the end of their bucket"""
+        result = []
+        counts = self.counts
+        seen = 0
+        index = 0
+        for bound in bounds:
+            bound_us = bound * 1e6
+            while index < BUCKET_COUNT and bucket_upper(index) <= bound_us:
+                seen += counts[index]
+                index += 1
+            result.append(seen)
+        return result
+
+    def summary(self) -> Dict[str, float]:
+        """returns count, mean, p50, p99 and max, durations in milliseconds"""
+        return {
+            'count': self.count,
+            'mean': self.total / self.count * 1000 if self.count else 0.0,
+            'p50': self.percentile(0.5) * 1000,
+            'p99': self.percentile(0.99) * 1000,
+            'max': self.max * 1000,
+        }
+
+
+def get_packet_name(packet_id, sent: bool = False) -> str:
+    """returns the name of a packet received by the server, or of one sent
+    by it if sent is true"""
+    # registers the loaders
+    import pyspades.contained  # noqa: F401
+    from pyspades.packet import _client_loaders, _server_loaders
+    loaders = _server_loaders if sent else _client_loaders
+    loader = loaders.get(packet_id)
+    if loader is None:
+        return 'packet {}'.format(packet_id)
+    return loader.__name__
+
+
+class TickProfiler:
+    """
+    Keeps histograms of tick, phase and packet handler durations, and traces
+    ticks that take longer than the budget.
+    """
+
+    def __init__(self, budget: float, log_interval: float = 10.0,
+                 slow_tick_count: int = 8) -> None:
+        self.budget = budget
+        self.log_interval = log_interval
+        self.last_log = 0.0
+        self.ticks = Histogram()
+        self.phases = {name: Histogram() for name in PHASES}
+        self.packets = {}  # type: Dict[int, Histogram]
+        self.slow_ticks = 0
+        # (time, duration, trace) of the last slow ticks
+        self.slow_tick_traces = deque(maxlen=slow_tick_count)
+        # label -> [calls, seconds] of what ran since the end of the last tick
+        self.window = {}  # type: Dict[object, List]
+        # time spent in packet handlers outside of tick() since the last one
+        self.busy = 0.0
+        self.in_tick = False
+
+    def reset(self) -> None:
+        self.__init__(self.budget, self.log_interval,
+                      self.slow_tick_traces.maxlen)
+
+    def record_packet(self, packet_id: int, seconds: float) -> None:
+        histogram = self.packets.get(packet_id)
+        if histogram is None:
+            histogram = self.packets[packet_id] = Histogram()
+        histogram.record(seconds)
+        if not self.in_tick:
+            # the time of tick() already includes the handlers it runs
+            self.busy += seconds
+        self.add_trace(packet_id, seconds)
+
+    def record_phase(self, name: str, seconds: float) -> None:
+        self.phases[name].record(seconds)
+        self.add_trace(name, seconds)
+
+    def add_trace(self, label, seconds: float) -> None:
+        """adds a call to the trace of the current tick"""
+        entry = self.window.get(label)
+        if entry is None:
+            self.window[label] = [1, seconds]
+        else:
+            entry[0] += 1
+            entry[1] += seconds
+
+    def start_tick(self) -> None:
+        self.in_tick = True
+
+    def end_tick(self, seconds: float) -> None:
+        """records a tick that took the given time, not counting the packet
+        handlers that ran since the previous one outside of it"""
+        self.in_tick = False
+        busy = self.busy
+        self.phases['packets'].record(busy)
+        total = seconds + busy
+        self.ticks.record(total)
+        if total > self.budget:
+            self.on_slow_tick(total)
+        self.window.clear()
+        self.busy = 0.0
+
+    def on_slow_tick(self, total: float) -> None:
+        self.slow_ticks += 1
+        trace = self.get_trace()
+        now = time.monotonic()
+        self.slow_tick_traces.append((time.time(), total, trace))
+        if now - self.last_log < self.log_interval:
+            return
+        self.last_log = now
+        log.warn('slow tick: {total:.1f} ms (budget {budget:.1f} ms): '
+                 '{trace}', total=total * 1000, budget=self.budget * 1000,
+                 trace=format_trace(trace))
+
+    def get_trace(self, limit: int = 8) -> List[Tuple[str, int, float]]:
+        """returns the (name, calls, seconds) of what ran during the current
+        tick, slowest first"""
+        trace = []
+        for label, (calls, seconds) in self.window.items():
+            if not isinstance(label, str):
+                label = get_packet_name(label)
+            trace.append((label, calls, seconds))
+        trace.sort(key=lambda item: -item[2])
+        return trace[:limit]
+
+    def summary(self) -> Dict[str, object]:
+        return {
+            'tick': self.ticks.summary(),
+            'phases': {name: histogram.summary()
+                       for name, histogram in self.phases.items()},
+            'packets': {get_packet_name(packet_id): histogram.summary()
+                        for packet_id, histogram in self.packets.items()},
+            'slow_ticks': self.slow_ticks,
+        }
+
+
+def format_trace(trace: List[Tuple[str, int, float]]) -> str:
+    return ', '.join('{} x{} {:.1f} ms'.format(name, calls, seconds * 1000)
+                     for name, calls, seconds in trace)
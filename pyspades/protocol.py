@@ -18,10 +18,35 @@
 import asyncio
 from twisted.internet import reactor
 from pyspades.bytes import ByteWriter
+from pyspades.capture import CaptureWriter
 
 import enet
 
 
+class PacketCounter:
+    """
+    Counts packets and their bytes by packet id, the first byte of their data
+    """
+    __slots__ = ('packets', 'bytes')
+
+    def __init__(self):
+        self.packets = [0] * 256
+        self.bytes = [0] * 256
+
+    def record(self, data, count=1):
+        if not data or not count:
+            return
+        packet_id = data[0]
+        self.packets[packet_id] += count
+        self.bytes[packet_id] += len(data) * count
+
+    def items(self):
+        """yields (packet id, packets, bytes) of the ids that were seen"""
+        for packet_id, packets in enumerate(self.packets):
+            if packets:
+                yield packet_id, packets, self.bytes[packet_id]
+
+
 class BaseConnection:
     disconnected = False
     timeout_call = None
@@ -51,9 +76,12 @@ class BaseConnection:
             flags = enet.PACKET_FLAG_UNSEQUENCED
         else:
             flags = enet.PACKET_FLAG_RELIABLE
-        data = ByteWriter()
-        contained.write(data)
-        packet = enet.Packet(bytes(data), flags)
+        writer = self.protocol.writer
+        writer.reset()
+        contained.write(writer)
+        data = bytes(writer)
+        self.protocol.packets_out.record(data)
+        packet = enet.Packet(data, flags)
         self.peer.send(0, packet)
 
     # events
@@ -75,6 +103,8 @@ class BaseProtocol:
     connection_class = BaseConnection
     max_connections = 33
     is_client = False
+    # CaptureWriter recording the events of server peers, see start_capture()
+    capture = None
 
     def __init__(self, port=None, interface=b'*',
                  update_interval=1 / 60.0):
@@ -89,9 +119,45 @@ class BaseProtocol:
             raise IOError("Failed  to Create Enet Host. Is the Port in use?")
 
         self.host.compress_with_range_coder()
+        # shared writer for encoding outgoing packets, reset before each use
+        self.writer = ByteWriter()
+        # packets received from and sent to peers, by packet id
+        self.packets_in = PacketCounter()
+        self.packets_out = PacketCounter()
         self.update_loop = asyncio.ensure_future(self.update())
         self.connections = {}
         self.clients = {}
+        # service enet as soon as data arrives on its socket, instead of
+        # waiting for the next iteration of the update loop
+        self.event_driven = self.add_socket_reader()
+
+    def add_socket_reader(self):
+        """watch the enet socket with the event loop, calling service_enet()
+        whenever it becomes readable. Returns False if the event loop does not
+        support this"""
+        try:
+            loop = asyncio.get_event_loop()
+            loop.add_reader(self.host.socket.fileno(), self.service_enet)
+        except (AttributeError, NotImplementedError, ValueError):
+            return False
+        return True
+
+    def remove_socket_reader(self):
+        if not self.event_driven:
+            return
+        self.event_driven = False
+        asyncio.get_event_loop().remove_reader(self.host.socket.fileno())
+
+    def start_capture(self, filename):
+        """record all connect, receive and disconnect events of server peers
+        to a capture file, which can be replayed with pyspades.capture"""
+        self.stop_capture()
+        self.capture = CaptureWriter(open(filename, 'wb'))
+
+    def stop_capture(self):
+        if self.capture is not None:
+            self.capture.close()
+            self.capture = None
 
     def connect(self, connection_class, host, port, version, channel_count=1,
                 timeout=5.0):
@@ -130,11 +196,16 @@ class BaseProtocol:
 
     def check_client(self):
         if self.is_client and not self.clients:
-            self.update_loop.stop()
+            self.update_loop.cancel()
             self.update_loop = None
+            self.remove_socket_reader()
             self.host = None  # important for GC
 
     def update(self):
+        self.service_enet()
+
+    def service_enet(self):
+        """handle all pending enet events and send queued packets"""
         try:
             while 1:
                 if self.host is None:
@@ -163,6 +234,8 @@ class BaseProtocol:
                     elif event.type == enet.EVENT_TYPE_RECEIVE:
                         connection.loader_received(event.packet)
                 else:
+                    if self.capture is not None:
+                        self.capture.write_event(event)
                     if event_type == enet.EVENT_TYPE_CONNECT:
                         self.on_connect(peer)
                     elif event_type == enet.EVENT_TYPE_DISCONNECT:
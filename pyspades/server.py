@@ -21,13 +21,16 @@ import warnings
 from itertools import product
 import enet
 import time
+from time import perf_counter
 import asyncio
 import traceback
 
 from pyspades.protocol import BaseProtocol
+from pyspades.profiler import TickProfiler
+from pyspades.spatial import SpatialGrid
 from pyspades.constants import (
     CTF_MODE, TC_MODE, GAME_VERSION, MIN_TERRITORY_COUNT, MAX_TERRITORY_COUNT,
-    UPDATE_FREQUENCY, UPDATE_FPS, DEFAULT_NETWORK_FPS)
+    UPDATE_FREQUENCY, UPDATE_FPS, DEFAULT_NETWORK_FPS, IDLE_UPDATE_FREQUENCY)
 from pyspades.types import IDPool
 from pyspades.master import MasterPool
 from pyspades.team import Team
@@ -35,11 +38,10 @@ from pyspades.entities import Territory
 # importing tc_data is a quick hack since this file writes into it
 from pyspades.player import ServerConnection, check_nan, tc_data
 from pyspades import world
-from pyspades.bytes import ByteWriter
 from pyspades import contained as loaders
 from pyspades.common import make_color
+from pyspades.log import Logger
 from pyspades.mapgenerator import ProgressiveMapGenerator
-from twisted.logger import Logger
 
 log = Logger()
 
@@ -85,7 +87,12 @@ class ServerProtocol(BaseProtocol):
     melee_damage = 100
     version = GAME_VERSION
     respawn_waves = False
+    # blocks changed by players since the server started
+    blocks_built = 0
+    blocks_removed = 0
     master_hosts: List[MasterHostDict]
+    # time source of the update loop, replaced when replaying captures
+    clock = staticmethod(time.monotonic)
 
     def __init__(self, *arg, **kw):
         # +2 to allow server->master and master->server connection since enet
@@ -96,7 +103,13 @@ class ServerProtocol(BaseProtocol):
         BaseProtocol.__init__(self, *arg, **kw)
         self.entities = []
         self.players = {}
+        # lower case name -> player, for looking players up by name
+        self.player_names = {}
         self.player_ids = IDPool(start=0, end=32)
+        # players with a world object and entities by position, see
+        # update_grids
+        self.player_grid = SpatialGrid()
+        self.entity_grid = SpatialGrid()
 
         self._create_teams()
 
@@ -116,8 +129,11 @@ class ServerProtocol(BaseProtocol):
                             abs(vec[1] * 1.02) +
                             abs(vec[2] * 1.01))
 
-        self.last_network_update = self.world_time = time.monotonic()
+        self.last_network_update = self.world_time = self.clock()
         self.loop_count = 0
+        # set when a peer connects, to wake up an idle update loop
+        self.wake_up = asyncio.Event()
+        self.profiler = TickProfiler(UPDATE_FREQUENCY)
 
     def _create_teams(self):
         """create the teams
@@ -173,10 +189,12 @@ class ServerProtocol(BaseProtocol):
             flags = enet.PACKET_FLAG_UNSEQUENCED
         else:
             flags = enet.PACKET_FLAG_RELIABLE
-        writer = ByteWriter()
+        writer = self.writer
+        writer.reset()
         contained.write(writer)
         data = bytes(writer)
         packet = enet.Packet(data, flags)
+        sent = 0
         for player in self.connections.values():
             if player is sender or player.player_id is None:
                 continue
@@ -189,6 +207,8 @@ class ServerProtocol(BaseProtocol):
                     player.saved_loaders.append(data)
             else:
                 player.peer.send(0, packet)
+                sent += 1
+        self.packets_out.record(data, sent)
 
     # backwards compatability
     def send_contained(self, *args, **kwargs):
@@ -209,6 +229,7 @@ class ServerProtocol(BaseProtocol):
                 entity.progress = float(team.id)
         tc_data.set_entities(self.entities)
         self.max_score = len(self.entities)
+        self.index_entities()
 
     def get_cp_entities(self):
         # cool algorithm number 1
@@ -237,45 +258,83 @@ class ServerProtocol(BaseProtocol):
 
     async def update(self):
         while True:
+            delay = UPDATE_FREQUENCY
             try:
-                start_time = time.monotonic()
-                # Notify if update starts more than 4ms later than requested
-                lag = start_time - self.world_time - UPDATE_FREQUENCY
-                if lag > 0.004:
-                    log.debug(
-                        "LAG before world update: {lag:.0f} ms", lag=lag * 1000)
-    
-                BaseProtocol.update(self)
-                # Map transfer
-                for player in self.connections.values():
-                    if (player.map_data is not None and
-                            not player.peer.reliableDataInTransit):
-                        player.continue_map_transfer()
-                # Update world
-                while (time.monotonic() - self.world_time) > UPDATE_FREQUENCY:
-                    self.loop_count += 1
-                    self.world.update(UPDATE_FREQUENCY)
-                    try:
-                        self.on_world_update()
-                    except Exception:
-                        traceback.print_exc()
-                    self.world_time += UPDATE_FREQUENCY
-                # Update network
-                if time.monotonic() - self.last_network_update >= 1 / self.network_fps:
-                    self.last_network_update = self.world_time
-                    self.update_network()
-    
-                # Notify if update uses more than 70% of time budget
-                lag = time.monotonic() - start_time
-                if lag > (UPDATE_FREQUENCY * 0.7):
-                    log.debug("world update LAG: {lag:.0f} ms", lag=lag * 1000)
-    
-                delay = self.world_time + UPDATE_FREQUENCY - time.monotonic()
+                delay = self.tick()
             except Exception:
                 # Prevent random exceptions from killing the
                 # whole loop without explanation
                 traceback.print_exc()
-            await asyncio.sleep(delay)
+            if self.event_driven and not self.connections:
+                await self.idle()
+            else:
+                await asyncio.sleep(delay)
+
+    def tick(self):
+        """run one iteration of the update loop, returns the time until the
+        next one is due"""
+        start_time = self.clock()
+        # Notify if update starts more than 4ms later than requested
+        lag = start_time - self.world_time - UPDATE_FREQUENCY
+        if lag > 0.004:
+            log.debug(
+                "LAG before world update: {lag:.0f} ms", lag=lag * 1000)
+
+        profiler = self.profiler
+        profiler.start_tick()
+        phase_start = tick_start = perf_counter()
+        # most packets are handled as soon as they arrive, see
+        # BaseProtocol.add_socket_reader. This sends queued packets and
+        # handles any events left over
+        self.service_enet()
+        now = perf_counter()
+        profiler.record_phase('enet', now - phase_start)
+        phase_start = now
+        # Map transfer
+        for player in self.connections.values():
+            if (player.map_data is not None and
+                    not player.peer.reliableDataInTransit):
+                player.continue_map_transfer()
+        now = perf_counter()
+        profiler.record_phase('map_transfer', now - phase_start)
+        # Update world
+        while (self.clock() - self.world_time) > UPDATE_FREQUENCY:
+            self.loop_count += 1
+            phase_start = perf_counter()
+            self.world.update(UPDATE_FREQUENCY)
+            self.update_grids()
+            now = perf_counter()
+            profiler.record_phase('world', now - phase_start)
+            try:
+                self.on_world_update()
+            except Exception:
+                traceback.print_exc()
+            profiler.record_phase('world_hooks', perf_counter() - now)
+            self.world_time += UPDATE_FREQUENCY
+        # Update network
+        if self.clock() - self.last_network_update >= 1 / self.network_fps:
+            self.last_network_update = self.world_time
+            phase_start = perf_counter()
+            self.update_network()
+            profiler.record_phase('network', perf_counter() - phase_start)
+
+        # logs a trace if the tick took longer than its time budget
+        profiler.end_tick(perf_counter() - tick_start)
+
+        return self.world_time + UPDATE_FREQUENCY - self.clock()
+
+    async def idle(self):
+        """sleep until a peer connects, but at most IDLE_UPDATE_FREQUENCY
+        seconds, so enet can still handle timeouts and master server pings"""
+        self.wake_up.clear()
+        try:
+            await asyncio.wait_for(self.wake_up.wait(), IDLE_UPDATE_FREQUENCY)
+        except asyncio.TimeoutError:
+            pass
+
+    def on_connect(self, peer):
+        BaseProtocol.on_connect(self, peer)
+        self.wake_up.set()
 
     def update_network(self):
         if not len(self.players):
@@ -312,6 +371,8 @@ class ServerProtocol(BaseProtocol):
         if self.game_mode == TC_MODE:
             self.reset_tc()
         self.players = {}
+        self.player_names = {}
+        self.player_grid.clear()
         if self.connections:
             data = ProgressiveMapGenerator(self.map, parent=True)
             for connection in list(self.connections.values()):
@@ -323,6 +384,7 @@ class ServerProtocol(BaseProtocol):
                 connection.reset()
                 connection._send_connection_data()
                 connection.send_map(data.get_child())
+        self.index_entities()
         self.update_entities()
 
     def reset_game(self, player=None, territory=None):
@@ -366,7 +428,7 @@ class ServerProtocol(BaseProtocol):
         if not name:
             name = 'Deuce' + str(player.player_id)
         new_name = name
-        names = [p.name.lower() for p in self.players.values()]
+        names = self.player_names
         i = 0
         while new_name.lower() in names:
             i += 1
@@ -412,6 +474,34 @@ class ServerProtocol(BaseProtocol):
     def update_master(self):
         self.master_pool.update_player_count(self.get_player_count())
 
+    def update_grids(self):
+        """moves the players and entities to the grid cells of their current
+        positions. Called after every world update, since the world moves
+        players and scripts move entities without telling the grids"""
+        player_grid = self.player_grid
+        for player in self.players.values():
+            world_object = player.world_object
+            if world_object is None:
+                player_grid.remove(player)
+            else:
+                player_grid.update(player, world_object.position)
+        entity_grid = self.entity_grid
+        entities = self.entities
+        for entity in entities:
+            entity_grid.update(entity, entity)
+        if len(entity_grid) > len(entities):
+            # entities were removed from the list, or the list was replaced
+            current = set(entities)
+            for entity in [entity for entity in entity_grid
+                           if entity not in current]:
+                entity_grid.remove(entity)
+
+    def index_entities(self):
+        """rebuilds the entity grid, for when the entities were replaced"""
+        self.entity_grid.clear()
+        for entity in self.entities:
+            self.entity_grid.update(entity, entity)
+
     def update_entities(self):
         map_obj = self.map
         for entity in self.entities:
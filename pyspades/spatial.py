@@ -0,0 +1,124 @@
+"""
+Uniform grid index of objects by position, for finding the objects near a
+point without looping over all of them.
+
+The map is split into columns of CELL_SIZE x CELL_SIZE blocks. Maps are only
+64 blocks high, so each cell spans the whole height and queries compare z
+themselves.
+"""
+
+from typing import Dict, Hashable, Iterator, List, Tuple
+
+CELL_SIZE = 16
+
+Cell = Tuple[int, int]
+
+
+class SpatialGrid:
+    """
+    Keeps objects in cells by their position.
+
+    The grid stores the position object that was passed for each item, such as
+    a Character's position, and queries compare its current coordinates. Only
+    the cell of an item is computed on update(), so update() has to be called
+    after an item moved to keep it in the right cell.
+    """
+
+    def __init__(self, cell_size: int = CELL_SIZE) -> None:
+        self.cell_size = cell_size
+        # cell -> {item: position}
+        self.cells = {}  # type: Dict[Cell, Dict[Hashable, object]]
+        # item -> (cell, position)
+        self.items = {}  # type: Dict[Hashable, Tuple[Cell, object]]
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def __contains__(self, item) -> bool:
+        return item in self.items
+
+    def __iter__(self) -> Iterator:
+        return iter(self.items)
+
+    def get_cell(self, x: float, y: float) -> Cell:
+        size = self.cell_size
+        return int(x // size), int(y // size)
+
+    def update(self, item, position) -> None:
+        """adds an item with a position that has x, y and z attributes, or
+        moves it to the cell of its current position"""
+        size = self.cell_size
+        try:
+            cell = (int(position.x // size), int(position.y // size))
+        except (ValueError, OverflowError):
+            # nan or infinite, not anywhere on the map
+            self.remove(item)
+            return
+        entry = self.items.get(item)
+        if entry is not None:
+            old_cell, old_position = entry
+            if old_cell == cell and old_position is position:
+                return
+            self._remove_from_cell(item, old_cell)
+        contents = self.cells.get(cell)
+        if contents is None:
+            contents = self.cells[cell] = {}
+        contents[item] = position
+        self.items[item] = (cell, position)
+
+    def remove(self, item) -> None:
+        """removes an item, if it is in the grid"""
+        entry = self.items.pop(item, None)
+        if entry is not None:
+            self._remove_from_cell(item, entry[0])
+
+    def _remove_from_cell(self, item, cell: Cell) -> None:
+        contents = self.cells[cell]
+        del contents[item]
+        if not contents:
+            del self.cells[cell]
+
+    def clear(self) -> None:
+        self.cells.clear()
+        self.items.clear()
+
+    def query_box(self, x1: float, y1: float, z1: float, x2: float, y2: float,
+                  z2: float) -> List:
+        """returns the items inside the box from (x1, y1, z1) to
+        (x2, y2, z2), bounds included"""
+        result = []
+        if not self.items:
+            return result
+        cx1, cy1 = self.get_cell(x1, y1)
+        cx2, cy2 = self.get_cell(x2, y2)
+        cells = self.cells
+        if (cx2 - cx1 + 1) * (cy2 - cy1 + 1) > len(cells):
+            # the box covers more cells than there are occupied ones
+            candidates = [
+                contents for (cx, cy), contents in cells.items()
+                if cx1 <= cx <= cx2 and cy1 <= cy <= cy2]
+        else:
+            candidates = [
+                cells[cx, cy] for cx in range(cx1, cx2 + 1)
+                for cy in range(cy1, cy2 + 1) if (cx, cy) in cells]
+        for contents in candidates:
+            for item, position in contents.items():
+                if (x1 <= position.x <= x2 and y1 <= position.y <= y2 and
+                        z1 <= position.z <= z2):
+                    result.append(item)
+        return result
+
+    def query_radius(self, x: float, y: float, z: float,
+                     radius: float) -> List:
+        """returns the items at most radius blocks away from (x, y, z)"""
+        result = []
+        squared = radius * radius
+        for item in self.query_box(x - radius, y - radius, z - radius,
+                                   x + radius, y + radius, z + radius):
+            position = self.items[item][1]
+            dx = position.x - x
+            dy = position.y - y
+            dz = position.z - z
+            if dx * dx + dy * dy + dz * dz <= squared:
+                result.append(item)
+        return result
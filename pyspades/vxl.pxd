@@ -4,8 +4,12 @@ cdef extern from "vxl_c.cpp":
         MAP_Y
         MAP_Z
         DEFAULT_COLOR
+        TILE_SIZE
+        TILES_X
+        TILES_Y
     struct MapData:
-        pass
+        unsigned int version
+        unsigned int tile_versions[]
     struct MapGenerator:
         pass
     MapGenerator * create_map_generator(MapData * original)
@@ -27,6 +31,9 @@ cdef extern from "vxl_c.cpp":
         float random_1, float random_2, int * x, int * y)
     bint is_valid_position(int x, int y, int z)
     void update_shadows(MapData * map)
+    void mark_all_dirty(MapData * map)
+    void get_overview_area(int x1, int y1, int width, int height,
+        MapData * map, unsigned int * data) nogil
 
 cdef class VXLData:
     cdef MapData * map
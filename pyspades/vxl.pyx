@@ -31,6 +31,9 @@ cpdef inline int make_color(int r, int g, int b, int a = 255):
 import time
 import random
 
+# size of the tiles that get_tile_versions() returns the versions of
+OVERVIEW_TILE_SIZE = TILE_SIZE
+
 cdef class Generator:
     cdef MapGenerator * generator
     cdef public:
@@ -63,7 +66,13 @@ cdef class VXLData:
         self.map = load_vxl(c_data)
 
     def load_vxl(self, c_data = None):
+        cdef unsigned int version = 0
+        if self.map != NULL:
+            version = self.map.version
         self.map = load_vxl(c_data)
+        # carry on from the old version, so that everything looks changed
+        self.map.version = version
+        mark_all_dirty(self.map)
 
     def copy(self):
         cdef VXLData map = VXLData()
@@ -221,9 +230,20 @@ cdef class VXLData:
     cpdef update_shadows(self):
         update_shadows(self.map)
 
+    def get_version(self):
+        """returns a number that is increased on every change to the map"""
+        return self.map.version
+
+    def get_tile_versions(self):
+        """returns the version of the last change to each tile of
+        OVERVIEW_TILE_SIZE x OVERVIEW_TILE_SIZE columns, row by row"""
+        return [self.map.tile_versions[i] for i in range(TILES_X * TILES_Y)]
+
     def get_overview(self, int z = -1, bint rgba = False):
         cdef unsigned int * data
         cdef unsigned int i, r, g, b, a, color
+        if z == -1 and rgba:
+            return self.get_overview_area(0, 0, 512, 512)
         data_python = allocate_memory(sizeof(int[512][512]), <char**>&data)
         i = 0
         cdef int current_z
@@ -251,6 +271,19 @@ cdef class VXLData:
                 i += 1
         return data_python
 
+    def get_overview_area(self, int x, int y, int width, int height):
+        """returns the color of the top block of each column in the area, as
+        RGBA pixels row by row"""
+        cdef unsigned int * data
+        if (x < 0 or y < 0 or width < 0 or height < 0 or
+            x + width > MAP_X or y + height > MAP_Y):
+            raise ValueError('area is outside of the map')
+        data_python = allocate_memory(sizeof(unsigned int) * width * height,
+                                      <char**>&data)
+        with nogil:
+            get_overview_area(x, y, width, height, self.map, data)
+        return data_python
+
     def set_overview(self, data_str, int z):
         cdef unsigned int * data
         cdef unsigned int r, g, b, a, color, i, new_color
@@ -191,6 +191,7 @@ int check_node(int x, int y, int z, MapData *map, int destroy)
         {
             map->geometry[*iter] = 0;
             map->colors.erase(*iter);
+            mark_dirty(*iter % MAP_X, (*iter / MAP_X) % MAP_Y, map);
         }
     }
 
@@ -433,6 +434,7 @@ void update_shadows(MapData *map)
         int a = sunblock(map, x, y, z);
         iter->second = (color & 0x00FFFFFF) | (a << 24);
     }
+    mark_all_dirty(map);
 }
 
 struct MapGenerator
@@ -14,13 +14,35 @@
 #define get_pos(x, y, z) ((x) + (y)*MAP_Y + (z)*MAP_X * MAP_Y)
 #define DEFAULT_COLOR 0xFF674028
 
+// the map is split into tiles of columns that remember the version of their
+// last change, so that images of the map only redraw the tiles that changed
+#define TILE_SIZE 64
+#define TILES_X (MAP_X / TILE_SIZE)
+#define TILES_Y (MAP_Y / TILE_SIZE)
+
 struct MapData
 {
     std::bitset<MAP_X * MAP_Y * MAP_Z> geometry;
     // char geometry[MAP_X * MAP_Y * MAP_Z];
     map_type<int, int> colors;
+    // increased on every change
+    unsigned int version = 0;
+    unsigned int tile_versions[TILES_X * TILES_Y] = {};
 };
 
+void inline mark_dirty(int x, int y, MapData *map)
+{
+    map->tile_versions[(y / TILE_SIZE) * TILES_X + x / TILE_SIZE] =
+        ++map->version;
+}
+
+void inline mark_all_dirty(MapData *map)
+{
+    unsigned int version = ++map->version;
+    for (int i = 0; i < TILES_X * TILES_Y; i++)
+        map->tile_versions[i] = version;
+}
+
 void inline get_xyz(int pos, int *x, int *y, int *z)
 {
     *x = pos % MAP_Y;
@@ -61,6 +83,7 @@ int inline get_color(int x, int y, int z, MapData *map)
 void inline set_point(int x, int y, int z, MapData *map, bool solid, int color)
 {
     int i = get_pos(x, y, z);
+    mark_dirty(x, y, map);
     map->geometry[i] = solid;
     if (!solid)
         map->colors.erase(i);
@@ -71,6 +94,7 @@ void inline set_point(int x, int y, int z, MapData *map, bool solid, int color)
 void inline set_column_solid(int x, int y, int z_start, int z_end,
                              MapData *map, bool solid)
 {
+    mark_dirty(x, y, map);
     int i = get_pos(x, y, z_start);
     int i_end = get_pos(x, y, z_end);
     if (!solid)
@@ -94,6 +118,7 @@ void inline set_column_solid(int x, int y, int z_start, int z_end,
 void inline set_column_color(int x, int y, int z_start, int z_end,
                              MapData *map, int color)
 {
+    mark_dirty(x, y, map);
     int i = get_pos(x, y, z_start);
     int i_end = get_pos(x, y, z_end);
     while (i <= i_end)
@@ -103,4 +128,26 @@ void inline set_column_color(int x, int y, int z_start, int z_end,
     }
 }
 
+// writes the color of the top block of each column in the given area, as
+// RGBA pixels
+void inline get_overview_area(int x1, int y1, int width, int height,
+                              MapData *map, unsigned int *data)
+{
+    for (int y = y1; y < y1 + height; y++)
+    {
+        for (int x = x1; x < x1 + width; x++)
+        {
+            int z = 0;
+            while (z < MAP_Z && !map->geometry[get_pos(x, y, z)])
+                z++;
+            // like VXLData.get_z(), an empty column is drawn from the top
+            if (z == MAP_Z)
+                z = 0;
+            unsigned int color = get_color(x, y, z, map);
+            *data++ = ((color & 0xFF0000) >> 16) | (color & 0xFF00) |
+                      ((color & 0xFF) << 16) | 0xFF000000;
+        }
+    }
+}
+
 #endif /* VXL_C_H */
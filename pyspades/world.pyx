@@ -20,6 +20,7 @@ import time
 from pyspades.vxl cimport VXLData, MapData
 from pyspades.common cimport Vertex3, create_proxy_vector
 from libc.math cimport sqrt, sin, cos, acos, fabs
+from libcpp.vector cimport vector
 from pyspades.constants import TORSO, HEAD, ARMS, LEGS, MELEE
 
 cdef extern from "common_c.h":
@@ -37,6 +38,9 @@ cdef extern from "world_c.cpp":
         float victim_x, float victim_y, float victim_z, float aim_tolerance, float dist_tolerance)
     int c_can_see "can_see" (MapData * map, float x0, float y0, float z0,
         float x1, float y1, float z1)
+    void c_can_see_many "can_see_many" (MapData * map, float x, float y,
+        float z, Vector * points, size_t count, bint to_origin, int * visible,
+        float * distances) nogil
     int c_cast_ray "cast_ray" (MapData * map, float x0, float y0, float z0,
         float x1, float y1, float z1, float length, long* x, long* y, long* z)
     size_t cube_line_c "cube_line"(int, int, int, int, int, int, LongVector *)
@@ -50,6 +54,7 @@ cdef extern from "world_c.cpp":
 
     struct GrenadeType:
         Vector p, v
+        float fuse
     PlayerType * create_player()
     void destroy_player(PlayerType * player)
     void destroy_grenade(GrenadeType * player)
@@ -59,6 +64,10 @@ cdef extern from "world_c.cpp":
     int try_uncrouch(PlayerType * p)
     GrenadeType * create_grenade(Vector * p, Vector * v)
     int move_grenade(GrenadeType * grenade)
+    size_t move_players(PlayerType ** players, size_t count, size_t * fallen,
+                        long * damage)
+    size_t update_grenades(GrenadeType ** grenades, size_t count, float dt,
+                           size_t * expired)
 
 from libc.math cimport sqrt
 
@@ -70,6 +79,22 @@ cdef inline bint cast_ray(VXLData map, float x1, float y1, float z1,
     float x2, float y2, float z2, float length, long* x, long* y, long* z):
     return c_cast_ray(map.map, x1, y1, z1, x2, y2, z2, length, x, y, z)
 
+cdef vector[Vector] get_points(positions) except *:
+    cdef vector[Vector] points
+    cdef Vector point
+    cdef Vertex3 vertex
+    points.reserve(len(positions))
+    for position in positions:
+        if isinstance(position, Vertex3):
+            vertex = position
+            point.x = vertex.value.x
+            point.y = vertex.value.y
+            point.z = vertex.value.z
+        else:
+            point.x, point.y, point.z = position
+        points.push_back(point)
+    return points
+
 cdef class Object
 cdef class World
 cdef class Grenade
@@ -94,10 +119,6 @@ cdef class Object:
         """
         pass
 
-    cdef int update(self, double dt) except -1:
-        '''update this object, giving it a "Tick"'''
-        return 0
-
     def delete(self):
         """remove this object from the World"""
         self.world.delete_object(self)
@@ -231,12 +252,6 @@ cdef class Character(Object):
         self.player.secondary_fire = False
         self.player.sprint = False
 
-    cdef int update(self, double dt) except -1:
-        cdef long ret = move_player(self.player)
-        if ret > 0:
-            self.fall_callback(ret)
-        return 0
-
     # properties
     property up:
         def __get__(self):
@@ -318,7 +333,6 @@ cdef class Character(Object):
 cdef class Grenade(Object):
     cdef public:
         Vertex3 position, velocity
-        float fuse
         object callback
         object team
     cdef GrenadeType * grenade
@@ -382,31 +396,87 @@ cdef class Grenade(Object):
             return 4096.0 / value
         return 0
 
-    cdef int update(self, double dt) except -1:
-        self.fuse -= dt
-        if self.fuse <= 0:
-            if self.callback is not None:
-                self.callback(self)
-            self.delete()
-            return 0
-        move_grenade(self.grenade)
+    property fuse:
+        def __get__(self):
+            return self.grenade.fuse
+        def __set__(self, float value):
+            self.grenade.fuse = value
 
     def __dealloc__(self):
         destroy_grenade(self.grenade)
 
+    cpdef list get_damages(self, list positions):
+        """Calculate the damage given to players standing at each of the
+        positions, like ``get_damage``. The cover of all the positions in
+        range is checked with a single call."""
+        cdef Vector * nade = self.position.value
+        cdef list damages = [0.0] * len(positions)
+        cdef vector[Vector] points
+        cdef vector[size_t] indices
+        cdef Vertex3 position
+        cdef Vector * point
+        cdef size_t i
+        for i in range(len(positions)):
+            position = positions[i]
+            point = position.value
+            if (fabs(point.x - nade.x) < 16 and
+                fabs(point.y - nade.y) < 16 and
+                fabs(point.z - nade.z) < 16):
+                points.push_back(point[0])
+                indices.push_back(i)
+        cdef size_t count = points.size()
+        if count == 0:
+            return damages
+        cdef vector[int] visible
+        cdef vector[float] distances
+        visible.resize(count)
+        distances.resize(count)
+        cdef MapData * map = self.world.map.map
+        with nogil:
+            c_can_see_many(map, nade.x, nade.y, nade.z, points.data(), count,
+                           True, visible.data(), distances.data())
+        cdef double diff_x, diff_y, diff_z, value
+        for i in range(count):
+            if not visible[i]:
+                continue
+            diff_x = points[i].x - nade.x
+            diff_y = points[i].y - nade.y
+            diff_z = points[i].z - nade.z
+            value = diff_x**2 + diff_y**2 + diff_z**2
+            if value == 0.0:
+                damages[indices[i]] = 100.0
+            else:
+                damages[indices[i]] = 4096.0 / value
+        return damages
+
     def __repr__(self):
         rep = "Grenade(fuse={:.3f}, position={}, (...), velocity={})"
         return rep.format(self.fuse, self.position, self.velocity)
 
 cdef class World(object):
-    """controls the map of the World and the Objects inside of it"""
+    """controls the map of the World and the Objects inside of it
+
+    The state of the characters and grenades is kept in arrays in the same
+    order as the ``characters`` and ``grenades`` lists, so that all of them
+    are moved with a single call per tick. Only the objects that landed or
+    exploded are called back into."""
     cdef public:
         VXLData map
         list objects
+        list characters
+        list grenades
         float time
+    cdef:
+        vector[PlayerType *] player_data
+        vector[GrenadeType *] grenade_data
+        # output of move_players and update_grenades
+        vector[size_t] indices
+        vector[long] damage
 
     def __init__(self):
         self.objects = []
+        self.characters = []
+        self.grenades = []
         self.time = 0
 
     def update(self, double dt):
@@ -414,16 +484,93 @@ cdef class World(object):
             return
         self.time += dt
         set_globals(self.map.map, self.time, dt)
-        cdef Object instance
-        for instance in self.objects[:]:
-            instance.update(dt)
+        self.update_characters()
+        self.update_grenades(dt)
+
+    cdef int update_characters(self) except -1:
+        cdef size_t count = self.player_data.size()
+        if count == 0:
+            return 0
+        self.indices.resize(count)
+        self.damage.resize(count)
+        cdef size_t falls = move_players(self.player_data.data(), count,
+                                         self.indices.data(),
+                                         self.damage.data())
+        if falls == 0:
+            return 0
+        # the callbacks may create or delete characters
+        cdef list fallen = [(self.characters[self.indices[i]],
+                             self.damage[i]) for i in range(falls)]
+        cdef Character character
+        for character, damage in fallen:
+            character.fall_callback(damage)
+        return 0
+
+    cdef int update_grenades(self, double dt) except -1:
+        cdef size_t count = self.grenade_data.size()
+        if count == 0:
+            return 0
+        self.indices.resize(count)
+        cdef size_t expirations = update_grenades(
+            self.grenade_data.data(), count, dt, self.indices.data())
+        if expirations == 0:
+            return 0
+        cdef list expired = [self.grenades[self.indices[i]]
+                             for i in range(expirations)]
+        cdef Grenade grenade
+        for grenade in expired:
+            if grenade.callback is not None:
+                grenade.callback(grenade)
+            grenade.delete()
+        return 0
+
+    def can_see_many(self, float x, float y, float z, positions,
+                     bint to_origin=False):
+        """check which of the given positions can be seen from (x, y, z).
+        This only considers the map voxels, not any other objects. All
+        positions are checked in a single call that releases the GIL.
+
+        Positions are Vertex3 or (x, y, z) tuples. With ``to_origin=True``,
+        check whether (x, y, z) can be seen from each position instead, the
+        way ``Grenade.get_damage`` checks for cover.
+
+        Returns:
+            visible, distances: lists with an entry for each position
+        """
+        cdef vector[Vector] points = get_points(positions)
+        cdef size_t count = points.size()
+        cdef vector[int] visible
+        cdef vector[float] distances
+        visible.resize(count)
+        distances.resize(count)
+        cdef MapData * map = self.map.map
+        with nogil:
+            c_can_see_many(map, x, y, z, points.data(), count, to_origin,
+                           visible.data(), distances.data())
+        return ([bool(value) for value in visible],
+                [distance for distance in distances])
 
     cpdef delete_object(self, Object item):
         self.objects.remove(item)
+        cdef Py_ssize_t index
+        if isinstance(item, Character):
+            index = self.characters.index(item)
+            del self.characters[index]
+            self.player_data.erase(self.player_data.begin() + index)
+        elif isinstance(item, Grenade):
+            index = self.grenades.index(item)
+            del self.grenades[index]
+            self.grenade_data.erase(self.grenade_data.begin() + index)
 
     def create_object(self, klass, *arg, **kw):
         new_object = klass(self, *arg, **kw)
         self.objects.append(new_object)
+        if isinstance(new_object, Character):
+            self.characters.append(new_object)
+            self.player_data.push_back((<Character>new_object).player)
+        elif isinstance(new_object, Grenade):
+            self.grenades.append(new_object)
+            self.grenade_data.push_back((<Grenade>new_object).grenade)
         return new_object
 
 # utility functions
@@ -66,6 +66,7 @@ struct PlayerType
 struct GrenadeType
 {
     Vector p, v;
+    float fuse;
 };
 
 inline void get_orientation(Orientation *o,
@@ -142,13 +143,13 @@ int clipbox(float x, float y, float z)
 }
 
 //same as isvoxelsolid() but with wrapping
-long isvoxelsolidwrap(long x, long y, long z)
+long isvoxelsolidwrap(long x, long y, long z, MapData *map)
 {
     if (z < 0)
         return 0;
     else if (z >= 64)
         return 1;
-    return get_solid((int)x & VXL_MAX_SIZEM, (int)y & VSIDM, z, global_map);
+    return get_solid((int)x & VXL_MAX_SIZEM, (int)y & VSIDM, z, map);
 }
 
 //same as isvoxelsolid but water is empty
@@ -263,13 +264,34 @@ long can_see(MapData *map, float x0, float y0, float z0, float x1, float y1,
             p.z += i.x;
         }
 
-        if (isvoxelsolidwrap(a.x, a.y, a.z))
+        if (isvoxelsolidwrap(a.x, a.y, a.z, map))
             return 0;
         cnt--;
     }
     return 1;
 }
 
+// checks can_see between one point and each of count points, and stores the
+// result and the distance for each of them. With to_origin set the line is
+// traced from each point to the origin instead, as can_see is not symmetric
+void can_see_many(MapData *map, float x, float y, float z,
+                  const Vector *points, size_t count, int to_origin,
+                  int *visible, float *distances)
+{
+    for (size_t i = 0; i < count; i++)
+    {
+        const Vector *p = &points[i];
+        if (to_origin)
+            visible[i] = can_see(map, p->x, p->y, p->z, x, y, z);
+        else
+            visible[i] = can_see(map, x, y, z, p->x, p->y, p->z);
+        float dx = p->x - x;
+        float dy = p->y - y;
+        float dz = p->z - z;
+        distances[i] = sqrtf(dx * dx + dy * dy + dz * dz);
+    }
+}
+
 long cast_ray(MapData *map, float x0, float y0, float z0, float x1, float y1,
               float z1, float length, long *x, long *y, long *z)
 {
@@ -369,7 +391,7 @@ long cast_ray(MapData *map, float x0, float y0, float z0, float x1, float y1,
             p.z += i.x;
         }
 
-        if (isvoxelsolidwrap(a.x, a.y, a.z))
+        if (isvoxelsolidwrap(a.x, a.y, a.z, map))
         {
             *x = a.x;
             *y = a.y;
@@ -742,6 +764,7 @@ GrenadeType *create_grenade(Vector *p, Vector *v)
     GrenadeType *g = new GrenadeType;
     g->p = *p;
     g->v = *v;
+    g->fuse = 0.0f;
     return g;
 }
 
@@ -799,6 +822,45 @@ int move_grenade(GrenadeType *g)
     }
 }
 
+// moves all players. Stores the indices of the players that landed hard
+// enough to take fall damage in fallen, and the damage in damage, and returns
+// their count
+size_t move_players(PlayerType **players, size_t count, size_t *fallen,
+                    long *damage)
+{
+    size_t falls = 0;
+    for (size_t i = 0; i < count; i++)
+    {
+        long ret = move_player(players[i]);
+        if (ret > 0)
+        {
+            fallen[falls] = i;
+            damage[falls] = ret;
+            falls++;
+        }
+    }
+    return falls;
+}
+
+// advances the fuse of all grenades by dt and moves the ones that are still
+// live. Stores the indices of the grenades whose fuse ran out in expired and
+// returns their count
+size_t update_grenades(GrenadeType **grenades, size_t count, float dt,
+                       size_t *expired)
+{
+    size_t expirations = 0;
+    for (size_t i = 0; i < count; i++)
+    {
+        GrenadeType *g = grenades[i];
+        g->fuse -= dt;
+        if (g->fuse <= 0)
+            expired[expirations++] = i;
+        else
+            move_grenade(g);
+    }
+    return expirations;
+}
+
 // C interface
 
 PlayerType *create_player()
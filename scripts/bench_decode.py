@@ -0,0 +1,159 @@
+#!/usr/bin/python3
+"""
+usage: bench_decode.py [-h] [--iterations ITERATIONS] [--repeat REPEAT]
+
+Microbenchmark for decoding inbound packets, per packet type.
+
+Compares allocating a new ByteReader and a new Loader for every packet (the
+old receive path) against call_packet_handler, which rebinds a single
+ByteReader to each packet and decodes pooled packet types into a reused
+Loader instance. Packet handlers are replaced by no-ops for the measurement.
+
+optional arguments:
+  -h, --help            show this help message and exit
+  --iterations ITERATIONS, -n ITERATIONS
+                        Number of packets decoded per measurement
+  --repeat REPEAT, -r REPEAT
+                        Number of measurements, the best one is reported
+"""
+
+import argparse
+import timeit
+from types import SimpleNamespace
+
+from pyspades import contained as loaders
+from pyspades import packet as packet_module
+from pyspades.bytes import ByteReader, ByteWriter
+from pyspades.packet import call_packet_handler, load_client_packet
+
+
+def make_position():
+    packet = loaders.PositionData()
+    packet.set((256.5, 256.5, 32.0))
+    return packet
+
+
+def make_orientation():
+    packet = loaders.OrientationData()
+    packet.set((0.5, 0.5, 0.0))
+    return packet
+
+
+def make_input():
+    packet = loaders.InputData()
+    packet.player_id = 1
+    packet.up = packet.sprint = True
+    return packet
+
+
+def make_weapon_input():
+    packet = loaders.WeaponInput()
+    packet.player_id = 1
+    packet.primary = True
+    return packet
+
+
+def make_hit():
+    packet = loaders.HitPacket()
+    packet.player_id = 2
+    packet.value = 1
+    return packet
+
+
+def make_grenade():
+    packet = loaders.GrenadePacket()
+    packet.player_id = 1
+    packet.value = 2.5
+    packet.position = (256.0, 256.0, 30.0)
+    packet.velocity = (1.0, 0.0, 0.0)
+    return packet
+
+
+def make_block_action():
+    packet = loaders.BlockAction()
+    packet.player_id = 1
+    packet.x, packet.y, packet.z = 256, 256, 32
+    return packet
+
+
+def make_block_line():
+    packet = loaders.BlockLine()
+    packet.player_id = 1
+    packet.x1, packet.y1, packet.z1 = 256, 256, 32
+    packet.x2, packet.y2, packet.z2 = 260, 256, 32
+    return packet
+
+
+def make_chat():
+    packet = loaders.ChatMessage()
+    packet.player_id = 1
+    packet.chat_type = 0
+    packet.value = "gg"
+    return packet
+
+
+PACKETS = [
+    make_position,
+    make_orientation,
+    make_input,
+    make_weapon_input,
+    make_hit,
+    make_grenade,
+    make_block_action,
+    make_block_line,
+    make_chat,
+]
+
+
+def encode(packet):
+    writer = ByteWriter()
+    packet.write(writer)
+    return bytes(writer)
+
+
+def handle_nothing(connection, contained):
+    pass
+
+
+def bench(data, iterations, repeat):
+    enet_packet = SimpleNamespace(data=data)
+
+    def fresh():
+        contained = load_client_packet(ByteReader(enet_packet.data))
+        handle_nothing(None, contained)
+
+    def reused():
+        call_packet_handler(None, enet_packet)
+
+    fresh_time = min(timeit.repeat(fresh, number=iterations, repeat=repeat))
+    reused_time = min(timeit.repeat(reused, number=iterations, repeat=repeat))
+    return fresh_time, reused_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark packet decoding")
+    parser.add_argument("--iterations", "-n", type=int, default=200000,
+                        help="Number of packets decoded per measurement")
+    parser.add_argument("--repeat", "-r", type=int, default=5,
+                        help="Number of measurements, the best one is "
+                        "reported")
+    args = parser.parse_args()
+
+    handlers = packet_module._packet_handlers
+    for make_packet in PACKETS:
+        handlers[make_packet().id] = handle_nothing
+
+    print("{:<16} {:>12} {:>12} {:>8}".format(
+        "packet", "fresh ns/op", "pooled ns/op", "gain"))
+    for make_packet in PACKETS:
+        packet = make_packet()
+        fresh, reused = bench(encode(packet), args.iterations, args.repeat)
+        fresh_ns = fresh / args.iterations * 1e9
+        reused_ns = reused / args.iterations * 1e9
+        print("{:<16} {:>12.1f} {:>12.1f} {:>7.1f}%".format(
+            type(packet).__name__, fresh_ns, reused_ns,
+            (1 - reused_ns / fresh_ns) * 100))
+
+
+if __name__ == "__main__":
+    main()
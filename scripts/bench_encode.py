@@ -0,0 +1,87 @@
+#!/usr/bin/python3
+"""
+usage: bench_encode.py [-h] [--iterations ITERATIONS] [--repeat REPEAT]
+
+Microbenchmark for encoding outgoing packets, per packet type.
+
+Compares allocating a new ByteWriter for every packet against reusing a
+single ByteWriter that is cleared with reset(). Both measurements include
+converting the result to bytes, as is done before creating an enet.Packet.
+
+optional arguments:
+  -h, --help            show this help message and exit
+  --iterations ITERATIONS, -n ITERATIONS
+                        Number of packets encoded per measurement
+  --repeat REPEAT, -r REPEAT
+                        Number of measurements, the best one is reported
+"""
+
+import argparse
+import timeit
+
+from pyspades import contained as loaders
+from pyspades.bytes import ByteWriter
+
+from bench_decode import PACKETS
+
+
+def make_world_update():
+    packet = loaders.WorldUpdate()
+    packet.items = [((256.0, 256.0, 32.0), (1.0, 0.0, 0.0))] * 32
+    return packet
+
+
+def make_existing_player():
+    packet = loaders.ExistingPlayer()
+    packet.player_id = 1
+    packet.name = "Deuce"
+    return packet
+
+
+def make_set_hp():
+    packet = loaders.SetHP()
+    packet.hp = 75
+    packet.not_fall = 1
+    return packet
+
+
+def bench(packet, iterations, repeat):
+    writer = ByteWriter()
+
+    def fresh():
+        writer = ByteWriter()
+        packet.write(writer)
+        bytes(writer)
+
+    def reused():
+        writer.reset()
+        packet.write(writer)
+        bytes(writer)
+
+    fresh_time = min(timeit.repeat(fresh, number=iterations, repeat=repeat))
+    reused_time = min(timeit.repeat(reused, number=iterations, repeat=repeat))
+    return fresh_time, reused_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark packet encoding")
+    parser.add_argument("--iterations", "-n", type=int, default=200000,
+                        help="Number of packets encoded per measurement")
+    parser.add_argument("--repeat", "-r", type=int, default=5,
+                        help="Number of measurements, the best one is "
+                        "reported")
+    args = parser.parse_args()
+
+    print("{:<16} {:>12} {:>12}".format(
+        "packet", "fresh ns/op", "reused ns/op"))
+    for make_packet in [*PACKETS, make_world_update, make_existing_player,
+                        make_set_hp]:
+        packet = make_packet()
+        fresh, reused = bench(packet, args.iterations, args.repeat)
+        print("{:<16} {:>12.1f} {:>12.1f}".format(
+            type(packet).__name__, fresh / args.iterations * 1e9,
+            reused / args.iterations * 1e9))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/python3
+"""
+usage: bench_networkdict.py [-h] [--entries ENTRIES] [--lookups LOOKUPS]
+                            [--seed SEED]
+
+Benchmark for the NetworkDict that holds the ban list, with a list of random
+bans the size of a large bansubscribe list.
+
+Most entries are single addresses, the rest are /24 and /16 networks, with a
+few IPv6 addresses and /64 networks. The following is reported:
+- loading the list with read_list
+- looking up banned addresses (hits), which is what happens on every connect
+  of a banned player
+- looking up addresses that are not banned (misses), which is what happens on
+  every other connect
+- finding the bans that overlap random /16 networks, which add_ban and
+  remove_ban do (the first query also sorts the index)
+- removing entries with remove()
+
+optional arguments:
+  -h, --help            show this help message and exit
+  --entries ENTRIES, -n ENTRIES
+                        Number of entries in the ban list
+  --lookups LOOKUPS, -l LOOKUPS
+                        Number of lookups per measurement
+  --seed SEED           Random seed
+"""
+
+import argparse
+import random
+import time
+from ipaddress import IPv4Address, IPv6Address
+
+from piqueserver.networkdict import NetworkDict
+
+
+def random_ipv4(rng):
+    return str(IPv4Address(rng.getrandbits(32)))
+
+
+def random_ipv6(rng):
+    return str(IPv6Address(rng.getrandbits(128)))
+
+
+def make_ban_list(rng, count):
+    bans = []
+    for index in range(count):
+        kind = rng.random()
+        if kind < 0.85:
+            network = random_ipv4(rng)
+        elif kind < 0.95:
+            network = random_ipv4(rng) + "/24"
+        elif kind < 0.97:
+            network = random_ipv4(rng) + "/16"
+        elif kind < 0.99:
+            network = random_ipv6(rng)
+        else:
+            network = random_ipv6(rng) + "/64"
+        bans.append(["player{}".format(index), network, "reason",
+                     time.time() + 3600])
+    return bans
+
+
+def measure(function, items):
+    start = time.perf_counter()
+    for item in items:
+        function(item)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark NetworkDict with a large ban list")
+    parser.add_argument("--entries", "-n", type=int, default=100000,
+                        help="Number of entries in the ban list")
+    parser.add_argument("--lookups", "-l", type=int, default=100000,
+                        help="Number of lookups per measurement")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    bans = make_ban_list(rng, args.entries)
+
+    start = time.perf_counter()
+    networks = NetworkDict()
+    networks.read_list(bans)
+    load_time = time.perf_counter() - start
+
+    banned = [rng.choice(bans)[1].split("/")[0]
+              for _ in range(args.lookups)]
+    unknown = [random_ipv4(rng) for _ in range(args.lookups)]
+
+    def lookup(address):
+        return address in networks
+
+    hit_time = measure(lookup, banned)
+    miss_time = measure(lookup, unknown)
+    ranges = [random_ipv4(rng) + "/16" for _ in range(args.lookups // 10)]
+    overlap_time = measure(networks.get_overlaps, ranges)
+    removed = [ban[1] for ban in rng.sample(bans, min(len(bans),
+                                                      args.lookups // 10))]
+    remove_time = measure(networks.remove, removed)
+
+    print("{} entries, {} left after removing {}".format(
+        args.entries, len(networks), len(removed)))
+    print("read_list:     {:8.1f} ms".format(load_time * 1000))
+    print("lookup hit:    {:8.2f} us/op".format(
+        hit_time / len(banned) * 1e6))
+    print("lookup miss:   {:8.2f} us/op".format(
+        miss_time / len(unknown) * 1e6))
+    print("overlaps:      {:8.2f} us/op".format(
+        overlap_time / len(ranges) * 1e6))
+    print("remove:        {:8.2f} us/op".format(
+        remove_time / len(removed) * 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,337 @@
+#!/usr/bin/python3
+"""
+usage: bot_swarm.py [-h] [--host HOST] [--port PORT] [--bots BOTS]
+                    [--duration DURATION] [--ramp RAMP] [--rate RATE]
+                    [--mix MIX] [--seed SEED]
+
+Load test for a running server: connects a swarm of scripted headless clients,
+which download the map, join the game and then move, shoot, build, dig and
+chat according to the behaviour mix.
+
+All bots connect from the same address, so the server should be started with
+max_connections_per_ip = 0 (and enough max_players) for all of them to join.
+If [admission] packet_rate is set, it limits all bots together too: each bot
+sends about 70 datagrams per second, so leave it unset or raise it above
+70 times the number of bots, or datagrams are silently dropped.
+
+At the end the following is reported:
+- map download time (from connecting until the map and state are received)
+- world update interval, the time between two world updates received by a bot.
+  The server sends one per network tick, so the spread of this interval
+  reflects the server's tick latency.
+- round trip time of the bots' enet peers
+- bandwidth received and sent by the swarm
+
+optional arguments:
+  -h, --help            show this help message and exit
+  --host HOST           Server address
+  --port PORT, -p PORT  Server port
+  --bots BOTS, -n BOTS  Number of bots
+  --duration DURATION, -t DURATION
+                        Seconds to run after the first bot connects
+  --ramp RAMP           Seconds between two bots connecting
+  --rate RATE           Actions per second per bot
+  --mix MIX             Behaviour weights, e.g. move=6,shoot=2,build=1,dig=1,chat=0.2
+  --seed SEED           Random seed
+"""
+
+import argparse
+import asyncio
+import math
+import random
+import time
+
+DEFAULT_MIX = "move=6,shoot=2,build=1,dig=1,chat=0.2"
+CHAT_LINES = ["gg", "lol", "where is the intel", "nice shot", "brb"]
+
+
+def parse_mix(value):
+    mix = {}
+    for item in value.split(","):
+        name, _, weight = item.partition("=")
+        mix[name.strip()] = float(weight)
+    return mix
+
+
+def percentiles(values):
+    if not values:
+        return "n/a"
+    values = sorted(values)
+
+    def at(fraction):
+        return values[min(len(values) - 1, int(len(values) * fraction))]
+    return "p50 {:.1f} p90 {:.1f} p99 {:.1f} max {:.1f}".format(
+        at(0.5), at(0.9), at(0.99), values[-1])
+
+
+def make_connection_class():
+    from pyspades import contained as loaders
+    from pyspades.bytes import ByteReader
+    from pyspades.common import make_color
+    from pyspades.constants import (
+        BLOCK_TOOL, BUILD_BLOCK, CHAT_ALL, DESTROY_BLOCK, SPADE_TOOL, TORSO,
+        WEAPON_TOOL)
+    from pyspades.packet import load_server_packet
+    from pyspades.protocol import BaseConnection
+
+    class BotConnection(BaseConnection):
+        player_id = None
+        position = None
+        tool = None
+        connect_time = None
+        joined = False
+        firing = False
+
+        def on_connect(self):
+            self.connect_time = time.monotonic()
+            self.next_action = 0.0
+            self.last_world_update = None
+
+        def on_disconnect(self):
+            self.protocol.on_bot_disconnect(self)
+
+        def loader_received(self, packet):
+            contained = load_server_packet(ByteReader(packet.data))
+            if isinstance(contained, loaders.MapChunk):
+                self.protocol.map_bytes += len(contained.data)
+            elif isinstance(contained, loaders.StateData):
+                self.on_state(contained)
+            elif isinstance(contained, loaders.CreatePlayer):
+                self.protocol.players.add(contained.player_id)
+                if contained.player_id == self.player_id:
+                    self.position = [contained.x, contained.y, contained.z]
+                    self.joined = True
+            elif isinstance(contained, loaders.ExistingPlayer):
+                self.protocol.players.add(contained.player_id)
+            elif isinstance(contained, loaders.WorldUpdate):
+                now = time.monotonic()
+                if self.last_world_update is not None:
+                    self.protocol.world_update_intervals.append(
+                        (now - self.last_world_update) * 1000)
+                self.last_world_update = now
+
+        def on_state(self, state):
+            self.protocol.map_times.append(
+                time.monotonic() - self.connect_time)
+            self.player_id = state.player_id
+            existing_player = loaders.ExistingPlayer()
+            existing_player.player_id = self.player_id
+            existing_player.team = self.protocol.random.randint(0, 1)
+            existing_player.weapon = 0
+            existing_player.tool = 2
+            existing_player.kills = 0
+            existing_player.color = make_color(112, 112, 112)
+            existing_player.name = "Bot{}".format(self.bot_id)
+            self.send_contained(existing_player)
+
+        def set_tool(self, tool):
+            if self.tool == tool:
+                return
+            self.tool = tool
+            set_tool = loaders.SetTool()
+            set_tool.player_id = self.player_id
+            set_tool.value = tool
+            self.send_contained(set_tool)
+
+        def act(self):
+            rng = self.protocol.random
+            action = rng.choices(self.protocol.actions,
+                                 self.protocol.weights)[0]
+            getattr(self, "do_" + action)()
+            self.protocol.actions_done[action] += 1
+
+        def do_move(self):
+            rng = self.protocol.random
+            x, y, z = self.position
+            x = min(511.0, max(0.0, x + rng.uniform(-0.3, 0.3)))
+            y = min(511.0, max(0.0, y + rng.uniform(-0.3, 0.3)))
+            self.position = [x, y, z]
+            position = loaders.PositionData()
+            position.set((x, y, z))
+            self.send_contained(position, True)
+            angle = rng.uniform(0, math.tau)
+            orientation = loaders.OrientationData()
+            orientation.set((math.cos(angle), math.sin(angle), 0.0))
+            self.send_contained(orientation, True)
+            input_data = loaders.InputData()
+            input_data.player_id = self.player_id
+            input_data.up = rng.random() < 0.5
+            input_data.sprint = rng.random() < 0.2
+            self.send_contained(input_data)
+
+        def do_shoot(self):
+            self.set_tool(WEAPON_TOOL)
+            self.firing = not self.firing
+            weapon_input = loaders.WeaponInput()
+            weapon_input.player_id = self.player_id
+            weapon_input.primary = self.firing
+            self.send_contained(weapon_input)
+            targets = self.protocol.players - {self.player_id}
+            if self.firing and targets:
+                hit = loaders.HitPacket()
+                hit.player_id = self.protocol.random.choice(sorted(targets))
+                hit.value = TORSO
+                self.send_contained(hit)
+
+        def block_action(self, value):
+            x, y, z = self.position
+            block_action = loaders.BlockAction()
+            block_action.player_id = self.player_id
+            block_action.value = value
+            block_action.x = int(x) + self.protocol.random.choice((-1, 1))
+            block_action.y = int(y)
+            block_action.z = min(63, int(z) + 2)
+            self.send_contained(block_action)
+
+        def do_build(self):
+            self.set_tool(BLOCK_TOOL)
+            self.block_action(BUILD_BLOCK)
+
+        def do_dig(self):
+            self.set_tool(SPADE_TOOL)
+            self.block_action(DESTROY_BLOCK)
+
+        def do_chat(self):
+            chat = loaders.ChatMessage()
+            chat.player_id = self.player_id
+            chat.chat_type = CHAT_ALL
+            chat.value = self.protocol.random.choice(CHAT_LINES)
+            self.send_contained(chat)
+
+    return BotConnection
+
+
+def make_protocol(args):
+    from collections import Counter
+
+    from pyspades.constants import GAME_VERSION
+    from pyspades.protocol import BaseProtocol
+
+    connection_class = make_connection_class()
+
+    class SwarmProtocol(BaseProtocol):
+        is_client = True
+
+        def __init__(self):
+            self.max_connections = args.bots
+            BaseProtocol.__init__(self, None, None)
+            self.random = random.Random(args.seed)
+            mix = parse_mix(args.mix)
+            self.actions = list(mix)
+            self.weights = list(mix.values())
+            self.actions_done = Counter()
+            self.players = set()
+            self.map_bytes = 0
+            self.map_times = []
+            self.world_update_intervals = []
+            self.round_trip_times = []
+            self.bots = []
+            self.disconnected = 0
+            self.stopping = False
+
+        def add_bot(self):
+            bot = self.connect(connection_class, args.host, args.port,
+                               GAME_VERSION, timeout=30.0)
+            bot.bot_id = len(self.bots)
+            self.bots.append(bot)
+
+        def on_bot_disconnect(self, bot):
+            if not self.stopping:
+                self.disconnected += 1
+
+        async def update(self):
+            interval = 1 / args.rate
+            last_sample = time.monotonic()
+            while True:
+                self.service_enet()
+                now = time.monotonic()
+                for bot in list(self.clients.values()):
+                    if bot.joined and now >= bot.next_action:
+                        bot.next_action = now + interval
+                        bot.act()
+                if now - last_sample >= 1.0:
+                    last_sample = now
+                    for bot in self.clients.values():
+                        if bot.joined:
+                            self.round_trip_times.append(bot.latency)
+                await asyncio.sleep(1 / 60)
+
+    return SwarmProtocol()
+
+
+async def run_swarm(args):
+    protocol = make_protocol(args)
+    host = protocol.host
+    start = time.monotonic()
+    for _ in range(args.bots):
+        protocol.add_bot()
+        await asyncio.sleep(args.ramp)
+    await asyncio.sleep(max(0.0, start + args.duration - time.monotonic()))
+
+    elapsed = time.monotonic() - start
+    received = host.totalReceivedData
+    sent = host.totalSentData
+    joined = sum(bot.joined for bot in protocol.bots)
+    protocol.stopping = True
+    for bot in protocol.bots:
+        bot.disconnect()
+    protocol.service_enet()
+    host.flush()
+
+    print("bots joined: {}/{}, disconnected by server: {}".format(
+        joined, args.bots, protocol.disconnected))
+    print("actions: {}".format(", ".join(
+        "{}={}".format(name, count)
+        for name, count in sorted(protocol.actions_done.items()))))
+    print("map download s:         {}".format(percentiles(protocol.map_times)))
+    if protocol.map_times:
+        print("map size per bot:       {:.0f} KiB".format(
+            protocol.map_bytes / len(protocol.map_times) / 1024))
+    print("world update interval ms: {}".format(
+        percentiles(protocol.world_update_intervals)))
+    print("round trip time ms:     {}".format(
+        percentiles(protocol.round_trip_times)))
+    print("bandwidth in:  {:.1f} KiB/s".format(received / elapsed / 1024))
+    print("bandwidth out: {:.1f} KiB/s".format(sent / elapsed / 1024))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Load test a server with headless bots")
+    parser.add_argument("--host", type=str, default="127.0.0.1",
+                        help="Server address")
+    parser.add_argument("--port", "-p", type=int, default=32887,
+                        help="Server port")
+    parser.add_argument("--bots", "-n", type=int, default=16,
+                        help="Number of bots")
+    parser.add_argument("--duration", "-t", type=float, default=60,
+                        help="Seconds to run after the first bot connects")
+    parser.add_argument("--ramp", type=float, default=0.5,
+                        help="Seconds between two bots connecting")
+    parser.add_argument("--rate", type=float, default=10,
+                        help="Actions per second per bot")
+    parser.add_argument("--mix", type=str, default=DEFAULT_MIX,
+                        help="Behaviour weights, e.g. " + DEFAULT_MIX)
+    parser.add_argument("--seed", type=int, default=None,
+                        help="Random seed")
+    args = parser.parse_args()
+
+    from twisted.internet import asyncioreactor
+    asyncioreactor.install()
+    from twisted.internet import reactor
+    from twisted.internet.defer import ensureDeferred
+
+    from piqueserver.utils import as_deferred
+
+    async def run():
+        try:
+            await run_swarm(args)
+        finally:
+            reactor.stop()
+
+    reactor.callWhenRunning(lambda: ensureDeferred(as_deferred(run())))
+    reactor.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+#!/usr/bin/python3
+"""
+usage: replay.py [-h] [--config-dir CONFIG_DIR] [--config-file CONFIG_FILE]
+                 [--realtime] [--json JSON]
+                 capture
+
+Replays a capture recorded with the "capture" option of the [logging] config
+section against a server running the given config, without any networking.
+Packets sent by the server are dropped.
+
+By default the capture is replayed as fast as possible: the clocks of the
+update loop and of the reactor are advanced to the time of each event instead
+of waiting for it. Reports the CPU time of each tick and, per packet type, the
+CPU time spent in the handlers and the number of memory blocks they left
+allocated.
+
+positional arguments:
+  capture               Capture file to replay
+
+optional arguments:
+  -h, --help            show this help message and exit
+  --config-dir CONFIG_DIR, -d CONFIG_DIR
+                        Pique config dir
+  --config-file CONFIG_FILE, -c CONFIG_FILE
+                        Config file, default is config.toml in the config dir
+  --realtime            Replay at the speed the capture was recorded at
+  --json JSON           Also write the results to this file as json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from collections import defaultdict
+
+# servers don't bind a public port or register while replaying
+REPLAY_CONFIG = {
+    'port': 0,
+    'master': False,
+    'ip_getter': '',
+    'release_notifications': False,
+    'status_server': {'enabled': False},
+    'ssh': {'enabled': False},
+    'irc': {'enabled': False},
+    'bans': {'publish': False, 'urls': []},
+    'logging': {'capture': ''},
+}
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class ReplayStats:
+    def __init__(self):
+        self.ticks = []
+        # packet id -> [count, cpu time in ns, net allocated blocks]
+        self.packets = defaultdict(lambda: [0, 0, 0])
+        self.wall_time = 0.0
+
+    def as_dict(self, packet_names):
+        ticks = self.ticks
+        return {
+            'wall_time': self.wall_time,
+            'ticks': {
+                'count': len(ticks),
+                'mean_ms': sum(ticks) / len(ticks) / 1e6 if ticks else 0,
+                'p50_ms': percentile(ticks, 0.5) / 1e6,
+                'p99_ms': percentile(ticks, 0.99) / 1e6,
+                'max_ms': max(ticks, default=0) / 1e6,
+            },
+            'packets': {
+                packet_names.get(packet_id, str(packet_id)): {
+                    'count': count,
+                    'total_ms': cpu / 1e6,
+                    'mean_us': cpu / count / 1e3,
+                    'blocks_per_packet': blocks / count,
+                }
+                for packet_id, (count, cpu, blocks) in sorted(
+                    self.packets.items(), key=lambda item: -item[1][1])
+            },
+        }
+
+    def print_report(self, packet_names, out):
+        result = self.as_dict(packet_names)
+        ticks = result['ticks']
+        print("replayed in {:.2f} s".format(result['wall_time']), file=out)
+        print("{} ticks, cpu ms: mean {:.3f} p50 {:.3f} p99 {:.3f} "
+              "max {:.3f}".format(ticks['count'], ticks['mean_ms'],
+                                  ticks['p50_ms'], ticks['p99_ms'],
+                                  ticks['max_ms']), file=out)
+        print("{:<24} {:>8} {:>10} {:>10} {:>12}".format(
+            "packet", "count", "total ms", "mean us", "blocks/op"), file=out)
+        for name, packet in result['packets'].items():
+            print("{:<24} {:>8} {:>10.2f} {:>10.2f} {:>12.2f}".format(
+                name, packet['count'], packet['total_ms'], packet['mean_us'],
+                packet['blocks_per_packet']), file=out)
+
+
+async def replay(protocol, capture, realtime, stats):
+    from twisted.internet import reactor
+    from pyspades.capture import RECEIVE, Replayer, read_capture
+    from pyspades.constants import UPDATE_FREQUENCY
+
+    # wait for the map to load, then take over the update loop
+    while protocol.map_info is None:
+        await asyncio.sleep(0.1)
+    protocol.update_loop.cancel()
+    protocol.remove_socket_reader()
+
+    start_wall = time.monotonic()
+    start_reactor = reactor.seconds()
+    elapsed = 0.0
+    if not realtime:
+        protocol.clock = lambda: start_wall + elapsed
+        reactor.seconds = lambda: start_reactor + elapsed
+    protocol.world_time = protocol.last_network_update = protocol.clock()
+
+    async def advance(to_time):
+        nonlocal elapsed
+        if realtime:
+            delay = start_wall + to_time - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        else:
+            elapsed = to_time
+            reactor.runUntilCurrent()
+
+    replayer = Replayer(protocol)
+    next_tick = 0.0
+    for record in read_capture(capture):
+        while next_tick <= record.time:
+            await advance(next_tick)
+            start = time.process_time_ns()
+            protocol.tick()
+            stats.ticks.append(time.process_time_ns() - start)
+            next_tick += UPDATE_FREQUENCY
+        await advance(record.time)
+        if record.type == RECEIVE and record.data:
+            blocks = sys.getallocatedblocks()
+            start = time.process_time_ns()
+            replayer.dispatch(record)
+            packet = stats.packets[record.data[0]]
+            packet[0] += 1
+            packet[1] += time.process_time_ns() - start
+            packet[2] += sys.getallocatedblocks() - blocks
+        else:
+            replayer.dispatch(record)
+    stats.wall_time = time.monotonic() - start_wall
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Replay a packet capture against a server")
+    parser.add_argument("capture", help="Capture file to replay")
+    parser.add_argument("--config-dir", "-d", type=str,
+                        default="./piqueserver/config",
+                        help="Pique config dir")
+    parser.add_argument("--config-file", "-c", type=str, default=None,
+                        help="Config file, default is config.toml in the "
+                        "config dir")
+    parser.add_argument("--realtime", action="store_true",
+                        help="Replay at the speed the capture was recorded "
+                        "at")
+    parser.add_argument("--json", type=str, default=None,
+                        help="Also write the results to this file as json")
+    args = parser.parse_args()
+
+    from twisted.internet import asyncioreactor
+    asyncioreactor.install()
+    from twisted.internet import reactor
+    from twisted.internet.defer import ensureDeferred
+
+    from piqueserver.config import config, TOML_FORMAT, JSON_FORMAT
+    from piqueserver.utils import as_deferred
+
+    config.config_dir = args.config_dir
+    config_file = args.config_file or os.path.join(args.config_dir,
+                                                   "config.toml")
+    format_ = JSON_FORMAT if config_file.endswith(".json") else TOML_FORMAT
+    with open(config_file) as fobj:
+        config.load_from_file(fobj, format_=format_)
+    config.update_from_dict(REPLAY_CONFIG)
+
+    from piqueserver import server
+    from pyspades import packet
+
+    protocol_class = server.create_protocol_class()
+    protocol = protocol_class(b"127.0.0.1", config.get_dict())
+
+    stats = ReplayStats()
+
+    async def run():
+        try:
+            with open(args.capture, "rb") as capture:
+                await replay(protocol, capture, args.realtime, stats)
+        finally:
+            reactor.stop()
+
+    reactor.callWhenRunning(lambda: ensureDeferred(as_deferred(run())))
+    reactor.run()
+
+    packet_names = {packet_id: loader.__name__ for packet_id, loader in
+                    packet._client_loaders.items()}
+    # stdout is redirected to the log once the server starts
+    stats.print_report(packet_names, sys.__stdout__)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(stats.as_dict(packet_names), f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+"""
+test piqueserver/admission.py
+"""
+from twisted.trial import unittest
+
+from piqueserver.admission import AdmissionControl
+
+
+class TestAdmissionControl(unittest.TestCase):
+    def test_burst_and_refill(self):
+        admission = AdmissionControl('queries', rate=2, burst=4)
+        self.assertEqual([admission.admit('10.0.0.1', 0) for _ in range(6)],
+                         [True] * 4 + [False] * 2)
+        # other sources have their own buckets
+        self.assertTrue(admission.admit('10.0.0.2', 0))
+        self.assertFalse(admission.admit('10.0.0.1', 0.25))
+        self.assertTrue(admission.admit('10.0.0.1', 0.5))
+        # the bucket never holds more than burst
+        self.assertEqual([admission.admit('10.0.0.1', 100)
+                          for _ in range(5)], [True] * 4 + [False])
+        self.assertEqual(admission.admitted, 10)
+        self.assertEqual(admission.dropped, 4)
+        self.assertEqual(dict(admission.offenders), {'10.0.0.1': 4})
+
+    def test_total_rate(self):
+        admission = AdmissionControl('queries', rate=1, burst=1, total_rate=2)
+        self.assertEqual([admission.admit('10.0.0.{}'.format(index), 0)
+                          for index in range(4)], [True, True, False, False])
+        self.assertEqual(admission.dropped_total, 2)
+        self.assertEqual(len(admission.offenders), 0)
+        self.assertTrue(admission.admit('10.0.0.3', 1))
+
+    def test_bounded(self):
+        admission = AdmissionControl('packets', rate=1, burst=1,
+                                     max_sources=8, max_offenders=4)
+        for index in range(20):
+            host = '10.0.0.{}'.format(index)
+            admission.admit(host, 0)
+            admission.admit(host, 0)
+        self.assertEqual(len(admission.buckets), 8)
+        self.assertEqual(list(admission.offenders),
+                         ['10.0.0.{}'.format(index) for index in range(16, 20)])
@@ -33,3 +33,72 @@ async def test_ban_manger_update_bans():
     assert banm.get_ban("189.5.43.17") is not None
     assert banm.get_ban("177.142.42.13") is None
     await site.stop()
+
+
+def test_json_array_parser():
+    text = '  [{"ip": "1.1.1.1", "reason": "a,]"}, 2,\n{"ip": "1.1.1.2"}, 345 ]'
+    for size in (1, 3, 7, len(text)):
+        parser = bansubscribe.JSONArrayParser()
+        items = []
+        chunks = [text[i:i + size] for i in range(0, len(text), size)]
+        for chunk in chunks[:-1]:
+            items += parser.feed(chunk)
+        items += parser.feed(chunks[-1], final=True)
+        assert items == [{"ip": "1.1.1.1", "reason": "a,]"}, 2,
+                         {"ip": "1.1.1.2"}, 345]
+
+    with pytest.raises(ValueError):
+        bansubscribe.JSONArrayParser().feed('[{"ip": "1.1', final=True)
+    with pytest.raises(ValueError):
+        bansubscribe.JSONArrayParser().feed('{"ip": "1.1.1.1"}')
+
+
+@pytest.mark.asyncio
+async def test_ban_manager_conditional_update():
+    state = {
+        "etag": '"1"',
+        "bans": [
+            {"ip": "189.5.43.17", "name": "GreaseMonkey", "reason": "Cheating"},
+            {"ip": "10.0.0.0/8", "name": "Deuce", "reason": "Griefing"},
+        ],
+        "requests": [],
+    }
+
+    async def handler(request):
+        state["requests"].append(request.headers.get("If-None-Match"))
+        if request.headers.get("If-None-Match") == state["etag"]:
+            return web.Response(status=304)
+        return web.json_response(state["bans"],
+                                 headers={"ETag": state["etag"]})
+
+    app = web.Application()
+    app.router.add_get('/', handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, 'localhost', 9192)
+    await site.start()
+
+    banm = bansubscribe.BanSubscribeManager(Mock())
+    banm.urls = [("http://localhost:9192/", [])]
+    await banm.update_bans()
+    assert banm.get_ban("189.5.43.17") == "Cheating"
+    assert banm.get_ban("10.1.2.3") == "Griefing"
+    index = banm.bans
+
+    # not modified, the index is kept as it is
+    await banm.update_bans()
+    assert banm.bans is index
+    assert state["requests"] == [None, '"1"']
+
+    state["etag"] = '"2"'
+    state["bans"] = state["bans"][1:] + [
+        {"ip": "10.1.0.0/16", "name": "Danko", "reason": "Spam"}]
+    await banm.update_bans()
+    assert banm.get_ban("189.5.43.17") is None
+    assert banm.get_ban("10.1.2.3") == "Spam"
+    assert banm.get_ban("10.2.0.1") == "Griefing"
+
+    # failed fetches keep the last list
+    await runner.cleanup()
+    await banm.update_bans()
+    assert banm.get_ban("10.1.2.3") == "Spam"
@@ -0,0 +1,90 @@
+"""
+test piqueserver/banpublish.py
+"""
+import gzip
+import json
+from ipaddress import ip_network
+from unittest.mock import Mock
+
+from twisted.trial import unittest
+from twisted.web.test.requesthelper import DummyRequest
+
+from piqueserver import banpublish
+
+
+class TestPublishServer(unittest.TestCase):
+    def setUp(self):
+        self.bans = [(ip_network('10.0.0.1'), 'Deuce', 'grief', None),
+                     (ip_network('10.0.1.0/24'), 'Danko', 'spam', None)]
+        protocol = Mock()
+        protocol.ban_manager.get_all_bans = lambda: list(self.bans)
+        self.server = banpublish.PublishServer(protocol, 0)
+        self.resource = banpublish.PublishResource(self.server)
+
+    def get(self, headers=None, args=None):
+        request = DummyRequest([b''])
+        for name, value in (headers or {}).items():
+            request.requestHeaders.setRawHeaders(name, [value])
+        request.args = args or {}
+        body = self.resource.render_GET(request)
+        return request, body
+
+    def header(self, request, name):
+        return request.responseHeaders.getRawHeaders(name, [None])[0]
+
+    def test_body(self):
+        request, body = self.get()
+        self.assertEqual(json.loads(body), [
+            {'ip': '10.0.0.1/32', 'reason': 'grief'},
+            {'ip': '10.0.1.0/24', 'reason': 'spam'}])
+        self.assertIsNone(self.header(request, 'Content-Encoding'))
+        self.assertEqual(self.header(request, 'X-Bans-Version'),
+                         self.server.run_id + '-1')
+
+    def test_gzip(self):
+        request, body = self.get({'Accept-Encoding': 'deflate, gzip'})
+        self.assertEqual(self.header(request, 'Content-Encoding'), 'gzip')
+        self.assertEqual(gzip.decompress(body),
+                         self.server.json_bans.encode())
+        # compressed once per list
+        self.assertIs(self.get({'Accept-Encoding': 'gzip'})[1], body)
+        request, body = self.get({'Accept-Encoding': 'gzip;q=0'})
+        self.assertIsNone(self.header(request, 'Content-Encoding'))
+
+    def test_etag(self):
+        request, _ = self.get()
+        etag = self.header(request, 'ETag')
+        request, body = self.get({'If-None-Match': etag})
+        self.assertEqual(request.responseCode, 304)
+        self.assertEqual(body, b'')
+        # unchanged lists keep their ETag
+        self.server.update()
+        self.assertEqual(self.get({'If-None-Match': etag})[0].responseCode,
+                         304)
+        self.bans.pop()
+        self.server.update()
+        request, _ = self.get({'If-None-Match': etag})
+        self.assertNotEqual(request.responseCode, 304)
+        self.assertNotEqual(self.header(request, 'ETag'), etag)
+
+    def test_delta(self):
+        self.bans.pop(0)
+        self.server.update()
+        self.bans.append((ip_network('10.0.2.1'), 'Deuce', 'grief', None))
+        self.server.update()
+        run_id = self.server.run_id
+        _, body = self.get(args={b'since': [run_id.encode() + b'-1']})
+        self.assertEqual(json.loads(body), {
+            'version': run_id + '-3',
+            'added': [{'ip': '10.0.2.1/32', 'reason': 'grief'}],
+            'removed': ['10.0.0.1/32']})
+        _, body = self.get(args={b'since': [run_id.encode() + b'-3']})
+        self.assertEqual(json.loads(body),
+                         {'version': run_id + '-3', 'added': [],
+                          'removed': []})
+        # too old or unknown versions, and versions of an earlier run, get
+        # the whole list
+        for since in (b'-5', b'4', b'x', run_id.encode() + b'-4',
+                      run_id.encode() + b'-x', b'00000000-2'):
+            _, body = self.get(args={b'since': [since]})
+            self.assertEqual(len(json.loads(body)), 2)
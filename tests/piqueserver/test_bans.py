@@ -0,0 +1,158 @@
+"""
+test piqueserver/bans.py
+"""
+import json
+import os
+import shutil
+import tempfile
+from ipaddress import ip_network
+from types import SimpleNamespace
+
+from twisted.internet.task import Clock
+from twisted.trial import unittest
+
+from piqueserver import bans
+from piqueserver.bans import BanJournal, DefaultBanManager
+from piqueserver.config import config
+from piqueserver.networkdict import NetworkDict
+
+
+class TestBanJournal(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'bans.txt')
+        self.journal = BanJournal(self.path)
+
+    def tearDown(self):
+        self.journal.close()
+        shutil.rmtree(self.directory)
+
+    def load(self):
+        database = NetworkDict()
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                database.read_list(json.load(f))
+        journal = BanJournal(self.path)
+        journal.load(database)
+        return database, journal
+
+    def test_append_and_load(self):
+        self.journal.append(added=[
+            (ip_network('10.0.0.1/32'), ('Deuce', 'grief', None)),
+            (ip_network('10.0.1.0/24'), ('Deuce', 'grief', 123.0))])
+        self.journal.append(removed=[ip_network('10.0.0.1/32')])
+        self.assertEqual(self.journal.records, 3)
+        self.assertFalse(os.path.exists(self.path))
+
+        database, journal = self.load()
+        self.assertEqual(journal.records, 3)
+        self.assertEqual(database.make_list(),
+                         [['Deuce', '10.0.1.0/24', 'grief', 123.0]])
+
+    def test_truncated_record(self):
+        self.journal.append(added=[
+            (ip_network('10.0.0.1/32'), ('Deuce', 'grief', None))])
+        self.journal.close()
+        with open(self.journal.journal_path, 'a') as f:
+            f.write('{"add": ["Deuce", "10.0.')
+        database, journal = self.load()
+        self.assertEqual(len(database), 1)
+        self.assertEqual(journal.records, 1)
+
+    def test_compact(self):
+        database = NetworkDict()
+        database['10.0.0.1'] = ['Deuce', 'grief', None]
+        self.journal.append(added=[(ip_network('10.0.0.1/32'),
+                                    database['10.0.0.1'])])
+        self.assertTrue(self.journal.needs_compaction())
+
+        def compacted(count):
+            self.assertEqual(count, 1)
+            self.assertFalse(self.journal.needs_compaction())
+            self.assertFalse(os.path.exists(self.journal.journal_path))
+            self.assertFalse(os.path.exists(self.journal.old_path))
+            with open(self.path) as f:
+                self.assertEqual(json.load(f),
+                                 [['Deuce', '10.0.0.1', 'grief', None]])
+
+        return self.journal.compact(database).addCallback(compacted)
+
+    def test_changes_during_compaction(self):
+        database = NetworkDict()
+        database['10.0.0.1'] = ['Deuce', 'grief', None]
+        self.journal.append(added=[(ip_network('10.0.0.1/32'),
+                                    database['10.0.0.1'])])
+        d = self.journal.compact(database)
+        # made while the list is written, so it goes to the new journal
+        self.journal.append(added=[(ip_network('10.0.0.2/32'),
+                                    ('Deuce', 'grief', None))])
+        database['10.0.0.2'] = ['Deuce', 'grief', None]
+
+        def compacted(count):
+            self.assertTrue(self.journal.needs_compaction())
+            loaded, _ = self.load()
+            self.assertEqual(loaded.make_list(), database.make_list())
+
+        return d.addCallback(compacted)
+
+    def test_failed_compaction_kept(self):
+        self.journal.append(added=[(ip_network('10.0.0.1/32'),
+                                    ('Deuce', 'grief', None))])
+        self.journal.rotate()
+        self.journal.append(added=[(ip_network('10.0.0.2/32'),
+                                    ('Deuce', 'grief', None))])
+        self.journal.rotate()
+        database, _ = self.load()
+        self.assertEqual(len(database), 2)
+
+
+class TestBanExpiry(unittest.TestCase):
+    def setUp(self):
+        self.config_dir = config.config_dir
+        config.config_dir = tempfile.mkdtemp()
+        self.clock = Clock()
+        self.clock.advance(1000)
+        self.patch(bans, 'reactor', self.clock)
+        self.patch(bans, 'time', SimpleNamespace(time=self.clock.seconds))
+        self.manager = DefaultBanManager(SimpleNamespace(connections={}))
+
+    def tearDown(self):
+        shutil.rmtree(config.config_dir)
+        config.config_dir = self.config_dir
+
+    def get_banned(self):
+        return [str(ban[0]) for ban in self.manager.get_all_bans()]
+
+    def test_expiry(self):
+        manager = self.manager
+        manager.add_ban('10.0.0.1', 'Deuce', 'grief', None)
+        manager.add_ban('10.0.0.2', 'Deuce', 'grief', 60)
+        manager.add_ban('10.0.0.3', 'Deuce', 'grief', 30)
+        self.assertEqual(len(self.clock.getDelayedCalls()), 1)
+        self.clock.advance(30)
+        self.assertEqual(self.get_banned(), ['10.0.0.1/32', '10.0.0.2/32'])
+        # banned again for longer, the first expiry is out of date
+        manager.remove_ban('10.0.0.2')
+        manager.add_ban('10.0.0.2', 'Deuce', 'grief', 120)
+        self.clock.advance(30)
+        self.assertEqual(self.get_banned(), ['10.0.0.1/32', '10.0.0.2/32'])
+        self.clock.advance(90)
+        self.assertEqual(self.get_banned(), ['10.0.0.1/32'])
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+        with open(os.path.join(config.config_dir, 'bans.txt')) as f:
+            self.assertEqual(json.load(f),
+                             [['Deuce', '10.0.0.1', 'grief', None]])
+
+    def test_batched(self):
+        manager = self.manager
+        self.clock.advance(100)
+        for index in range(5):
+            manager.add_ban('10.0.0.{}'.format(index), 'Deuce', 'grief',
+                            1 + index)
+        self.clock.advance(1)
+        self.assertEqual(len(self.get_banned()), 4)
+        # the rest expire within EXPIRY_INTERVAL, and are removed together
+        self.clock.advance(bans.EXPIRY_INTERVAL - 1)
+        self.assertEqual(len(self.get_banned()), 4)
+        self.clock.advance(1)
+        self.assertEqual(self.get_banned(), [])
@@ -1,6 +1,10 @@
+import asyncio
 import unittest
+from types import SimpleNamespace
 from unittest.mock import Mock
-from piqueserver.commands import command, _alias_map, target_player
+from piqueserver.commands import (
+    command, _alias_map, _handle_command, target_player, get_player,
+    CommandError)
 
 
 class TestCommandDecorator(unittest.TestCase):
@@ -30,6 +34,33 @@ class TestCommandDecorator(unittest.TestCase):
             pass
         self.assertEqual(_alias_map['n'], 'name')
 
+    def test_command_spec(self):
+        @command()
+        def test(connection, a, b=None):
+            pass
+        self.assertEqual(test.command_spec, (1, 2))
+
+        @command()
+        def test(connection, *args):
+            pass
+        self.assertEqual(test.command_spec, (0, None))
+
+    def test_invalid_number_of_arguments(self):
+        @command('testarity')
+        def test(connection, a):
+            """
+            Test
+            /testarity <a>
+            """
+            return a
+
+        connection = Mock()
+        result = asyncio.run(_handle_command(connection, 'testarity', []))
+        self.assertEqual(result,
+                         'Invalid number of arguments\nUsage: /testarity <a>')
+        result = asyncio.run(_handle_command(connection, 'testarity', ['x']))
+        self.assertEqual(result, 'x')
+
 
 class TestTargetPlayerDecorator(unittest.TestCase):
     def test_no_arg_non_player(self):
@@ -54,3 +85,27 @@ class TestTargetPlayerDecorator(unittest.TestCase):
         connection.protocol.players.values = lambda: [connection]
 
         test(connection)
+
+
+class TestGetPlayer(unittest.TestCase):
+    def setUp(self):
+        self.deuce = SimpleNamespace(name='Deuce', world_object=object())
+        self.deuce2 = SimpleNamespace(name='Deuce2', world_object=None)
+        self.protocol = SimpleNamespace(
+            players={0: self.deuce, 1: self.deuce2},
+            player_names={'deuce': self.deuce, 'deuce2': self.deuce2})
+
+    def test_by_id(self):
+        self.assertIs(get_player(self.protocol, '#1'), self.deuce2)
+
+    def test_by_name(self):
+        self.assertIs(get_player(self.protocol, 'DEUCE'), self.deuce)
+        with self.assertRaises(CommandError):
+            get_player(self.protocol, 'deuce2', spectators=False)
+
+    def test_by_partial_name(self):
+        self.assertIs(get_player(self.protocol, 'ce2'), self.deuce2)
+        with self.assertRaises(CommandError):
+            get_player(self.protocol, 'euc')
+        with self.assertRaises(CommandError):
+            get_player(self.protocol, 'nobody')
@@ -0,0 +1,143 @@
+"""
+test piqueserver/hooks.py
+"""
+from types import ModuleType
+from unittest.mock import patch
+
+from twisted.trial import unittest
+
+from piqueserver import extensions, hooks
+from piqueserver.config import config
+from piqueserver.player import FeatureConnection
+
+
+class Clock:
+    def __init__(self):
+        self.time = 0.0
+
+    def __call__(self):
+        return self.time
+
+
+def make_script(name, cost, clock):
+    script = ModuleType(name + '_pique_script')
+
+    def apply_script(protocol, connection, config):
+        class ScriptConnection(connection):
+            def on_hit(self, *args):
+                clock.time += cost
+                return connection.on_hit(self, *args)
+
+            def not_a_hook(self):
+                pass
+
+        ScriptConnection.__module__ = script.__name__
+        return protocol, ScriptConnection
+
+    script.apply_script = apply_script
+    return script
+
+
+class BaseConnection:
+    def __init__(self):
+        pass
+
+    def on_hit(self, damage):
+        return damage
+
+
+class BaseProtocol:
+    pass
+
+
+class TestHookProfiler(unittest.TestCase):
+    def test_get_script_name(self):
+        self.assertEqual(hooks.get_script_name(
+            'piqueserver.scripts.afk_pique_script'),
+            'piqueserver.scripts.afk')
+
+    def test_instrument(self):
+        clock = Clock()
+        profiler = hooks.HookProfiler()
+        traces = []
+        profiler.tracer = lambda label, seconds: traces.append(label)
+        scripts = [make_script('first', 1.0, clock),
+                   make_script('second', 2.0, clock)]
+        with patch('piqueserver.hooks.perf_counter', clock):
+            protocol_class, connection_class = extensions.apply_scripts(
+                scripts, config, BaseProtocol, BaseConnection, profiler)
+            self.assertEqual(connection_class().on_hit(10), 10)
+            connection_class().on_hit(10)
+
+        self.assertTrue(profiler.enabled)
+        self.assertEqual(set(profiler.stats), {
+            ('server', 'on_hit'), ('first', 'on_hit'), ('second', 'on_hit')})
+        first = profiler.stats['first', 'on_hit']
+        second = profiler.stats['second', 'on_hit']
+        self.assertEqual((first.calls, first.total, first.max), (2, 2.0, 1.0))
+        self.assertEqual((second.calls, second.total, second.max),
+                         (2, 4.0, 2.0))
+        self.assertEqual(profiler.stats['server', 'on_hit'].calls, 2)
+        self.assertEqual(traces,
+                         ['server.on_hit', 'first.on_hit', 'second.on_hit'] * 2)
+        self.assertEqual(profiler.stack, [])
+        self.assertEqual(
+            [(script, hook) for script, hook, _ in profiler.summary()],
+            [('second', 'on_hit'), ('first', 'on_hit'), ('server', 'on_hit')])
+
+        profiler.reset()
+        self.assertEqual(profiler.summary(), [])
+
+    def test_disabled(self):
+        scripts = [make_script('first', 1.0, Clock())]
+        _, connection_class = extensions.apply_scripts(
+            scripts, config, BaseProtocol, BaseConnection)
+        self.assertFalse(hasattr(connection_class.on_hit,
+                                 'hook_profiler_wrapped'))
+
+
+def make_broken_script(name):
+    script = ModuleType(name + '_pique_script')
+
+    def apply_script(protocol, connection, config):
+        class BrokenConnection(connection):
+            def on_hit(self, damage):
+                return damage * 2
+
+            def on_custom(self):
+                pass
+
+        BrokenConnection.__module__ = script.__name__
+        return protocol, BrokenConnection
+
+    script.apply_script = apply_script
+    return script
+
+
+class TestHookRegistry(unittest.TestCase):
+    def test_registry(self):
+        clock = Clock()
+        scripts = [make_script('first', 1.0, clock),
+                   make_broken_script('broken'),
+                   make_script('last', 1.0, clock)]
+        _, connection_class = extensions.apply_scripts(
+            scripts, config, BaseProtocol, BaseConnection)
+        registry = hooks.get_hook_registry(connection_class, BaseConnection)
+        self.assertEqual([script for script, _ in registry['on_hit']],
+                         ['last', 'broken', 'first'])
+        self.assertNotIn('not_a_hook', registry)
+        # on_custom is added by the script, so there is nothing to call
+        self.assertEqual(
+            list(hooks.get_broken_chains(registry, BaseConnection)),
+            [('broken', 'on_hit')])
+
+    def test_bundled_scripts(self):
+        # only scripts applied alone, as their order is not known
+        _, connection_class = extensions.apply_scripts(
+            extensions.load_scripts(['piqueserver.scripts.spadenadefix'], '',
+                                    'script'),
+            config, BaseProtocol, FeatureConnection)
+        registry = hooks.get_hook_registry(connection_class,
+                                           FeatureConnection)
+        self.assertEqual(
+            list(hooks.get_broken_chains(registry, FeatureConnection)), [])
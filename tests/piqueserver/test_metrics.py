@@ -0,0 +1,88 @@
+"""
+test piqueserver/metrics.py
+"""
+import time
+from types import SimpleNamespace
+
+from twisted.trial import unittest
+
+from piqueserver import metrics
+from piqueserver.admission import AdmissionControl
+from pyspades.profiler import Histogram, TickProfiler
+from pyspades.protocol import PacketCounter
+
+
+def make_protocol():
+    profiler = TickProfiler(1 / 60)
+    profiler.record_packet(0, 0.002)
+    profiler.record_phase('world', 0.0003)
+    profiler.end_tick(0.001)
+    packets_in = PacketCounter()
+    packets_in.record(b'\x00' + b'\x00' * 12)
+    packets_out = PacketCounter()
+    packets_out.record(b'\x13' + b'\x00' * 100, 3)
+    peer = SimpleNamespace(roundTripTime=40, packetLoss=655)
+    connection = SimpleNamespace(peer=peer, map_data=object())
+    query_admission = AdmissionControl('queries', 1, 1)
+    for _ in range(3):
+        query_admission.admit('10.0.0.1', 0)
+    return SimpleNamespace(
+        start_time=time.time(), profiler=profiler, packets_in=packets_in,
+        packets_out=packets_out, host=None, connections={0: connection},
+        players={}, blocks_built=5, blocks_removed=7,
+        query_admission=query_admission, packet_admission=None)
+
+
+def parse(page):
+    samples = {}
+    for line in page.decode('utf-8').splitlines():
+        if not line.startswith('#'):
+            name, value = line.rsplit(' ', 1)
+            samples[name] = float(value)
+    return samples
+
+
+class TestMetrics(unittest.TestCase):
+    def test_render(self):
+        samples = parse(metrics.render_metrics(make_protocol()))
+        self.assertEqual(
+            samples['piqueserver_packets_in_total{packet="PositionData"}'], 1)
+        self.assertEqual(samples[
+            'piqueserver_packet_bytes_out_total{packet="MapChunk"}'], 303)
+        self.assertEqual(samples[
+            'piqueserver_packet_handler_seconds_count{packet="PositionData"}'],
+            1)
+        self.assertEqual(samples[
+            'piqueserver_tick_seconds_bucket{le="0.001"}'], 0)
+        self.assertEqual(samples[
+            'piqueserver_tick_seconds_bucket{le="0.005"}'], 1)
+        self.assertEqual(samples[
+            'piqueserver_peer_rtt_milliseconds_bucket{le="50.0"}'], 1)
+        self.assertEqual(samples[
+            'piqueserver_peer_packet_loss_ratio_bucket{le="0.005"}'], 0)
+        self.assertEqual(samples[
+            'piqueserver_peer_packet_loss_ratio_bucket{le="0.01"}'], 1)
+        self.assertEqual(samples['piqueserver_map_transfers'], 1)
+        self.assertEqual(samples[
+            'piqueserver_admission_dropped_total{kind="queries",'
+            'limit="source"}'], 2)
+        self.assertEqual(samples['piqueserver_admission_offenders'
+                                 '{kind="queries"}'], 1)
+        self.assertEqual(samples['piqueserver_blocks_removed_total'], 7)
+        self.assertIn('process_cpu_seconds_total', samples)
+
+    def test_gc_monitor(self):
+        monitor = metrics.GCMonitor()
+        monitor.callback('start', {'generation': 1})
+        monitor.callback('stop', {'generation': 1})
+        self.assertEqual(monitor.pauses[1].count, 1)
+        self.assertEqual(monitor.pauses[0].count, 0)
+
+
+class TestHistogramBuckets(unittest.TestCase):
+    def test_cumulative(self):
+        histogram = Histogram()
+        for seconds in (0.0001, 0.003, 0.02, 5.0):
+            histogram.record(seconds)
+        self.assertEqual(histogram.cumulative([0.001, 0.01, 0.1, 1.0]),
+                         [1, 2, 3, 3])
@@ -1,4 +1,7 @@
-from piqueserver.networkdict import NetworkDict
+import random
+from ipaddress import IPv4Address, ip_network
+
+from piqueserver.networkdict import NetworkDict, NetworkRanges, parse_network
 import unittest
 
 
@@ -83,3 +86,172 @@ class TestNetworkDict(unittest.TestCase):
                 'GOD', ': esp hacker', 1511717871.435394]
             self.assertEqual((case["within"] in networkdict), True)
             self.assertEqual((case["outside"] in networkdict), False)
+
+    def test_longest_prefix(self):
+        networkdict = NetworkDict()
+        networkdict["10.0.0.0/8"] = ['a']
+        networkdict["10.1.0.0/16"] = ['b']
+        networkdict["10.1.2.3"] = ['c']
+        self.assertEqual(networkdict["10.1.2.3"], ['c'])
+        self.assertEqual(networkdict["10.1.2.4"], ['b'])
+        self.assertEqual(networkdict["10.2.2.4"], ['a'])
+        self.assertEqual(networkdict["10.1.2.0/24"], ['b'])
+        self.assertEqual(networkdict["10.0.0.0/8"], ['a'])
+        self.assertRaises(KeyError, lambda: networkdict["10.0.0.0/7"])
+        self.assertRaises(ValueError, lambda: networkdict["10.1.2.3/24"])
+
+    def test_remove_supernets(self):
+        networkdict = NetworkDict()
+        networkdict["10.0.0.0/8"] = ['a']
+        networkdict["10.1.0.0/16"] = ['b']
+        networkdict["10.2.0.0/16"] = ['c']
+        removed = networkdict.remove("10.1.2.3")
+        self.assertEqual(removed, [[ip_network("10.1.0.0/16"), ['b']],
+                                   [ip_network("10.0.0.0/8"), ['a']]])
+        self.assertEqual(len(networkdict), 1)
+        self.assertNotIn("10.1.2.3", networkdict)
+        self.assertIn("10.2.2.3", networkdict)
+
+    def test_ipv6(self):
+        networkdict = NetworkDict()
+        networkdict["2001:db8::/32"] = ['a']
+        networkdict["2001:db8:1::1"] = ['b']
+        networkdict["1.2.3.4"] = ['c']
+        self.assertEqual(networkdict["2001:db8:1::1"], ['b'])
+        self.assertEqual(networkdict["2001:db8:ffff::1"], ['a'])
+        self.assertNotIn("2001:db9::1", networkdict)
+        self.assertNotIn("::ffff:1.2.3.4", networkdict)
+        self.assertEqual(networkdict.make_list(), [
+            ['a', '2001:db8::/32'], ['b', '2001:db8:1::1'], ['c', '1.2.3.4']])
+
+    def test_discard(self):
+        networkdict = NetworkDict()
+        networkdict["10.0.0.0/8"] = ['a']
+        networkdict.discard("10.1.2.3")
+        self.assertIn("10.1.2.3", networkdict)
+        networkdict.discard("10.0.0.0/8")
+        self.assertNotIn("10.1.2.3", networkdict)
+        self.assertEqual(networkdict.prefixes, {4: {}, 6: {}})
+
+    def test_pop_unindexes(self):
+        networkdict = NetworkDict()
+        networkdict["10.0.0.0/8"] = ['a']
+        networkdict["10.1.2.3"] = ['b']
+        self.assertEqual(networkdict.pop(), ('10.1.2.3', ['b']))
+        self.assertEqual(networkdict["10.1.2.3"], ['a'])
+
+    def test_parse_network(self):
+        self.assertEqual(parse_network("1.2.3.4"), (4, 0x01020304, 32))
+        self.assertEqual(parse_network("1.2.3.0/24"), (4, 0x01020300, 24))
+        self.assertEqual(parse_network("1.2.3.4/24", strict=False),
+                         (4, 0x01020300, 24))
+        self.assertEqual(parse_network("1.2.3.0/255.255.255.0"),
+                         (4, 0x01020300, 24))
+        self.assertEqual(parse_network(ip_network("::1")), (6, 1, 128))
+        for invalid in ("1.2.3", "1.2.3.4/33", "1.2.3.4/24", "foo", ""):
+            self.assertRaises(ValueError, parse_network, invalid)
+
+    def test_subnets_and_supernets(self):
+        networkdict = NetworkDict()
+        for network in ("10.1.2.3", "10.0.0.0/8", "10.1.0.0/16", "10.1.2.0/24",
+                        "11.0.0.1", "9.255.255.255", "::a00:0/104"):
+            networkdict[network] = ['x']
+        self.assertEqual(
+            [str(network) for network in networkdict.get_subnets("10.1.0.0/16")],
+            ["10.1.0.0/16", "10.1.2.0/24", "10.1.2.3/32"])
+        self.assertEqual(
+            [str(network) for network in networkdict.get_supernets("10.1.2.0/24")],
+            ["10.1.2.0/24", "10.1.0.0/16", "10.0.0.0/8"])
+        self.assertEqual(
+            [str(network) for network in networkdict.get_overlaps("10.1.0.0/16")],
+            ["10.0.0.0/8", "10.1.0.0/16", "10.1.2.0/24", "10.1.2.3/32"])
+        self.assertEqual(networkdict.get_overlaps("12.0.0.0/8"), [])
+        del networkdict["10.1.2.0/24"]
+        networkdict.remove("11.0.0.1")
+        self.assertEqual(
+            [str(network) for network in networkdict.get_subnets("0.0.0.0/0")],
+            ["9.255.255.255/32", "10.0.0.0/8", "10.1.0.0/16", "10.1.2.3/32"])
+
+    def test_overlaps_match_brute_force(self):
+        rng = random.Random(0)
+        networkdict = NetworkDict()
+        for _ in range(500):
+            prefixlen = rng.choice((8, 16, 24, 28, 32, 32, 32))
+            address = IPv4Address(rng.getrandbits(8) << 24 |
+                                  rng.getrandbits(24) & 0xff00ff)
+            networkdict["{}/{}".format(address, prefixlen)] = ['x']
+        stored = list(networkdict.networks)
+        for network in rng.sample(stored, 100):
+            networkdict.discard(network)
+        stored = list(networkdict.networks)
+        for _ in range(200):
+            prefixlen = rng.choice((4, 8, 16, 24, 32))
+            key = ip_network("{}/{}".format(
+                IPv4Address(rng.getrandbits(32)), prefixlen), strict=False)
+            self.assertEqual(
+                set(networkdict.get_overlaps(key)),
+                {network for network in stored if network.overlaps(key)})
+            self.assertEqual(
+                set(networkdict.get_subnets(key)),
+                {network for network in stored if network.subnet_of(key)})
+
+
+class TestNetworkRanges(unittest.TestCase):
+
+    def make_ranges(self, items):
+        return NetworkRanges((parse_network(key), value) for key, value in items)
+
+    def test_lookup(self):
+        ranges = self.make_ranges([
+            ("10.0.0.0/8", "a"), ("10.1.0.0/16", "b"), ("10.1.2.3", "c"),
+            ("10.2.0.0/16", "d"), ("2001:db8::/32", "e")])
+        self.assertEqual(len(ranges), 5)
+        self.assertEqual(ranges["10.1.2.3"], "c")
+        self.assertEqual(ranges["10.1.2.4"], "b")
+        self.assertEqual(ranges["10.1.2.0/24"], "b")
+        self.assertEqual(ranges["10.3.0.1"], "a")
+        self.assertNotIn("10.0.0.0/7", ranges)
+        self.assertEqual(ranges["2001:db8::1"], "e")
+        self.assertIsNone(ranges.get("11.0.0.1"))
+        self.assertNotIn("2001:db9::1", ranges)
+        with self.assertRaises(KeyError):
+            ranges["9.255.255.255"]
+
+    def test_update(self):
+        ranges = self.make_ranges([("10.0.0.0/8", "a"), ("10.1.2.3", "c")])
+        updated = ranges.update({parse_network("10.1.0.0/16"): "b",
+                                 parse_network("10.0.0.0/8"): "x"},
+                                [parse_network("10.1.2.3")])
+        self.assertEqual(ranges["10.1.2.3"], "c")
+        self.assertEqual(updated["10.1.2.3"], "b")
+        self.assertEqual(updated["10.2.0.0"], "x")
+        self.assertEqual(
+            list(updated.items()),
+            [(parse_network("10.0.0.0/8"), "x"),
+             (parse_network("10.1.0.0/16"), "b")])
+
+    def test_matches_network_dict(self):
+        rng = random.Random(0)
+        networkdict = NetworkDict()
+        items = {}
+        for index in range(500):
+            prefixlen = rng.choice((8, 16, 24, 28, 32, 32, 32))
+            address = IPv4Address(rng.getrandbits(8) << 24 |
+                                  rng.getrandbits(24) & 0xff00ff)
+            key = "{}/{}".format(address, prefixlen)
+            networkdict[key] = index
+            items[parse_network(key, strict=False)] = index
+        ranges = NetworkRanges(items.items())
+        removed = [parse_network(str(network))
+                   for network in rng.sample(list(networkdict.networks), 100)]
+        for version, address, prefixlen in removed:
+            del networkdict["{}/{}".format(IPv4Address(address), prefixlen)]
+        ranges = ranges.update({}, removed)
+        for _ in range(2000):
+            address = str(IPv4Address(rng.getrandbits(8) << 24 |
+                                      rng.getrandbits(24) & 0xff00ff))
+            try:
+                expected = networkdict[address]
+            except KeyError:
+                expected = None
+            self.assertEqual(ranges.get(address), expected)
@@ -0,0 +1,105 @@
+"""
+test piqueserver/overview.py
+"""
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+from piqueserver.overview import MAX_ZOOM, TILE_SIZE, TILES, Overview
+from pyspades.vxl import OVERVIEW_TILE_SIZE, VXLData
+
+
+def make_map():
+    the_map = VXLData()
+    for x in range(0, 512, 8):
+        the_map.set_column_fast(x, x, 30, 63, 32, 0x00FF00)
+    return the_map
+
+
+def count_drawn(overview):
+    drawn = []
+    draw_tile = overview.draw_tile
+
+    def counting_draw_tile(the_map, index):
+        drawn.append(index)
+        draw_tile(the_map, index)
+    overview.draw_tile = counting_draw_tile
+    return drawn
+
+
+@pytest.mark.asyncio
+async def test_update():
+    the_map = make_map()
+    overview = Overview()
+    drawn = count_drawn(overview)
+    await overview.update(the_map)
+    assert len(drawn) == TILES * TILES
+    assert bytes(overview.pixels) == the_map.get_overview(rgba=True)
+
+    drawn.clear()
+    the_map.set_point(OVERVIEW_TILE_SIZE + 3, 1, 10, (255, 0, 0))
+    await overview.update(the_map)
+    assert drawn == [1]
+    assert bytes(overview.pixels) == the_map.get_overview(rgba=True)
+
+    drawn.clear()
+    await overview.update(make_map())
+    assert len(drawn) == TILES * TILES
+
+
+@pytest.mark.asyncio
+async def test_get_png():
+    the_map = make_map()
+    overview = Overview()
+    png = await overview.get_png(the_map)
+    image = Image.open(BytesIO(png))
+    assert image.size == (512, 512)
+    assert image.getpixel((8, 8)) == (0, 255, 0, 255)
+    # kept until the map changes
+    assert await overview.get_png(the_map) is png
+    the_map.set_point(8, 8, 10, (255, 0, 0))
+    png = await overview.get_png(the_map)
+    assert Image.open(BytesIO(png)).getpixel((8, 8)) == (255, 0, 0, 255)
+
+
+@pytest.mark.asyncio
+async def test_tiles():
+    the_map = make_map()
+    overview = Overview()
+    await overview.update(the_map)
+    etags = {(zoom, x, y): overview.get_etag(zoom, x, y)
+             for zoom in range(MAX_ZOOM + 1)
+             for x in range(1 << zoom) for y in range(1 << zoom)}
+
+    tile = await overview.get_tile(the_map, MAX_ZOOM, 1, 0)
+    image = Image.open(BytesIO(tile))
+    assert image.size == (TILE_SIZE, TILE_SIZE)
+    # (72, 72) is in the tile below
+    assert image.getpixel((0, 0)) == (0, 0, 0, 255)
+    assert await overview.get_tile(the_map, MAX_ZOOM, 1, 0) is tile
+    image = Image.open(BytesIO(await overview.get_tile(the_map, 0, 0, 0)))
+    assert image.size == (TILE_SIZE, TILE_SIZE)
+
+    the_map.set_point(TILE_SIZE, 0, 10, (255, 0, 0))
+    await overview.update(the_map)
+    changed = [key for key, etag in etags.items()
+               if overview.get_etag(*key) != etag]
+    # the tile and the ones above it
+    assert changed == [(zoom, 1 >> (MAX_ZOOM - zoom), 0)
+                       for zoom in range(MAX_ZOOM + 1)]
+    tile = await overview.get_tile(the_map, MAX_ZOOM, 1, 0)
+    assert Image.open(BytesIO(tile)).getpixel((0, 0)) == (255, 0, 0, 255)
+
+
+@pytest.mark.asyncio
+async def test_encode_tile():
+    the_map = make_map()
+    overview = Overview()
+    await overview.update(the_map)
+    etag = overview.get_etag(MAX_ZOOM, 1, 0)
+    the_map.set_point(TILE_SIZE, 0, 10, (255, 0, 0))
+    # changes after the update are not drawn, so the tile matches the ETag
+    tile = await overview.encode_tile(MAX_ZOOM, 1, 0)
+    assert Image.open(BytesIO(tile)).getpixel((0, 0)) == (0, 0, 0, 255)
+    assert overview.get_etag(MAX_ZOOM, 1, 0) == etag
@@ -0,0 +1,144 @@
+"""
+test piqueserver/sqlitebans.py
+"""
+import json
+import os
+import shutil
+import tempfile
+import time
+from ipaddress import ip_network
+from types import SimpleNamespace
+
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from piqueserver import sqlitebans
+from piqueserver.config import config
+from piqueserver.sqlitebans import SqliteBanManager
+
+
+class TestSqliteBanManager(unittest.TestCase):
+    def setUp(self):
+        self.config_dir = config.config_dir
+        config.config_dir = tempfile.mkdtemp()
+        self.managers = []
+        self.manager = self.make_manager()
+
+    def tearDown(self):
+        for manager in self.managers:
+            manager.close()
+        shutil.rmtree(config.config_dir)
+        config.config_dir = self.config_dir
+
+    def make_manager(self):
+        manager = SqliteBanManager(SimpleNamespace(connections={}))
+        self.managers.append(manager)
+        return manager
+
+    def flush(self, manager=None):
+        # writes are done in order, so this fires after the queued ones
+        return (manager or self.manager).queue_write([])
+
+    def check_bans(self):
+        manager = self.manager
+        self.assertEqual(manager.get_ban('10.0.0.5')[1:],
+                         ('Deuce', 'grief', None))
+        self.assertEqual(manager.get_ban('10.0.1.1')[1:],
+                         ('Danko', 'spam', None))
+        self.assertIsNone(manager.get_ban('10.0.2.1'))
+        self.assertEqual(manager.ban_overlaps('10.0.0.0/16'),
+                         ip_network('10.0.0.0/24'))
+        self.assertFalse(manager.ban_overlaps('10.0.0.7'))
+        self.assertEqual([ban[0] for ban in manager.get_all_bans()],
+                         [ip_network('10.0.0.0/24'), ip_network('10.0.1.1')])
+
+    @defer.inlineCallbacks
+    def test_add_ban(self):
+        manager = self.manager
+        self.assertIsNone(manager.add_ban('10.0.0.0/24', 'Deuce', 'grief',
+                                          None))
+        self.assertIsNone(manager.add_ban('10.0.1.1', 'Danko', 'spam', None))
+        self.assertIsNotNone(manager.add_ban('10.0.0.7', 'Deuce', 'grief',
+                                             None))
+        self.assertIsNotNone(manager.add_ban('10.0.0.0/23', 'Deuce', 'grief',
+                                             None))
+        # before and after the bans are written
+        self.check_bans()
+        yield self.flush()
+        self.assertEqual(len(manager.pending_added), 0)
+        self.check_bans()
+
+    @defer.inlineCallbacks
+    def test_remove_ban(self):
+        manager = self.manager
+        manager.add_ban('10.0.0.0/24', 'Deuce', 'grief', None)
+        manager.add_ban('10.0.1.1', 'Danko', 'spam', None)
+        yield self.flush()
+        manager.add_ban('10.0.1.2', 'Danko', 'spam', None)
+        # the /24 that contains it and the bans inside the /16
+        self.assertEqual(manager.remove_ban('10.0.0.1'), 1)
+        self.assertEqual(manager.remove_ban('10.0.0.0/16'), 2)
+        self.assertEqual(manager.get_all_bans(), [])
+        yield self.flush()
+        self.assertEqual(manager.get_all_bans(), [])
+
+    @defer.inlineCallbacks
+    def test_undo_ban(self):
+        manager = self.manager
+        manager.add_ban('10.0.0.1', 'Deuce', 'grief', None)
+        manager.add_ban('10.0.0.2', 'Deuce', 'grief', None)
+        yield self.flush()
+        manager.add_ban('10.0.0.3', 'Deuce', 'grief', None)
+        self.assertEqual(manager.undo_ban()[0], ip_network('10.0.0.3'))
+        self.assertEqual(manager.undo_ban()[0], ip_network('10.0.0.2'))
+        yield self.flush()
+        self.assertEqual([ban[0] for ban in manager.get_all_bans()],
+                         [ip_network('10.0.0.1')])
+
+    @defer.inlineCallbacks
+    def test_shared_database(self):
+        other = self.make_manager()
+        self.assertIsNone(other.get_ban('10.0.0.1'))
+        self.manager.add_ban('10.0.0.1', 'Deuce', 'grief', None)
+        yield self.flush()
+        # the cached result is dropped once the database changed
+        self.assertIsNotNone(other.get_ban('10.0.0.1'))
+
+    @defer.inlineCallbacks
+    def test_vacuum(self):
+        manager = self.manager
+        manager.add_ban('10.0.0.1', 'Deuce', 'grief', None)
+        manager.add_ban('10.0.0.2', 'Deuce', 'grief', 60)
+        manager.add_ban('10.0.0.3', 'Deuce', 'grief', 60)
+        yield self.flush()
+        manager.connection.execute(
+            'UPDATE bans SET expiry = ? WHERE expiry IS NOT NULL',
+            (time.time() - 1,))
+        yield manager.vacuum_bans()
+        self.assertEqual([ban[0] for ban in manager.get_all_bans()],
+                         [ip_network('10.0.0.1')])
+
+    @defer.inlineCallbacks
+    def test_expired(self):
+        manager = self.manager
+        manager.add_ban('10.0.0.5', 'Deuce', 'grief', 60)
+        self.assertIsNotNone(manager.get_ban('10.0.0.5'))
+        self.assertTrue(manager.expiry_call.active())
+        yield self.flush()
+        self.assertIsNotNone(manager.get_ban('10.0.0.5'))
+        # expired, but not vacuumed yet
+        now = time.time() + 60
+        self.patch(sqlitebans, 'time', SimpleNamespace(time=lambda: now))
+        self.assertIsNone(manager.get_ban('10.0.0.5'))
+        self.assertEqual(manager.get_all_bans(), [])
+        self.assertIsNone(manager.add_ban('10.0.0.5', 'Deuce', 'grief', None))
+
+    def test_import_bans_file(self):
+        with open(os.path.join(config.config_dir, 'bans.txt'), 'w') as f:
+            json.dump([['Deuce', '10.0.0.0/24', 'grief', None],
+                       ['Danko', '10.0.1.1', 'spam', None]], f)
+        os.remove(self.manager.path)
+        self.manager.close()
+        self.managers.remove(self.manager)
+        self.manager = self.make_manager()
+        self.check_bans()
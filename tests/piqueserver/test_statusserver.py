@@ -3,11 +3,14 @@ from unittest.mock import Mock, patch
 from aiohttp.test_utils import AioHTTPTestCase, unittest_run_loop
 from aiohttp import web
 import piqueserver.statusserver
+from pyspades.vxl import VXLData
 
 
 class StatusSeverTest(AioHTTPTestCase):
     async def get_application(self):
         protocol = Mock()
+        protocol.map = VXLData()
+        protocol.map_info.name = 'empty'
         status_server = piqueserver.statusserver.DefaultStatusServer(protocol)
         return status_server.create_app()
 
@@ -50,3 +53,32 @@ class StatusSeverTest(AioHTTPTestCase):
             self.assertEqual(resp.status, 200)
             state = await resp.json()
             self.assertEqual(state, state_fixture)
+
+    @unittest_run_loop
+    async def test_metrics(self):
+        with patch('piqueserver.metrics.render_metrics',
+                   return_value=b'piqueserver_players 0\n'):
+            resp = await self.client.request("GET", '/metrics')
+            self.assertEqual(resp.status, 200)
+            self.assertTrue(
+                resp.headers['Content-Type'].startswith('text/plain'))
+            self.assertEqual(await resp.text(), 'piqueserver_players 0\n')
+
+    @unittest_run_loop
+    async def test_overview(self):
+        resp = await self.client.request("GET", '/overview')
+        self.assertEqual(resp.status, 200)
+        self.assertEqual(resp.headers['Content-Type'], 'image/png')
+        self.assertTrue((await resp.read()).startswith(b'\x89PNG'))
+
+    @unittest_run_loop
+    async def test_tiles(self):
+        resp = await self.client.request("GET", '/tiles/3/7/7.png')
+        self.assertEqual(resp.status, 200)
+        self.assertEqual(resp.headers['Content-Type'], 'image/png')
+        etag = resp.headers['ETag']
+        resp = await self.client.request(
+            "GET", '/tiles/3/7/7.png', headers={'If-None-Match': etag})
+        self.assertEqual(resp.status, 304)
+        resp = await self.client.request("GET", '/tiles/3/8/0.png')
+        self.assertEqual(resp.status, 404)
@@ -0,0 +1,180 @@
+"""
+test piqueserver/supervisor.py
+"""
+import asyncio
+import shutil
+import tempfile
+from ipaddress import ip_network
+from types import SimpleNamespace
+from unittest.mock import Mock
+
+from twisted.internet.task import Clock
+from twisted.trial import unittest
+
+from piqueserver import bans, supervisor
+from piqueserver.bans import SupervisedBanManager
+from piqueserver.config import config
+from piqueserver.networkdict import NetworkDict
+
+
+class FakeClient:
+    def __init__(self):
+        self.handlers = {}
+        self.sent = []
+
+    def send(self, message_type, **kw):
+        self.sent.append((message_type, kw))
+
+
+class TestWorkerOverrides(unittest.TestCase):
+    def test_overrides(self):
+        overrides = supervisor.worker_overrides(
+            1, {'port': 32888, 'cpu': 3, 'bans': {'file': 'other.txt'}})
+        self.assertEqual(overrides['port'], 32888)
+        self.assertNotIn('cpu', overrides)
+        self.assertEqual(overrides['bans'], {
+            'backend': supervisor.WORKER_BAN_BACKEND,
+            'publish': False,
+            'file': 'other.txt'})
+        self.assertEqual(overrides['logging']['logfile'],
+                         './logs/log-32888.txt')
+        self.assertEqual(overrides['status_server']['port'], 32891)
+        overrides = supervisor.worker_overrides(
+            0, {'status_server': {'port': 8080}})
+        self.assertEqual(overrides['status_server'], {'port': 8080})
+
+
+class TestSupervisedBanManager(unittest.TestCase):
+    def setUp(self):
+        self.client = FakeClient()
+        self.kicked = []
+        protocol = SimpleNamespace(supervisor_client=self.client,
+                                   connections={})
+        self.manager = SupervisedBanManager(protocol)
+        self.manager.kick_network = self.kicked.append
+
+    def test_add_ban_forwarded(self):
+        self.assertIsNone(self.manager.add_ban('10.0.0.1', 'Deuce', 'grief',
+                                               None))
+        self.assertEqual(self.client.sent, [
+            ('add_ban', {'ban': ['Deuce', '10.0.0.1/32', 'grief', None]})])
+
+    def test_remove_ban_forwarded(self):
+        self.client.handlers['bans']({'bans': [
+            ['Deuce', '10.0.0.0/24', 'grief', None],
+            ['Deuce', '10.0.1.1', 'grief', None]]})
+        self.assertEqual(self.manager.remove_ban('10.0.0.0/24'), 1)
+        self.assertEqual(self.client.sent, [
+            ('remove_bans', {'networks': ['10.0.0.0/24']})])
+        self.assertIsNotNone(self.manager.get_ban('10.0.1.1'))
+
+    def test_ban_added_elsewhere(self):
+        self.client.handlers['ban_added'](
+            {'ban': ['Deuce', '10.0.0.0/24', 'grief', None]})
+        self.assertIsNotNone(self.manager.get_ban('10.0.0.5'))
+        self.assertEqual(self.kicked, [ip_network('10.0.0.0/24')])
+        self.client.handlers['bans_removed']({'networks': ['10.0.0.0/24']})
+        self.assertIsNone(self.manager.get_ban('10.0.0.5'))
+        self.assertEqual(self.client.sent, [])
+
+
+class TestSupervisorBanManager(unittest.TestCase):
+    def setUp(self):
+        self.config_dir = config.config_dir
+        config.config_dir = tempfile.mkdtemp()
+        self.clock = Clock()
+        self.clock.advance(1000)
+        self.patch(bans, 'reactor', self.clock)
+        self.patch(bans, 'time', SimpleNamespace(time=self.clock.seconds))
+
+    def tearDown(self):
+        shutil.rmtree(config.config_dir)
+        config.config_dir = self.config_dir
+
+    def test_expiry_broadcast(self):
+        sup = supervisor.Supervisor([{}, {}])
+        for worker in sup.workers:
+            worker.writer = Mock()
+        sup.on_message(sup.workers[0], {
+            'type': 'add_ban', 'ban': ['Deuce', '10.0.0.1/32', 'grief', 1030]})
+        self.clock.advance(30)
+        self.assertIsNone(sup.ban_manager.get_ban('10.0.0.1'))
+        for worker in sup.workers:
+            worker.writer.write.assert_called_with(supervisor.encode_message(
+                'bans_removed', networks=['10.0.0.1/32']))
+
+
+class TestSupervisor(unittest.TestCase):
+    def test_ban_broadcast(self):
+        sup = supervisor.Supervisor.__new__(supervisor.Supervisor)
+        sup.ban_manager = Mock()
+        sup.ban_manager.database = NetworkDict()
+        sup.workers = [supervisor.Worker(0, {}), supervisor.Worker(1, {})]
+        for worker in sup.workers:
+            worker.writer = Mock()
+
+        ban = ['Deuce', '10.0.0.1/32', 'grief', None]
+        sup.on_message(sup.workers[0], {'type': 'add_ban', 'ban': ban})
+        self.assertEqual(sup.ban_manager.database['10.0.0.1'],
+                         ('Deuce', 'grief', None))
+        sup.ban_manager.save_change.assert_called_once_with(
+            added=[('10.0.0.1/32', ('Deuce', 'grief', None))])
+        sup.workers[0].writer.write.assert_not_called()
+        sup.workers[1].writer.write.assert_called_once_with(
+            supervisor.encode_message('ban_added', ban=ban))
+
+    def test_large_ban_list(self):
+        database = NetworkDict()
+        for index in range(3000):
+            database['10.{}.{}.1'.format(index // 256, index % 256)] = [
+                'Deuce', 'griefing the tower', None]
+
+        async def connect():
+            sup = supervisor.Supervisor.__new__(supervisor.Supervisor)
+            sup.ban_manager = SimpleNamespace(database=database)
+            sup.workers = [supervisor.Worker(0, {})]
+            sup.token = 'secret'
+            server = await asyncio.start_server(
+                sup.handle_worker, '127.0.0.1', 0, limit=supervisor.IPC_LIMIT)
+            client = supervisor.SupervisorClient(
+                SimpleNamespace(), server.sockets[0].getsockname()[1], 0,
+                'secret')
+            received = []
+
+            def on_bans(message):
+                received.append(message)
+                sup.workers[0].writer.close()
+            client.handlers['bans'] = on_bans
+            await client.run()
+            server.close()
+            return received
+
+        stop = Mock()
+        self.patch(supervisor, 'reactor', SimpleNamespace(stop=stop))
+        received = asyncio.run(connect())
+        self.assertEqual(len(received[0]['bans']), 3000)
+        stop.assert_called_once_with()
+
+    def test_token_required(self):
+        async def connect():
+            sup = supervisor.Supervisor.__new__(supervisor.Supervisor)
+            sup.ban_manager = Mock()
+            sup.workers = [supervisor.Worker(0, {})]
+            sup.token = 'secret'
+            server = await asyncio.start_server(sup.handle_worker,
+                                                '127.0.0.1', 0)
+            reader, writer = await asyncio.open_connection(
+                '127.0.0.1', server.sockets[0].getsockname()[1])
+            writer.write(supervisor.encode_message('hello', index=0,
+                                                   token='guess'))
+            writer.write(supervisor.encode_message(
+                'add_ban', ban=['Deuce', '10.0.0.1/32', 'grief', None]))
+            closed = await reader.read() == b''
+            writer.close()
+            server.close()
+            return closed, sup
+
+        closed, sup = asyncio.run(connect())
+        self.assertTrue(closed)
+        self.assertIsNone(sup.workers[0].writer)
+        sup.ban_manager.save_change.assert_not_called()
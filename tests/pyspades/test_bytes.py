@@ -3,7 +3,7 @@ tests for bytes.pyx
 """
 from twisted.trial import unittest
 
-from pyspades.bytes import ByteReader, ByteWriter
+from pyspades.bytes import ByteReader, ByteWriter, NoDataLeft
 
 class TestByteReader(unittest.TestCase):
     """tests for ByteReader"""
@@ -78,4 +78,69 @@ class TestByteReader(unittest.TestCase):
             self.assertEqual(reader.readFloat(False), 2.2132692287005784e-38)
             self.assertEqual(reader.readFloat(True), -6.384869180745487e+29)
 
+    def test_readfloat_no_data_left(self):
+        reader = ByteReader(b"\x00\x00\x80")
+        with self.assertRaises(NoDataLeft):
+            reader.readFloat(False)
+
+    def test_reset(self):
+        reader = ByteReader(b"\x01\x02")
+        self.assertEqual(reader.readByte(True), 1)
+
+        reader.reset(b"\x03\x04\x05", 1)
+        self.assertEqual(reader.dataLeft(), 2)
+        self.assertEqual(reader.readByte(True), 4)
+        self.assertEqual(reader.read(), b"\x05")
+
     # TODO: test rest of bytes.pyx, moving on to more useful modules for now
+
+
+class TestByteWriter(unittest.TestCase):
+    """tests for ByteWriter"""
+
+    def test_write(self):
+        writer = ByteWriter()
+        writer.writeByte(-15)
+        writer.writeShort(241, True, False)
+        writer.writeInt(-251596544)
+        writer.writeFloat(2.2132692287005784e-38, False)
+        writer.writeString(b"ab", 4)
+        self.assertEqual(
+            bytes(writer),
+            b"\xF1\xF1\x00\xF1\x00\xF1\x00\xF1\x00\xF1\x00ab\x00\x00")
+        self.assertEqual(len(writer), 15)
+        self.assertEqual(writer.tell(), 15)
+
+    def test_grow(self):
+        writer = ByteWriter()
+        data = bytes(range(256)) * 64
+        writer.write(data)
+        writer.writeByte(1)
+        self.assertEqual(bytes(writer), data + b"\x01")
+
+    def test_rewind(self):
+        writer = ByteWriter()
+        writer.write(b"abcd")
+        writer.rewind(2)
+        self.assertEqual(writer.tell(), 2)
+        writer.write(b"x")
+        self.assertEqual(bytes(writer), b"abxd")
+
+    def test_reset(self):
+        writer = ByteWriter()
+        writer.write(b"abcd")
+        writer.reset()
+        self.assertEqual(len(writer), 0)
+        writer.write(b"ef")
+        self.assertEqual(bytes(writer), b"ef")
+
+    def test_buffer(self):
+        writer = ByteWriter()
+        writer.write(b"abcd")
+        with memoryview(writer) as view:
+            self.assertEqual(view.tobytes(), b"abcd")
+            self.assertTrue(view.readonly)
+            self.assertRaises(BufferError, writer.reset)
+            self.assertRaises(BufferError, writer.write, b"x" * 1024)
+        writer.reset()
+        self.assertEqual(bytes(writer), b"")
@@ -0,0 +1,70 @@
+"""
+test pyspades/capture.py
+"""
+from io import BytesIO
+from types import SimpleNamespace
+
+from twisted.trial import unittest
+
+from pyspades import capture
+
+
+def make_event(event_type, peer, data=0, packet=None):
+    return SimpleNamespace(type=event_type, peer=peer, data=data,
+                           packet=packet)
+
+
+class RecordingProtocol:
+    def __init__(self):
+        self.connections = {}
+        self.events = []
+
+    def on_connect(self, peer):
+        self.connections[peer] = None
+        self.events.append(('connect', peer.address, peer.eventData))
+
+    def data_received(self, peer, packet):
+        self.events.append(('receive', packet.data))
+
+    def on_disconnect(self, peer):
+        del self.connections[peer]
+        self.events.append(('disconnect', peer.eventData))
+
+
+class TestCapture(unittest.TestCase):
+    def record(self):
+        peer = SimpleNamespace(
+            incomingPeerID=3,
+            address=SimpleNamespace(host='127.0.0.1', port=51234))
+        fp = BytesIO()
+        writer = capture.CaptureWriter(fp)
+        writer.write_event(make_event(capture.CONNECT, peer, 3))
+        writer.write_event(make_event(capture.RECEIVE, peer,
+                                      packet=SimpleNamespace(data=b'\x00abc')))
+        writer.write_event(make_event(capture.DISCONNECT, peer, 7))
+        fp.seek(0)
+        return list(capture.read_capture(fp))
+
+    def test_roundtrip(self):
+        records = self.record()
+        self.assertEqual([record.type for record in records], [
+            capture.CONNECT, capture.RECEIVE, capture.DISCONNECT])
+        self.assertEqual(records[0].data, ('127.0.0.1', 51234))
+        self.assertEqual(records[0].value, 3)
+        self.assertEqual(records[1].data, b'\x00abc')
+        self.assertEqual(records[2].value, 7)
+        self.assertTrue(all(record.peer_id == 3 for record in records))
+
+    def test_not_a_capture(self):
+        with self.assertRaises(ValueError):
+            list(capture.read_capture(BytesIO(b'nonsense')))
+
+    def test_replay(self):
+        protocol = RecordingProtocol()
+        replayer = capture.Replayer(protocol)
+        for record in self.record():
+            replayer.dispatch(record)
+        self.assertEqual(protocol.events, [
+            ('connect', ('127.0.0.1', 51234), 3),
+            ('receive', b'\x00abc'),
+            ('disconnect', 7)])
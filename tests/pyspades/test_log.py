@@ -0,0 +1,29 @@
+"""
+test pyspades/log.py
+"""
+from twisted.logger import LogLevel
+from twisted.trial import unittest
+
+from pyspades import log
+
+
+class TestLogger(unittest.TestCase):
+    def setUp(self):
+        self.events = []
+        self.logger = log.Logger(observer=self.events.append)
+        self.addCleanup(setattr, log.Logger, 'enabled_levels', log.LEVELS)
+
+    def test_everything_by_default(self):
+        self.logger.debug('debug')
+        self.assertEqual(len(self.events), 1)
+        self.assertTrue(self.logger.is_enabled(LogLevel.debug))
+
+    def test_set_level(self):
+        log.set_level(LogLevel.info)
+        self.logger.debug('{value}', value=1)
+        self.assertEqual(self.events, [])
+        self.assertFalse(self.logger.is_enabled(LogLevel.debug))
+        self.logger.info('info')
+        self.logger.critical('critical')
+        self.assertEqual([event['log_level'] for event in self.events],
+                         [LogLevel.info, LogLevel.critical])
@@ -0,0 +1,67 @@
+"""
+test pyspades/packet.pyx
+"""
+from types import SimpleNamespace
+
+from twisted.trial import unittest
+
+from pyspades import contained as loaders
+from pyspades import packet
+from pyspades.bytes import ByteReader, ByteWriter
+
+
+def make_packet(contained):
+    writer = ByteWriter()
+    contained.write(writer)
+    return SimpleNamespace(data=bytes(writer))
+
+
+class TestCallPacketHandler(unittest.TestCase):
+    def setUp(self):
+        self.received = []
+        self.old_handler = packet._packet_handlers.get(loaders.PositionData.id)
+        packet._packet_handlers[loaders.PositionData.id] = self.handler
+
+    def tearDown(self):
+        packet._packet_handlers[loaders.PositionData.id] = self.old_handler
+
+    def handler(self, connection, contained):
+        self.received.append((id(contained), contained.x, contained.y,
+                              contained.z))
+
+    def test_pooled_instance_reused(self):
+        position = loaders.PositionData()
+        position.set((1.0, 2.0, 3.0))
+        packet.call_packet_handler(None, make_packet(position))
+        position.set((4.0, 5.0, 6.0))
+        packet.call_packet_handler(None, make_packet(position))
+
+        self.assertEqual(self.received[0][1:], (1.0, 2.0, 3.0))
+        self.assertEqual(self.received[1][1:], (4.0, 5.0, 6.0))
+        self.assertEqual(self.received[0][0], self.received[1][0])
+
+    def test_retained_instance_not_reused(self):
+        kept = []
+
+        def handler(connection, contained):
+            kept.append(contained)
+        packet._packet_handlers[loaders.PositionData.id] = handler
+
+        position = loaders.PositionData()
+        position.set((1.0, 2.0, 3.0))
+        packet.call_packet_handler(None, make_packet(position))
+        position.set((4.0, 5.0, 6.0))
+        packet.call_packet_handler(None, make_packet(position))
+
+        self.assertIsNot(kept[0], kept[1])
+        self.assertEqual((kept[0].x, kept[0].y, kept[0].z), (1.0, 2.0, 3.0))
+        self.assertEqual((kept[1].x, kept[1].y, kept[1].z), (4.0, 5.0, 6.0))
+
+
+class TestLoadServerPacket(unittest.TestCase):
+    def test_short_world_update(self):
+        world_update = loaders.WorldUpdate()
+        world_update.items = [((1.0, 2.0, 3.0), (0.0, 1.0, 0.0))] * 2
+        contained = packet.load_server_packet(
+            ByteReader(make_packet(world_update).data))
+        self.assertEqual(contained.items, world_update.items)
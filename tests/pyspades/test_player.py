@@ -18,6 +18,7 @@ class BaseConnectionTest(unittest.TestCase):
         server.ServerProtocol._create_teams(prot)
         # Some places still use the old name
         prot.players = {}
+        prot.player_names = {}
 
         for team in (prot.team_1, prot.team_2, prot.team_spectator):
             ply = player.ServerConnection(prot, Mock())
@@ -0,0 +1,64 @@
+"""
+test pyspades/profiler.py
+"""
+from twisted.trial import unittest
+
+from pyspades import contained as loaders
+from pyspades.profiler import Histogram, TickProfiler
+
+
+class TestHistogram(unittest.TestCase):
+    def test_percentiles(self):
+        histogram = Histogram()
+        for i in range(1, 1001):
+            histogram.record(i / 1e6)
+        self.assertEqual(histogram.count, 1000)
+        self.assertAlmostEqual(histogram.max, 1e-3)
+        # values are rounded up to their bucket, 1/16 relative error at most
+        self.assertTrue(500e-6 <= histogram.percentile(0.5) <= 500e-6 * 17 / 16)
+        self.assertTrue(990e-6 <= histogram.percentile(0.99) <= 1e-3)
+        self.assertEqual(histogram.percentile(1.0), 1e-3)
+
+    def test_small_and_large_values(self):
+        histogram = Histogram()
+        histogram.record(0.0)
+        histogram.record(1e6)
+        self.assertEqual(histogram.percentile(0.5), 1e-6)
+        self.assertEqual(histogram.percentile(1.0), 1e6)
+
+    def test_empty(self):
+        self.assertEqual(Histogram().summary()['p99'], 0.0)
+
+
+class TestTickProfiler(unittest.TestCase):
+    def test_slow_tick_trace(self):
+        profiler = TickProfiler(0.010)
+        profiler.record_packet(loaders.BlockAction.id, 0.004)
+        profiler.record_packet(loaders.BlockAction.id, 0.004)
+        profiler.record_phase('world', 0.001)
+        profiler.end_tick(0.003)
+        self.assertEqual(profiler.slow_ticks, 1)
+        _, total, trace = profiler.slow_tick_traces[0]
+        self.assertAlmostEqual(total, 0.011)
+        self.assertEqual(trace[0][:2], ('BlockAction', 2))
+        self.assertEqual(trace[1][:2], ('world', 1))
+
+    def test_packets_during_tick(self):
+        profiler = TickProfiler(0.010)
+        profiler.record_packet(loaders.BlockAction.id, 0.002)
+        profiler.start_tick()
+        # handled by the enet phase of the tick, part of its time already
+        profiler.record_packet(loaders.BlockAction.id, 0.004)
+        profiler.end_tick(0.005)
+        self.assertAlmostEqual(profiler.ticks.max, 0.007, places=5)
+        self.assertEqual(profiler.slow_ticks, 0)
+        self.assertEqual(profiler.packets[loaders.BlockAction.id].count, 2)
+
+    def test_fast_tick(self):
+        profiler = TickProfiler(0.010)
+        profiler.record_packet(loaders.PositionData.id, 0.001)
+        profiler.end_tick(0.002)
+        self.assertEqual(profiler.slow_ticks, 0)
+        self.assertEqual(profiler.ticks.count, 1)
+        self.assertEqual(profiler.phases['packets'].count, 1)
+        self.assertIn('PositionData', profiler.summary()['packets'])
@@ -2,9 +2,41 @@
 test pyspades/protocol.py
 """
 
+import asyncio
+
+import enet
+import pytest
 from twisted.trial import unittest
 from pyspades import protocol
 
 class BaseConnectionTest(unittest.TestCase):
     def test_test(self):
         pass
+
+
+class IdleProtocol(protocol.BaseProtocol):
+    """a protocol whose update loop never services enet itself"""
+    async def update(self):
+        pass
+
+
+@pytest.mark.asyncio
+async def test_socket_reader_services_enet():
+    server = IdleProtocol(0, b'127.0.0.1')
+    assert server.event_driven
+    port = server.host.address.port
+
+    client = enet.Host(None, 1, 1)
+    client.compress_with_range_coder()
+    client.connect(enet.Address(b'127.0.0.1', port), 1, 0)
+    # the client needs to be serviced to send its connection request, the
+    # server is only serviced by the event loop
+    for _ in range(50):
+        client.service(0)
+        await asyncio.sleep(0.01)
+        if server.connections:
+            break
+    assert len(server.connections) == 1
+
+    server.remove_socket_reader()
+    assert not server.event_driven
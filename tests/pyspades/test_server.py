@@ -2,9 +2,40 @@
 test pyspades/server.py
 """
 
+from types import SimpleNamespace
+
 from twisted.trial import unittest
 from pyspades import server
+from pyspades.spatial import SpatialGrid
+
+
+class Entity:
+    def __init__(self, x, y, z):
+        self.x = x
+        self.y = y
+        self.z = z
+
 
 class BaseConnectionTest(unittest.TestCase):
     def test_test(self):
         pass
+
+
+class UpdateGridsTest(unittest.TestCase):
+    def test_removed_entities(self):
+        first, second = Entity(10, 10, 10), Entity(100, 100, 10)
+        protocol = SimpleNamespace(players={}, entities=[first, second],
+                                   player_grid=SpatialGrid(),
+                                   entity_grid=SpatialGrid())
+        server.ServerProtocol.update_grids(protocol)
+        self.assertEqual(set(protocol.entity_grid), {first, second})
+        protocol.entities.remove(first)
+        server.ServerProtocol.update_grids(protocol)
+        self.assertEqual(list(protocol.entity_grid), [second])
+        self.assertEqual(
+            list(protocol.entity_grid.query_radius(10, 10, 10, 5)), [])
+        # replaced by reset_tc
+        third = Entity(10, 10, 10)
+        protocol.entities = [third]
+        server.ServerProtocol.update_grids(protocol)
+        self.assertEqual(list(protocol.entity_grid), [third])
@@ -0,0 +1,64 @@
+"""
+test pyspades/spatial.py
+"""
+from twisted.trial import unittest
+
+from pyspades.common import Vertex3
+from pyspades.spatial import SpatialGrid
+
+
+class TestSpatialGrid(unittest.TestCase):
+    def setUp(self):
+        self.grid = SpatialGrid()
+        self.positions = {
+            'a': Vertex3(10, 10, 30),
+            'b': Vertex3(20, 10, 30),
+            'c': Vertex3(100, 100, 10),
+            'd': Vertex3(10, 10, 60),
+        }
+        for name, position in self.positions.items():
+            self.grid.update(name, position)
+
+    def test_query_box(self):
+        self.assertEqual(sorted(self.grid.query_box(0, 0, 0, 20, 20, 40)),
+                         ['a', 'b'])
+        self.assertEqual(sorted(self.grid.query_box(0, 0, 0, 512, 512, 63)),
+                         ['a', 'b', 'c', 'd'])
+        self.assertEqual(self.grid.query_box(200, 200, 0, 300, 300, 63), [])
+
+    def test_query_radius(self):
+        self.assertEqual(self.grid.query_radius(10, 10, 30, 5), ['a'])
+        self.assertEqual(sorted(self.grid.query_radius(15, 10, 30, 5)),
+                         ['a', 'b'])
+        self.assertEqual(self.grid.query_radius(10, 10, 45, 14), [])
+
+    def test_live_positions(self):
+        # positions within the same cell do not need an update
+        self.positions['a'].set(12, 12, 30)
+        self.assertEqual(self.grid.query_radius(12, 12, 30, 0.5), ['a'])
+
+    def test_move(self):
+        self.positions['a'].set(100, 101, 10)
+        self.grid.update('a', self.positions['a'])
+        self.assertEqual(sorted(self.grid.query_radius(100, 100, 10, 2)),
+                         ['a', 'c'])
+        self.assertEqual(self.grid.query_box(0, 0, 0, 15, 15, 40), [])
+        self.assertEqual(len(self.grid), 4)
+
+    def test_remove(self):
+        self.grid.remove('a')
+        self.grid.remove('a')
+        self.assertNotIn('a', self.grid)
+        self.assertEqual(self.grid.query_box(0, 0, 0, 15, 15, 63), ['d'])
+        self.grid.remove('d')
+        self.assertNotIn((0, 0), self.grid.cells)
+
+    def test_invalid_position(self):
+        self.grid.update('a', Vertex3(float('nan'), 0, 0))
+        self.assertNotIn('a', self.grid)
+        self.grid.update('e', Vertex3(float('inf'), 0, 0))
+        self.assertNotIn('e', self.grid)
+
+    def test_negative_coordinates(self):
+        self.grid.update('e', Vertex3(-1, -1, 0))
+        self.assertEqual(self.grid.query_box(-2, -2, -2, 0, 0, 0), ['e'])
@@ -0,0 +1,52 @@
+"""
+test pyspades/vxl.pyx
+"""
+
+from twisted.trial import unittest
+
+from pyspades.vxl import OVERVIEW_TILE_SIZE, VXLData
+
+
+class TestTileVersions(unittest.TestCase):
+    def setUp(self):
+        self.map = VXLData()
+        self.map.set_column_fast(0, 0, 10, 63, 12, 0x123456)
+
+    def get_changed(self, versions):
+        return [index for index, (old, new) in enumerate(
+            zip(versions, self.map.get_tile_versions())) if old != new]
+
+    def test_changes(self):
+        versions = self.map.get_tile_versions()
+        version = self.map.get_version()
+        self.map.build_point(OVERVIEW_TILE_SIZE, 0, 40, (255, 0, 0))
+        self.assertEqual(self.get_changed(versions), [])
+        self.map.set_point(OVERVIEW_TILE_SIZE, 0, 40, (255, 0, 0))
+        self.assertEqual(self.get_changed(versions), [1])
+        self.assertGreater(self.map.get_version(), version)
+
+        versions = self.map.get_tile_versions()
+        self.map.destroy_point(0, 0, 10)
+        self.assertEqual(self.get_changed(versions), [0])
+
+    def test_floating_blocks(self):
+        # removed by check_node() in C, in the tile below
+        self.map.set_point(0, OVERVIEW_TILE_SIZE, 20, (255, 0, 0))
+        versions = self.map.get_tile_versions()
+        self.assertEqual(self.map.check_node(0, OVERVIEW_TILE_SIZE, 20, True),
+                         1)
+        self.assertEqual(self.get_changed(versions),
+                         [512 // OVERVIEW_TILE_SIZE])
+
+    def test_update_shadows(self):
+        versions = self.map.get_tile_versions()
+        self.map.update_shadows()
+        self.assertEqual(len(self.get_changed(versions)), len(versions))
+
+    def test_overview_area(self):
+        self.map.set_point(1, 0, 5, (1, 2, 3))
+        area = self.map.get_overview_area(0, 0, 2, 1)
+        self.assertEqual(area, bytes([0x12, 0x34, 0x56, 255, 1, 2, 3, 255]))
+        self.assertEqual(self.map.get_overview(rgba=True)[:8], area)
+        with self.assertRaises(ValueError):
+            self.map.get_overview_area(511, 0, 2, 1)
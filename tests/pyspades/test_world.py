@@ -3,8 +3,11 @@ from twisted.trial import unittest
 from unittest.mock import Mock
 
 from pyspades import world
+from pyspades.common import Vertex3
+from pyspades.vxl import VXLData
 
 import colorsys
+import random
 
 class WorldTest(unittest.TestCase):
     def test_giant_cube_line(self):
@@ -27,3 +30,105 @@ class WorldTest(unittest.TestCase):
                        (18, 17, 11), (18, 17, 12), (19, 17, 12), (19, 18, 12),
                        (20, 18, 12), (20, 19, 12), (21, 19, 12)]
         self.assertEqual(line, line_should)
+
+
+class UpdateTest(unittest.TestCase):
+    def setUp(self):
+        self.world = world.World()
+        self.world.map = VXLData()
+
+    def create_character(self, z, x=256.5, y=256.5):
+        return self.world.create_object(
+            world.Character, Vertex3(x, y, z), Vertex3(1, 0, 0), Mock())
+
+    def create_grenade(self, fuse, callback=None):
+        return self.world.create_object(
+            world.Grenade, fuse, Vertex3(256.5, 256.5, 20.0), None,
+            Vertex3(0.5, 0, 0), callback)
+
+    def run_world(self, seconds):
+        for _ in range(int(seconds * 60)):
+            self.world.update(1 / 60)
+
+    def test_fall_callback(self):
+        for x in range(99, 102):
+            for y in range(99, 102):
+                self.world.map.set_point(x, y, 40, (0, 0, 0))
+        standing = self.create_character(37.0, 100.5, 100.5)
+        falling = self.create_character(2.0)
+        self.run_world(3.0)
+        standing.fall_callback.assert_not_called()
+        falling.fall_callback.assert_called_once()
+        damage, = falling.fall_callback.call_args[0]
+        self.assertGreater(damage, 0)
+
+    def test_grenade_expires(self):
+        callback = Mock()
+        grenade = self.create_grenade(0.5, callback)
+        live = self.create_grenade(10.0)
+        self.run_world(0.4)
+        callback.assert_not_called()
+        self.assertGreater(grenade.position.x, 256.5)
+        self.run_world(0.2)
+        callback.assert_called_once_with(grenade)
+        self.assertEqual(self.world.grenades, [live])
+        self.assertNotIn(grenade, self.world.objects)
+        self.assertLess(live.fuse, 10.0)
+
+    def test_delete_object(self):
+        first = self.create_character(2.0)
+        second = self.create_character(2.0)
+        grenade = self.create_grenade(10.0)
+        first.delete()
+        self.assertEqual(self.world.characters, [second])
+        self.assertEqual(self.world.objects, [second, grenade])
+        self.run_world(0.5)
+        self.assertEqual(first.position.z, 2.0)
+        self.assertGreater(second.position.z, 2.0)
+        grenade.delete()
+        self.assertEqual(self.world.grenades, [])
+
+
+class LineOfSightTest(unittest.TestCase):
+    def setUp(self):
+        self.world = world.World()
+        self.world.map = VXLData()
+        # a wall across y = 260
+        for x in range(240, 272):
+            for z in range(20, 40):
+                self.world.map.set_point(x, 260, z, (0, 0, 0))
+        rng = random.Random(0)
+        self.positions = [
+            Vertex3(rng.uniform(236, 276), rng.uniform(244, 276),
+                    rng.uniform(16, 44)) for _ in range(64)]
+
+    def test_can_see_many(self):
+        character = self.world.create_object(
+            world.Character, Vertex3(256.5, 250.5, 30), None)
+        visible, distances = self.world.can_see_many(
+            256.5, 250.5, 30, self.positions)
+        self.assertEqual(visible, [character.can_see(*position.get())
+                                   for position in self.positions])
+        self.assertIn(True, visible)
+        self.assertIn(False, visible)
+        for position, distance in zip(self.positions, distances):
+            self.assertAlmostEqual(
+                distance, (position - character.position).length(), 3)
+
+    def test_tuples(self):
+        self.assertEqual(
+            self.world.can_see_many(256.5, 250.5, 30,
+                                    [(256.5, 255.5, 30), (256.5, 265.5, 30)]),
+            ([True, False], [5.0, 15.0]))
+        self.assertEqual(self.world.can_see_many(0, 0, 0, []), ([], []))
+
+    def test_get_damages(self):
+        grenade = self.world.create_object(
+            world.Grenade, 1.0, Vertex3(256.5, 255.5, 30), None, Vertex3(),
+            None)
+        positions = self.positions + [grenade.position.copy()]
+        damages = grenade.get_damages(positions)
+        self.assertEqual(damages, [grenade.get_damage(position)
+                                   for position in positions])
+        self.assertEqual(damages[-1], 100.0)
+        self.assertIn(0.0, damages)